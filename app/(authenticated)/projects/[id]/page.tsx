@@ -1,6 +1,7 @@
 import { redirect } from 'next/navigation'
 import Link from 'next/link'
 import { createServerSupabaseClient } from '@/lib/supabase/server'
+import { api } from '@/lib/api'
 
 export default async function ProjectDetailPage({
   params,
@@ -17,18 +18,22 @@ export default async function ProjectDetailPage({
     redirect('/auth/signin')
   }
 
-  const { data: projectData, error } = await supabase
-    .from('projects')
-    .select('*')
-    .eq('id', id)
-    .eq('user_id', user.id)
-    .single()
-
-  if (error || !projectData) {
+  // The project with its notebook, files and plan status in one round trip;
+  // a 404 means the project is missing or not the user's
+  const {
+    data: { session },
+  } = await supabase.auth.getSession()
+  let workspace: Awaited<ReturnType<typeof api.projects.workspace>>
+  try {
+    workspace = await api.projects.workspace(id, ['notebook', 'files', 'agent'], session?.access_token ?? null)
+  } catch {
     redirect('/projects')
   }
 
-  const project = projectData as { id: string; title: string; description: string | null; status: string; user_id: string; created_at: string; updated_at: string | null }
+  const project = workspace.project as { id: string; title: string; description: string | null; status: string; user_id: string; created_at: string; updated_at: string | null }
+  const notebook = workspace.notebook as { updated_at: string | null } | null | undefined
+  const files = workspace.files || []
+  const agentSession = workspace.agent_session as { status: string; current_step: number } | null | undefined
 
   return (
     <div className="min-h-screen bg-black pt-16">
@@ -146,6 +151,32 @@ export default async function ProjectDetailPage({
                   </span>
                 </div>
               )}
+              <div className="flex items-center gap-4">
+                <span className="text-sm font-medium text-gray-400 w-32">Notebook</span>
+                <span className="text-sm text-gray-300">
+                  {notebook?.updated_at
+                    ? `Saved ${new Date(notebook.updated_at).toLocaleDateString('en-US', {
+                        month: 'long',
+                        day: 'numeric',
+                        year: 'numeric'
+                      })}`
+                    : 'Not started'}
+                </span>
+              </div>
+              <div className="flex items-center gap-4">
+                <span className="text-sm font-medium text-gray-400 w-32">Files</span>
+                <span className="text-sm text-gray-300">
+                  {files.length === 0 ? 'None uploaded' : `${files.length}${files.length >= 50 ? '+' : ''} uploaded`}
+                </span>
+              </div>
+              <div className="flex items-center gap-4">
+                <span className="text-sm font-medium text-gray-400 w-32">Research Plan</span>
+                <span className="text-sm text-gray-300">
+                  {agentSession
+                    ? `${agentSession.status}, step ${agentSession.current_step + 1}`
+                    : 'Not created yet'}
+                </span>
+              </div>
             </div>
           </div>
         </div>
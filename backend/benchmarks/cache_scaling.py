@@ -0,0 +1,70 @@
+"""
+Cache hit rates as the number of workers grows
+
+Simulates a load balancer spreading lookups over N workers, each with its
+own TwoLevelCache. With a shared back end (one MemoryBackend standing in for
+Redis) a value loaded by any worker serves all of them; with per-worker
+back ends each worker warms up on its own, so the miss count, i.e. the
+auth checks, ownership queries and Gemini calls made, grows with N.
+
+Run from the backend/ directory:
+
+    python -m benchmarks.cache_scaling
+    python -m benchmarks.cache_scaling --workers 1 4 16 64 --keys 2000 --lookups 50000
+"""
+import argparse
+import asyncio
+import random
+import sys
+from typing import Dict, List, Optional
+
+from services.cache import MemoryBackend, TwoLevelCache
+
+
+async def simulate(workers: int, shared: bool, keys: List[str], lookups: int, seed: int) -> Dict[str, float]:
+    backend = MemoryBackend()
+    caches = [
+        TwoLevelCache(backend if shared else MemoryBackend(), local_max_entries=len(keys) // 4)
+        for _ in range(workers)
+    ]
+    loads = 0
+
+    async def loader():
+        nonlocal loads
+        loads += 1
+        return True
+
+    rng = random.Random(seed)
+    # A few users and projects are much more active than the rest
+    weights = [1 / (rank + 1) for rank in range(len(keys))]
+    for key in rng.choices(keys, weights=weights, k=lookups):
+        await rng.choice(caches).get_or_load("sim", key, loader, ttl=3600)
+    return {"loads": loads, "hit_rate": 1 - loads / lookups}
+
+
+async def run(args: argparse.Namespace) -> None:
+    keys = [f"key-{i}" for i in range(args.keys)]
+    print(f"{'workers':>8} {'shared hit %':>13} {'shared loads':>13} {'local hit %':>12} {'local loads':>12}")
+    for workers in args.workers:
+        shared = await simulate(workers, True, keys, args.lookups, args.seed)
+        local = await simulate(workers, False, keys, args.lookups, args.seed)
+        print(f"{workers:8d} {shared['hit_rate'] * 100:12.1f}% {shared['loads']:13d} "
+              f"{local['hit_rate'] * 100:11.1f}% {local['loads']:12d}")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 8, 32])
+    parser.add_argument("--keys", type=int, default=1000, help="distinct cache keys")
+    parser.add_argument("--lookups", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=1)
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    asyncio.run(run(parse_args(argv)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
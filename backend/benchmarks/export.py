@@ -0,0 +1,218 @@
+"""
+Memory use of project export and import
+
+Boots the app against the fakes (see run.py) with a synthetic object store
+whose files are generated on the fly, so a project of any size can be
+exported without holding its files anywhere. Streams GET /export?format=zip
+straight to a temporary file, then posts that file back to
+POST /api/projects/import chunk by chunk and checks that every file arrives
+with the same size and CRC. The ASGI app is driven directly because httpx's
+ASGI transport collects whole responses in memory.
+
+Peak is the tracemalloc high-water mark of Python allocations during each
+transfer; with streaming it stays flat as the project grows.
+
+Run from the backend/ directory:
+
+    python -m benchmarks.export
+    python -m benchmarks.export --files 40 --file-mb 128     # a 5 GiB project
+
+The exit status is non-zero if either direction peaks above --max-peak-mb
+or the round trip loses data.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import sys
+import tempfile
+import time
+import tracemalloc
+import zlib
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from benchmarks.run import boot_app, seed_data
+from services.object_store import STORAGE_CHUNK_BYTES, ObjectNotFound, ObjectStore
+
+
+class SyntheticObjectStore(ObjectStore):
+    """Objects made of a repeated pseudo-random block; uploads are only checksummed"""
+
+    def __init__(self):
+        self.sizes: Dict[str, int] = {}
+        self.uploads: Dict[str, Tuple[int, int]] = {}
+
+    @staticmethod
+    def _block(path: str) -> bytes:
+        # Deterministic per path, so the round trip can be checked
+        return hashlib.sha256(path.encode()).digest() * (STORAGE_CHUNK_BYTES // 32)
+
+    def expected(self, path: str) -> Tuple[int, int]:
+        """(size, crc32) of an object"""
+        size, crc, block = self.sizes[path], 0, self._block(path)
+        for start in range(0, size, len(block)):
+            crc = zlib.crc32(block[:size - start], crc)
+        return size, crc
+
+    async def iter_object(self, path, chunk_size=STORAGE_CHUNK_BYTES):
+        if path not in self.sizes:
+            raise ObjectNotFound(path)
+        block = self._block(path)
+        remaining = self.sizes[path]
+        while remaining > 0:
+            chunk = block[:min(remaining, len(block))]
+            remaining -= len(chunk)
+            yield chunk
+
+    async def put_object(self, path, chunks, content_type=None):
+        size, crc = 0, 0
+        async for chunk in chunks:
+            size += len(chunk)
+            crc = zlib.crc32(chunk, crc)
+        self.uploads[path] = (size, crc)
+
+
+async def call_app(app, method: str, path: str, headers: Dict[str, str],
+                   body: Optional[AsyncIterator[bytes]] = None, sink=None) -> Tuple[int, bytes]:
+    """Run one request through the ASGI app, writing a 200 body to sink"""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method,
+        "scheme": "http", "path": path.split("?")[0], "raw_path": path.split("?")[0].encode(),
+        "query_string": path.partition("?")[2].encode(), "root_path": "",
+        "headers": [(name.lower().encode(), value.encode()) for name, value in headers.items()],
+        "client": ("127.0.0.1", 1), "server": ("benchmark", 80),
+    }
+    state: Dict[str, Any] = {"status": 0, "error": bytearray(), "sent": False}
+    finished = asyncio.Event()
+
+    async def receive():
+        if body is not None:
+            try:
+                return {"type": "http.request", "body": await body.__anext__(), "more_body": True}
+            except StopAsyncIteration:
+                pass
+        if not state["sent"]:
+            state["sent"] = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await finished.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            state["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            data = message.get("body", b"")
+            if state["status"] == 200 and sink is not None:
+                sink.write(data)
+            else:
+                state["error"] += data
+            if not message.get("more_body", False):
+                finished.set()
+
+    await app(scope, receive, send)
+    return state["status"], bytes(state["error"])
+
+
+async def read_file(handle, chunk_size: int = STORAGE_CHUNK_BYTES) -> AsyncIterator[bytes]:
+    while True:
+        chunk = handle.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def measured(start_time: float) -> Tuple[float, float]:
+    _, peak = tracemalloc.get_traced_memory()
+    return time.perf_counter() - start_time, peak / 1024 ** 2
+
+
+async def run(args: argparse.Namespace) -> int:
+    bench = argparse.Namespace(
+        db_latency="0", auth_latency="0", storage_latency="0", gemini_latency="0", seed=1,
+        repository="memory", users=1, projects_per_user=1, cells=args.cells, files_per_project=0,
+    )
+    app, fake, repository = boot_app(bench)
+    import main
+
+    store = SyntheticObjectStore()
+    main.object_store = store
+    (user,) = await seed_data(fake, repository, bench)
+    (project_id,) = user["projects"]
+    owner = fake.auth.tokens[user["token"]]["id"]
+    file_bytes = int(args.file_mb * 1024 ** 2)
+    for index in range(args.files):
+        path = f"{project_id}/{index}_data.bin"
+        store.sizes[path] = file_bytes
+        await repository.create_file({
+            "project_id": project_id, "user_id": owner, "name": f"data_{index}.bin",
+            "path": path, "size": file_bytes, "mime_type": "application/octet-stream",
+        })
+    total_mib = args.files * file_bytes / 1024 ** 2
+    headers = {"Authorization": f"Bearer {user['token']}"}
+    print(f"project: {args.files} files x {args.file_mb:g} MiB = {total_mib:.0f} MiB, {args.cells} cells")
+
+    failures: List[str] = []
+    with tempfile.TemporaryFile() as bundle:
+        tracemalloc.start()
+        started = time.perf_counter()
+        status, error = await call_app(app, "GET", f"/api/projects/{project_id}/export?format=zip", headers, sink=bundle)
+        export_s, export_peak = measured(started)
+        tracemalloc.stop()
+        if status != 200:
+            print(f"export failed with {status}: {error[:200]!r}")
+            return 1
+        size = bundle.tell()
+        size_mib = size / 1024 ** 2
+
+        bundle.seek(0)
+        tracemalloc.start()
+        started = time.perf_counter()
+        status, response = await call_app(
+            app, "POST", "/api/projects/import",
+            {**headers, "Content-Type": "application/zip", "Content-Length": str(size)},
+            body=read_file(bundle),
+        )
+        import_s, import_peak = measured(started)
+        tracemalloc.stop()
+        if status != 201:
+            print(f"import failed with {status}: {response[:200]!r}")
+            return 1
+
+    imported = json.loads(response)["id"]
+    rows = await repository.list_files(imported)
+    expected = sorted(store.expected(path) for path in store.sizes)
+    received = sorted(store.uploads[row["path"]] for row in rows)
+    if received != expected:
+        failures.append("imported files differ from the exported ones")
+    cells = await repository.get_notebook_cells(imported, 0, args.cells + 1)
+    if len(cells) != args.cells:
+        failures.append(f"imported {len(cells)} of {args.cells} cells")
+
+    header = f"{'transfer':10} {'MiB':>8} {'seconds':>8} {'MiB/s':>8} {'peak MiB':>9}"
+    print(header)
+    print("-" * len(header))
+    for name, seconds, peak in (("export", export_s, export_peak), ("import", import_s, import_peak)):
+        print(f"{name:10} {size_mib:8.0f} {seconds:8.2f} {size_mib / seconds:8.0f} {peak:9.1f}")
+        if peak > args.max_peak_mb:
+            failures.append(f"{name} peaked at {peak:.1f} MiB > --max-peak-mb {args.max_peak_mb:g}")
+    if failures:
+        print("\n" + "\n".join(failures))
+        return 1
+    return 0
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=8)
+    parser.add_argument("--file-mb", type=float, default=64.0, help="size of each file in MiB")
+    parser.add_argument("--cells", type=int, default=500)
+    parser.add_argument("--max-peak-mb", type=float, default=32.0)
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    return asyncio.run(run(parse_args(argv)))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,436 @@
+"""
+In-memory stand-ins for Supabase and Gemini used by the benchmarks
+
+FakeSupabase implements the subset of the supabase-py table, storage and
+auth APIs that main.py uses, with the same synchronous call shape. Every
+executed query, storage call and auth check can sleep for a sampled
+latency so the app behaves like it is talking to a remote PostgREST.
+"""
+import copy
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from services.gemini_service import GeminiService
+from services.object_store import STORAGE_CHUNK_BYTES, ObjectNotFound, ObjectStore
+from services.storage_cleanup import PROJECT_FILES_BUCKET
+
+
+class Latency:
+    """
+    A latency distribution in milliseconds, parsed from a spec string:
+
+    - "0" or "fixed:5"        constant
+    - "uniform:20,80"         uniform between the two bounds
+    - "lognormal:40,0.5"      log-normal with the given median and sigma
+    """
+
+    def __init__(self, spec: str = "0", seed: int = 0):
+        self.spec = spec
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        kind, _, args = spec.partition(":")
+        if not args:
+            kind, args = "fixed", kind
+        values = [float(value) for value in args.split(",")]
+        if kind == "fixed":
+            self._sample: Callable[[], float] = lambda: values[0]
+        elif kind == "uniform":
+            self._sample = lambda: self._random.uniform(values[0], values[1])
+        elif kind == "lognormal":
+            median, sigma = values
+            self._sample = lambda: median * self._random.lognormvariate(0, sigma)
+        else:
+            raise ValueError(f"Unknown latency distribution: {spec}")
+
+    def sample_ms(self) -> float:
+        with self._lock:
+            return self._sample()
+
+    def wait(self) -> None:
+        delay = self.sample_ms()
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+
+class FakeAPIError(Exception):
+    """Raised where PostgREST would answer with an error status"""
+
+
+class FakeResponse:
+    def __init__(self, data: Any):
+        self.data = data
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+# Defaults the real schema fills in on insert
+TABLE_DEFAULTS: Dict[str, Dict[str, Any]] = {
+    "projects": {"description": None, "quiz_responses": None, "status": "draft"},
+    "notebooks": {"cells": [], "metadata": {}},
+    "files": {"mime_type": None},
+    "agent_sessions": {
+        "steps": [],
+        "current_step": 0,
+        "status": "planning",
+        "conversation_history": [],
+        "metadata": {},
+    },
+}
+TABLES_WITH_UPDATED_AT = {"projects", "notebooks", "agent_sessions"}
+
+
+class FakeQuery:
+    """Chainable query builder mirroring postgrest-py's request builders"""
+
+    def __init__(self, db: "FakeSupabase", table: str):
+        self.db = db
+        self.table = table
+        self.operation = "select"
+        self.columns = "*"
+        self.filters: List[Callable[[Dict[str, Any]], bool]] = []
+        self.payload: Any = None
+        self.on_conflict: Optional[str] = None
+        self.mode: Optional[str] = None
+        self.ordering: List[tuple] = []
+        self.bounds: Optional[tuple] = None
+
+    # Query construction
+
+    def select(self, columns: str = "*", **kwargs) -> "FakeQuery":
+        self.columns = columns
+        return self
+
+    def insert(self, payload: Any) -> "FakeQuery":
+        self.operation, self.payload = "insert", payload
+        return self
+
+    def upsert(self, payload: Any, on_conflict: Optional[str] = None) -> "FakeQuery":
+        self.operation, self.payload, self.on_conflict = "upsert", payload, on_conflict
+        return self
+
+    def update(self, payload: Dict[str, Any]) -> "FakeQuery":
+        self.operation, self.payload = "update", payload
+        return self
+
+    def delete(self) -> "FakeQuery":
+        self.operation = "delete"
+        return self
+
+    def eq(self, column: str, value: Any) -> "FakeQuery":
+        self.filters.append(lambda row: str(row.get(column)) == str(value))
+        return self
+
+    def in_(self, column: str, values: List[Any]) -> "FakeQuery":
+        wanted = {str(value) for value in values}
+        self.filters.append(lambda row: str(row.get(column)) in wanted)
+        return self
+
+    def order(self, column: str, desc: bool = False) -> "FakeQuery":
+        self.ordering.append((column, desc))
+        return self
+
+    def range(self, start: int, end: int) -> "FakeQuery":
+        self.bounds = (start, end + 1)
+        return self
+
+    def limit(self, count: int) -> "FakeQuery":
+        self.bounds = (0, count)
+        return self
+
+    def single(self) -> "FakeQuery":
+        self.mode = "single"
+        return self
+
+    def maybe_single(self) -> "FakeQuery":
+        self.mode = "maybe_single"
+        return self
+
+    # Execution
+
+    def execute(self):
+        self.db.latency.wait()
+        with self.db.lock:
+            self.db.query_count += 1
+            rows = self.db.tables.setdefault(self.table, [])
+            result = getattr(self, f"_execute_{self.operation}")(rows)
+        result = [self._project(row) for row in result]
+        if self.mode == "maybe_single":
+            return FakeResponse(result[0]) if result else None
+        if self.mode == "single":
+            if len(result) != 1:
+                raise FakeAPIError("JSON object requested, multiple (or no) rows returned")
+            return FakeResponse(result[0])
+        return FakeResponse(result)
+
+    def _matches(self, row: Dict[str, Any]) -> bool:
+        return all(check(row) for check in self.filters)
+
+    def _new_row(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        now = _now()
+        row = {"id": str(uuid.uuid4()), "created_at": now}
+        if self.table in TABLES_WITH_UPDATED_AT:
+            row["updated_at"] = now
+        row.update(copy.deepcopy(TABLE_DEFAULTS.get(self.table, {})))
+        row.update(copy.deepcopy(payload))
+        return row
+
+    def _execute_insert(self, rows):
+        payloads = self.payload if isinstance(self.payload, list) else [self.payload]
+        created = [self._new_row(payload) for payload in payloads]
+        rows.extend(created)
+        return copy.deepcopy(created)
+
+    def _execute_upsert(self, rows):
+        key = self.on_conflict or "id"
+        for row in rows:
+            if key in self.payload and str(row.get(key)) == str(self.payload[key]):
+                row.update(copy.deepcopy(self.payload))
+                if self.table in TABLES_WITH_UPDATED_AT:
+                    row["updated_at"] = _now()
+                return [copy.deepcopy(row)]
+        return self._execute_insert(rows)
+
+    def _execute_update(self, rows):
+        updated = []
+        for row in rows:
+            if self._matches(row):
+                row.update(copy.deepcopy(self.payload))
+                if self.table in TABLES_WITH_UPDATED_AT:
+                    row["updated_at"] = _now()
+                updated.append(copy.deepcopy(row))
+        return updated
+
+    def _execute_delete(self, rows):
+        deleted = [row for row in rows if self._matches(row)]
+        rows[:] = [row for row in rows if not self._matches(row)]
+        if self.table == "projects":
+            self.db.cascade_project_delete({row["id"] for row in deleted})
+        return deleted
+
+    def _execute_select(self, rows):
+        result = [row for row in rows if self._matches(row)]
+        for column, desc in reversed(self.ordering):
+            result.sort(key=lambda row: row.get(column) or "", reverse=desc)
+        if self.bounds:
+            result = result[self.bounds[0]:self.bounds[1]]
+        return copy.deepcopy(result)
+
+    def _project(self, row: Dict[str, Any]) -> Dict[str, Any]:
+        columns = [column.strip() for column in self.columns.split(",")]
+        if "*" in columns:
+            return row
+        # Embedded resources such as "projects!inner(user_id)" only filter
+        return {column: row.get(column) for column in columns if "(" not in column}
+
+
+class FakeRpc:
+    """Database functions the repository calls through client.rpc()"""
+
+    def __init__(self, db: "FakeSupabase", name: str, params: Dict[str, Any]):
+        self.db = db
+        self.name = name
+        self.params = params
+
+    def execute(self):
+        self.db.latency.wait()
+        with self.db.lock:
+            self.db.query_count += 1
+            if self.name != "notebook_cells_page":
+                raise FakeAPIError(f"Unknown function: {self.name}")
+            offset, limit = self.params["p_offset"], self.params["p_limit"]
+            cells = next(
+                (row["cells"] for row in self.db.tables.get("notebooks", [])
+                 if str(row["project_id"]) == str(self.params["p_project_id"])),
+                [],
+            )
+            return FakeResponse([{"cell": cell} for cell in copy.deepcopy(cells[offset:offset + limit])])
+
+
+class FakeBucket:
+    def __init__(self, storage: "FakeStorage", name: str):
+        self.storage = storage
+        self.name = name
+
+    def remove(self, paths: List[str]) -> List[Dict[str, Any]]:
+        self.storage.latency.wait()
+        with self.storage.lock:
+            self.storage.call_count += 1
+            removed = [path for path in paths if self.storage.objects.pop((self.name, path), None) is not None]
+        return [{"name": path} for path in removed]
+
+    def list(self, path: Optional[str] = None, options: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        self.storage.latency.wait()
+        options = options or {}
+        limit, offset = options.get("limit", 100), options.get("offset", 0)
+        prefix = f"{path}/" if path else ""
+        with self.storage.lock:
+            self.storage.call_count += 1
+            entries: Dict[str, Dict[str, Any]] = {}
+            for (bucket, key), meta in sorted(self.storage.objects.items()):
+                if bucket != self.name or not key.startswith(prefix):
+                    continue
+                name, _, rest = key[len(prefix):].partition("/")
+                if rest:
+                    entries.setdefault(name, {"name": name, "id": None})
+                else:
+                    entries[name] = {"name": name, "id": meta["id"], "created_at": meta["created_at"]}
+        return list(entries.values())[offset:offset + limit]
+
+    def upload(self, path: str, file: bytes, file_options: Optional[Dict[str, Any]] = None):
+        self.storage.latency.wait()
+        with self.storage.lock:
+            self.storage.call_count += 1
+            self.storage.objects[(self.name, path)] = {
+                "id": str(uuid.uuid4()),
+                "created_at": _now(),
+                "data": bytes(file),
+            }
+        return {"Key": f"{self.name}/{path}"}
+
+    def download(self, path: str) -> bytes:
+        self.storage.latency.wait()
+        with self.storage.lock:
+            self.storage.call_count += 1
+            meta = self.storage.objects.get((self.name, path))
+        if meta is None:
+            raise FakeAPIError(f"Object not found: {path}")
+        return meta["data"]
+
+
+class FakeStorage:
+    def __init__(self, latency: Latency):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.objects: Dict[tuple, Dict[str, Any]] = {}
+        self.call_count = 0
+
+    def from_(self, bucket: str) -> FakeBucket:
+        return FakeBucket(self, bucket)
+
+
+class FakeObjectStore(ObjectStore):
+    """Chunked access to FakeStorage objects, standing in for SupabaseObjectStore"""
+
+    def __init__(self, storage: FakeStorage, bucket: str = PROJECT_FILES_BUCKET):
+        self.storage = storage
+        self.bucket = bucket
+
+    async def iter_object(self, path, chunk_size=STORAGE_CHUNK_BYTES):
+        self.storage.latency.wait()
+        with self.storage.lock:
+            self.storage.call_count += 1
+            meta = self.storage.objects.get((self.bucket, path))
+        if meta is None:
+            raise ObjectNotFound(path)
+        data = memoryview(meta["data"])
+        for start in range(0, len(data), chunk_size):
+            yield bytes(data[start:start + chunk_size])
+
+    async def put_object(self, path, chunks, content_type=None):
+        data = bytearray()
+        async for chunk in chunks:
+            data += chunk
+        FakeBucket(self.storage, self.bucket).upload(path, bytes(data))
+
+
+class FakeUser(dict):
+    """Supports both user["id"] and user.id, like the app code expects"""
+
+    def __getattr__(self, name: str) -> Any:
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+class FakeUserResponse:
+    def __init__(self, user: Optional[FakeUser]):
+        self.user = user
+
+
+class FakeAuth:
+    def __init__(self, latency: Latency):
+        self.latency = latency
+        self.tokens: Dict[str, FakeUser] = {}
+        self.call_count = 0
+
+    def add_user(self, token: str, user_id: Optional[str] = None) -> FakeUser:
+        user = FakeUser(id=user_id or str(uuid.uuid4()), email=f"{token}@example.com")
+        self.tokens[token] = user
+        return user
+
+    def get_user(self, token: str) -> FakeUserResponse:
+        self.latency.wait()
+        self.call_count += 1
+        return FakeUserResponse(self.tokens.get(token))
+
+
+class FakeSupabase:
+    """In-memory stand-in for supabase.Client"""
+
+    def __init__(self, db_latency: str = "0", auth_latency: str = "0", storage_latency: str = "0", seed: int = 0):
+        self.latency = Latency(db_latency, seed)
+        self.lock = threading.Lock()
+        self.tables: Dict[str, List[Dict[str, Any]]] = {}
+        self.query_count = 0
+        self.auth = FakeAuth(Latency(auth_latency, seed + 1))
+        self.storage = FakeStorage(Latency(storage_latency, seed + 2))
+
+    def table(self, name: str) -> FakeQuery:
+        return FakeQuery(self, name)
+
+    def rpc(self, name: str, params: Dict[str, Any]) -> "FakeRpc":
+        return FakeRpc(self, name, params)
+
+    def cascade_project_delete(self, project_ids: set) -> None:
+        """Mirror ON DELETE CASCADE from projects to child tables"""
+        for table in ("notebooks", "files", "agent_sessions"):
+            rows = self.tables.get(table, [])
+            rows[:] = [row for row in rows if row.get("project_id") not in project_ids]
+
+
+FAKE_PLAN = """[
+  {"step_number": 1, "title": "Load and inspect data", "description": "Load the spectra", "code": "import pandas as pd\\ndf = pd.read_csv('data.csv')", "dependencies": []},
+  {"step_number": 2, "title": "Baseline correction", "description": "Remove the baseline", "code": "import numpy as np\\nfrom scipy.signal import savgol_filter", "dependencies": [1]},
+  {"step_number": 3, "title": "Peak fitting", "description": "Fit peaks", "code": "from scipy.optimize import curve_fit", "dependencies": [2]},
+  {"step_number": 4, "title": "Plot results", "description": "Visualize the fit", "code": "import matplotlib.pyplot as plt", "dependencies": [3]}
+]"""
+
+
+class FakeGenerateResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeGenerativeModel:
+    """Deterministic replacement for genai.GenerativeModel"""
+
+    def __init__(self, latency: Latency):
+        self.latency = latency
+        self.call_count = 0
+
+    def generate_content(self, prompt: str, **kwargs) -> FakeGenerateResponse:
+        self.latency.wait()
+        self.call_count += 1
+        if "Return ONLY a valid JSON array" in prompt:
+            return FakeGenerateResponse(FAKE_PLAN)
+        if "Return ONLY the Python code" in prompt:
+            return FakeGenerateResponse("import pandas as pd\nprint('step')")
+        return FakeGenerateResponse(
+            "Normalize each spectrum by dividing by its maximum intensity, "
+            "then compare peak positions across samples."
+        )
+
+
+class FakeGeminiService(GeminiService):
+    """GeminiService with real prompt building and parsing but a fake model"""
+
+    def __init__(self, latency: str = "0", seed: int = 0, cache=None):
+        self.cache = cache
+        self._model = FakeGenerativeModel(Latency(latency, seed))
@@ -0,0 +1,217 @@
+"""
+Goodput under overload, with and without admission control
+
+Boots the app against the fakes (see run.py), then offers open-loop Poisson
+traffic for --duration seconds at each --loads multiple of the agent chat
+capacity, alongside a steady stream of cheap GET /api/projects calls. Every
+request carries X-Request-Timeout-Ms; a response only counts towards goodput
+if it succeeded within that deadline. A client that gives up does not stop
+the server, so abandoned requests keep running, as they would behind a real
+connection.
+
+Chat capacity is --gemini-workers threads each spending --gemini-ms per
+Gemini call. Each mode runs in its own process, since the middleware reads
+its settings at import:
+
+    python -m benchmarks.overload
+    python -m benchmarks.overload --loads 1 3 --duration 20 --admission on
+
+The exit status is non-zero if, with admission control on, chat goodput at
+any load falls below --min-goodput of what the server can deliver.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from benchmarks.run import auth, boot_app, percentile, seed_data
+
+QUESTIONS = (
+    "How do I normalize sample {n}?",
+    "Which baseline method suits run {n}?",
+    "Why does the fit diverge for batch {n}?",
+    "Can step {n} use a log scale?",
+)
+
+
+def capacity(args: argparse.Namespace) -> float:
+    """Chat requests per second the fake Gemini can serve"""
+    return args.gemini_workers * 1000 / args.gemini_ms
+
+
+async def run_load(client: httpx.AsyncClient, users: List[Dict[str, Any]], args: argparse.Namespace, load: float) -> Dict[str, Any]:
+    rng = random.Random(args.seed + int(load * 100))
+    deadline = args.deadline_ms / 1000
+    outcomes: Dict[str, List[Tuple[int, float]]] = {"chat": [], "crud": []}
+    tasks: List[asyncio.Task] = []
+    in_server: List[asyncio.Future] = []
+
+    async def call(kind: str, method: str, url: str, user: Dict[str, Any], body: Optional[dict]) -> None:
+        start = time.perf_counter()
+        headers = auth(user, **{"X-Request-Timeout-Ms": str(args.deadline_ms)})
+        # The server keeps working on a request after its client gives up
+        request = asyncio.ensure_future(client.request(method, url, json=body, headers=headers))
+        in_server.append(request)
+        try:
+            response = await asyncio.wait_for(asyncio.shield(request), deadline)
+            status = response.status_code
+        except asyncio.TimeoutError:
+            status = 0
+        outcomes[kind].append((status, time.perf_counter() - start))
+
+    def chat(n: int):
+        user = users[n % len(users)]
+        # Unique per level so no answer comes from a cache
+        question = rng.choice(QUESTIONS).format(n=f"{load:g}-{n}")
+        return "POST", f"/api/projects/{rng.choice(user['projects'])}/agent/chat", user, {"message": question}
+
+    def crud(n: int):
+        return "GET", "/api/projects", users[n % len(users)], None
+
+    start = time.perf_counter()
+
+    async def arrivals(kind: str, rate: float, make) -> None:
+        at = 0.0
+        n = 0
+        while True:
+            at += rng.expovariate(rate)
+            if at >= args.duration:
+                return
+            await asyncio.sleep(max(0.0, start + at - time.perf_counter()))
+            tasks.append(asyncio.ensure_future(call(kind, *make(n))))
+            n += 1
+
+    await asyncio.gather(
+        arrivals("chat", load * capacity(args), chat),
+        arrivals("crud", args.crud_rps, crud),
+    )
+    if tasks:
+        await asyncio.wait(tasks)
+    # Until the last client got its answer or gave up
+    elapsed = time.perf_counter() - start
+    # Drain abandoned requests so they do not spill into the next level
+    drain_start = time.perf_counter()
+    if in_server:
+        await asyncio.wait(in_server)
+    drain_s = time.perf_counter() - drain_start
+
+    result: Dict[str, Any] = {"load": load, "drain_s": round(drain_s, 2)}
+    for kind, samples in outcomes.items():
+        good = sorted(seconds for status, seconds in samples if 200 <= status < 300 and seconds <= deadline)
+        result[kind] = {
+            "offered": len(samples),
+            "goodput_rps": round(len(good) / elapsed, 2),
+            "shed": sum(1 for status, _ in samples if status == 503),
+            "timed_out": sum(1 for status, _ in samples if status in (0, 504)),
+            "errors": sum(1 for status, _ in samples if status >= 400 and status not in (503, 504)),
+            "p50_ms": round(percentile(good, 0.50) * 1000, 1),
+            "p95_ms": round(percentile(good, 0.95) * 1000, 1),
+        }
+    return result
+
+
+async def run_mode(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    # Gemini calls run in the default executor; size it so capacity is known
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=args.gemini_workers))
+    bench = argparse.Namespace(
+        db_latency=args.db_latency, auth_latency="fixed:2", storage_latency="fixed:2",
+        gemini_latency=f"fixed:{args.gemini_ms}", seed=args.seed, repository="supabase",
+        users=args.users, projects_per_user=4, cells=5, files_per_project=0,
+    )
+    app, fake, repository = boot_app(bench)
+    users = await seed_data(fake, repository, bench)
+    results = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        for load in args.loads:
+            results.append(await run_load(client, users, args, load))
+    return results
+
+
+def print_report(mode: str, results: List[Dict[str, Any]], chat_capacity: float) -> None:
+    print(f"\nadmission control {mode} (chat capacity {chat_capacity:.1f} req/s)")
+    header = (f"{'load':>5} {'class':6} {'offered':>8} {'goodput/s':>10} {'shed':>6} "
+              f"{'timeout':>8} {'errors':>7} {'p50 ms':>8} {'p95 ms':>8}")
+    print(header)
+    print("-" * len(header))
+    for result in results:
+        for kind in ("chat", "crud"):
+            stats = result[kind]
+            print(f"{result['load']:>4}x {kind:6} {stats['offered']:8d} {stats['goodput_rps']:10.2f} "
+                  f"{stats['shed']:6d} {stats['timed_out']:8d} {stats['errors']:7d} "
+                  f"{stats['p50_ms']:8.1f} {stats['p95_ms']:8.1f}")
+        if result["drain_s"] >= 1:
+            print(f"       abandoned work took {result['drain_s']}s more to drain")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--admission", choices=("on", "off", "both"), default="both")
+    parser.add_argument("--loads", type=float, nargs="+", default=[1.0, 2.0, 3.0],
+                        help="offered chat load as multiples of capacity")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of traffic per load")
+    parser.add_argument("--deadline-ms", type=int, default=3000, help="client deadline sent with every request")
+    parser.add_argument("--gemini-ms", type=float, default=500.0, help="fixed latency of each Gemini call")
+    parser.add_argument("--gemini-workers", type=int, default=8, help="threads available for Gemini calls")
+    parser.add_argument("--crud-rps", type=float, default=40.0, help="steady rate of GET /api/projects")
+    parser.add_argument("--db-latency", default="fixed:2", help="per-query latency spec (ms)")
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--min-goodput", type=float, default=0.7,
+                        help="required chat goodput with admission on, as a fraction of min(offered, capacity)")
+    parser.add_argument("--json", action="store_true", help="print results as JSON (used between processes)")
+    return parser.parse_args(argv)
+
+
+def run_child(mode: str, argv: List[str]) -> List[Dict[str, Any]]:
+    env = {**os.environ, "ADMISSION_CONTROL_ENABLED": "true" if mode == "on" else "false"}
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.overload", *argv, "--admission", mode, "--json"],
+        env=env, check=True, capture_output=True, text=True,
+    ).stdout
+    # The app may print warnings; the results are the last line
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    argv = list(sys.argv[1:] if argv is None else argv)
+    args = parse_args(argv)
+    if args.json:
+        os.environ.setdefault("SEMANTIC_CACHE_ENABLED", "false")
+        print(json.dumps(asyncio.run(run_mode(args))))
+        return 0
+
+    # Strip --admission; each child gets its own
+    passthrough = [value for i, value in enumerate(argv)
+                   if value != "--admission" and (i == 0 or argv[i - 1] != "--admission")]
+    modes = ("off", "on") if args.admission == "both" else (args.admission,)
+    chat_capacity = capacity(args)
+    failures = []
+    for mode in modes:
+        results = run_child(mode, passthrough)
+        print_report(mode, results, chat_capacity)
+        if mode != "on":
+            continue
+        for result in results:
+            expected = min(result["load"], 1.0) * chat_capacity
+            if result["chat"]["goodput_rps"] < args.min_goodput * expected:
+                failures.append(
+                    f"chat goodput {result['chat']['goodput_rps']} req/s at {result['load']}x "
+                    f"< {args.min_goodput:.0%} of {expected:.1f} req/s"
+                )
+    if failures:
+        print("\n" + "\n".join(failures))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,410 @@
+"""
+Offline load test for the LabMind API
+
+Boots the FastAPI app in-process against FakeSupabase and FakeGeminiService
+(see fakes.py; --repository memory keeps table data in InMemoryRepository
+instead), seeds users and projects, then drives a deterministic mix of
+realistic workloads through httpx's ASGI transport and reports throughput
+and p50/p95/p99 latency per endpoint.
+
+Run from the backend/ directory:
+
+    python -m benchmarks.run
+    python -m benchmarks.run --db-latency lognormal:15,0.4 --gemini-latency uniform:800,2500
+    python -m benchmarks.run --repository memory
+    python -m benchmarks.run --save-baseline benchmarks/baseline.json
+    python -m benchmarks.run --baseline benchmarks/baseline.json --max-regression 0.25
+
+Each statistic is the median over --repeat runs (default 5, each in a fresh
+interpreter), so one noisy run does not decide the comparison. With
+--baseline the exit status is non-zero if any endpoint's p95 grew or its
+throughput fell by more than --max-regression, or if requests failed.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from benchmarks.fakes import FakeGeminiService, FakeObjectStore, FakeSupabase
+from services.repository import InMemoryRepository, Repository, SupabaseRepository
+
+# Weighted workload mix; each entry is one user-visible action
+DEFAULT_MIX = {
+    "dashboard": 30,
+    "notebook_autosave": 30,
+    "agent_poll": 25,
+    "chat_burst": 10,
+    "analyze_storm": 5,
+}
+
+QUIZ_RESPONSES = {
+    "field": "Chemistry",
+    "question": "How do peak positions shift with temperature?",
+    "dataType": "Spectroscopy",
+    "dataFormat": "CSV",
+    "outcomes": "Peak positions and widths",
+    "constraints": "",
+}
+
+
+def boot_app(args: argparse.Namespace):
+    """Import main with fake clients swapped in"""
+    # main.py refuses to import without Supabase settings; the values are
+    # never used because the client is replaced below
+    os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+    # supabase-py only checks that the key is shaped like a JWT
+    os.environ.setdefault("SUPABASE_SERVICE_ROLE_KEY", "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoic2VydmljZV9yb2xlIn0.benchmark")
+    os.environ.setdefault("GEMINI_API_KEY", "benchmark-gemini-key")
+
+    import main
+
+    fake = FakeSupabase(
+        db_latency=args.db_latency,
+        auth_latency=args.auth_latency,
+        storage_latency=args.storage_latency,
+        seed=args.seed,
+    )
+    main.supabase = fake
+    main.object_store = FakeObjectStore(fake.storage)
+    if args.repository == "memory":
+        main.repository = InMemoryRepository()
+    else:
+        main.repository = SupabaseRepository(fake)
+    main.gemini_service = FakeGeminiService(latency=args.gemini_latency, seed=args.seed, cache=main.cache)
+    return main.app, fake, main.repository
+
+
+async def seed_data(fake: FakeSupabase, repository: Repository, args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """Create users, each with projects, notebooks, files and agent sessions"""
+    rng = random.Random(args.seed)
+    users = []
+    for u in range(args.users):
+        token = f"bench-user-{u}"
+        user = fake.auth.add_user(token)
+        projects = []
+        for p in range(args.projects_per_user):
+            project = await repository.create_project({
+                "user_id": user["id"],
+                "title": f"Project {u}-{p}",
+                "description": "Benchmark project",
+                "quiz_responses": QUIZ_RESPONSES,
+                "status": "active",
+            })
+            cells = [
+                {
+                    "id": f"cell-{c}",
+                    "type": "code",
+                    "source": f"import numpy as np\nx = np.linspace(0, {c}, 1000)\nprint(x.mean())",
+                    "outputs": [{"type": "text", "text": "0.5" * rng.randint(1, 40)}],
+                }
+                for c in range(args.cells)
+            ]
+            await repository.create_notebook({"project_id": project["id"], "cells": cells})
+            for f in range(args.files_per_project):
+                path = f"{project['id']}/{f}_data.csv"
+                file_row = {
+                    "project_id": project["id"],
+                    "user_id": user["id"],
+                    "name": f"data_{f}.csv",
+                    "path": path,
+                    "size": 1024,
+                    "mime_type": "text/csv",
+                }
+                await repository.create_file(file_row)
+                fake.storage.from_("project-files").upload(path, b"x,y\n1,2\n")
+            await repository.upsert_agent_session({
+                "project_id": project["id"],
+                "steps": json.loads(FakeGeminiService().model.generate_content(
+                    "Return ONLY a valid JSON array"
+                ).text),
+                "conversation_history": [],
+            })
+            projects.append(project["id"])
+        users.append({"token": token, "projects": projects, "etags": {}})
+    # Seeding should not count towards the measured run
+    fake.query_count = 0
+    return users
+
+
+class Recorder:
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        # 412s from concurrent autosaves of one notebook are expected
+        self.conflicts: Dict[str, int] = defaultdict(int)
+
+    async def call(self, client: httpx.AsyncClient, label: str, method: str, url: str, **kwargs) -> httpx.Response:
+        start = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        self.samples[label].append(time.perf_counter() - start)
+        if response.status_code == 412:
+            self.conflicts[label] += 1
+        elif response.status_code >= 400:
+            self.errors[label] += 1
+        return response
+
+
+def auth(user: Dict[str, Any], **extra: str) -> Dict[str, str]:
+    return {"Authorization": f"Bearer {user['token']}", **extra}
+
+
+async def dashboard(client, recorder, user, rng):
+    await recorder.call(client, "GET /api/projects", "GET", "/api/projects", headers=auth(user))
+    project_id = rng.choice(user["projects"])
+    await recorder.call(
+        client, "GET /api/projects/{id}/workspace", "GET",
+        f"/api/projects/{project_id}/workspace", headers=auth(user),
+    )
+
+
+async def notebook_autosave(client, recorder, user, rng):
+    project_id = rng.choice(user["projects"])
+    response = await recorder.call(
+        client, "GET /api/projects/{id}/notebook", "GET",
+        f"/api/projects/{project_id}/notebook", headers=auth(user),
+    )
+    if response.status_code != 200:
+        return
+    cells = response.json()["cells"]
+    if cells:
+        cells[rng.randrange(len(cells))]["source"] += f"\n# edit {rng.random():.6f}"
+    await recorder.call(
+        client, "PUT /api/projects/{id}/notebook", "PUT",
+        f"/api/projects/{project_id}/notebook",
+        json={"cells": cells},
+        headers=auth(user, **{"If-Match": response.headers.get("etag", "*")}),
+    )
+
+
+async def agent_poll(client, recorder, user, rng):
+    project_id = rng.choice(user["projects"])
+    etag = user["etags"].get(project_id)
+    headers = auth(user, **({"If-None-Match": etag} if etag else {}))
+    response = await recorder.call(
+        client, "GET /api/projects/{id}/agent", "GET",
+        f"/api/projects/{project_id}/agent", headers=headers,
+    )
+    if response.headers.get("etag"):
+        user["etags"][project_id] = response.headers["etag"]
+
+
+async def chat_burst(client, recorder, user, rng):
+    project_id = rng.choice(user["projects"])
+    for question in ("How do I normalize this spectrum?", "Which baseline method?", "How do I fit the peaks?"):
+        await recorder.call(
+            client, "POST /api/projects/{id}/agent/chat", "POST",
+            f"/api/projects/{project_id}/agent/chat",
+            json={"message": question}, headers=auth(user),
+        )
+
+
+async def analyze_storm(client, recorder, user, rng):
+    project_id = rng.choice(user["projects"])
+    await recorder.call(
+        client, "POST /api/projects/{id}/agent/analyze", "POST",
+        f"/api/projects/{project_id}/agent/analyze", headers=auth(user),
+    )
+
+
+WORKLOADS = {
+    "dashboard": dashboard,
+    "notebook_autosave": notebook_autosave,
+    "agent_poll": agent_poll,
+    "chat_burst": chat_burst,
+    "analyze_storm": analyze_storm,
+}
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(recorder: Recorder, elapsed: float) -> Dict[str, Any]:
+    endpoints = {}
+    for label, samples in sorted(recorder.samples.items()):
+        ordered = sorted(samples)
+        endpoints[label] = {
+            "count": len(ordered),
+            "errors": recorder.errors.get(label, 0),
+            "conflicts": recorder.conflicts.get(label, 0),
+            "throughput_rps": round(len(ordered) / elapsed, 2),
+            "p50_ms": round(percentile(ordered, 0.50) * 1000, 3),
+            "p95_ms": round(percentile(ordered, 0.95) * 1000, 3),
+            "p99_ms": round(percentile(ordered, 0.99) * 1000, 3),
+        }
+    total = sum(len(samples) for samples in recorder.samples.values())
+    return {
+        "elapsed_s": round(elapsed, 3),
+        "requests": total,
+        "throughput_rps": round(total / elapsed, 2),
+        "endpoints": endpoints,
+    }
+
+
+async def run_benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    app, fake, repository = boot_app(args)
+    users = await seed_data(fake, repository, args)
+    mix = {name: weight for name, weight in DEFAULT_MIX.items() if not args.only or name in args.only}
+    rng = random.Random(args.seed)
+    plan = rng.choices(list(mix), weights=list(mix.values()), k=args.operations)
+    queue: "asyncio.Queue[tuple]" = asyncio.Queue()
+    for i, workload in enumerate(plan):
+        queue.put_nowait((workload, users[i % len(users)], random.Random(args.seed + i)))
+
+    recorder = Recorder()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        async def worker():
+            while True:
+                try:
+                    workload, user, op_rng = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                await WORKLOADS[workload](client, recorder, user, op_rng)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - start
+
+    result = summarize(recorder, elapsed)
+    result["supabase_queries"] = fake.query_count
+    result["config"] = {
+        key: getattr(args, key)
+        for key in (
+            "operations", "concurrency", "users", "projects_per_user", "cells",
+            "files_per_project", "db_latency", "auth_latency", "storage_latency",
+            "gemini_latency", "seed", "repository",
+        )
+    }
+    return result
+
+
+def run_once(args: argparse.Namespace) -> Dict[str, Any]:
+    return asyncio.run(run_benchmark(args))
+
+
+def median_result(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Combine repeated runs, taking the median of every statistic"""
+    def median(values: List[float]) -> float:
+        ordered = sorted(values)
+        return ordered[len(ordered) // 2]
+
+    combined = dict(results[-1])
+    for key in ("elapsed_s", "requests", "throughput_rps", "supabase_queries"):
+        combined[key] = median([result[key] for result in results])
+    combined["endpoints"] = {
+        label: {
+            stat: median([result["endpoints"][label][stat] for result in results if label in result["endpoints"]])
+            for stat in stats
+        }
+        for label, stats in results[-1]["endpoints"].items()
+    }
+    return combined
+
+
+def print_report(result: Dict[str, Any]) -> None:
+    print(f"{result['requests']} requests in {result['elapsed_s']}s "
+          f"({result['throughput_rps']} req/s, {result['supabase_queries']} Supabase queries)")
+    header = f"{'endpoint':45} {'count':>6} {'err':>4} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"
+    print(header)
+    print("-" * len(header))
+    for label, stats in result["endpoints"].items():
+        print(f"{label:45} {stats['count']:6d} {stats['errors']:4d} {stats['throughput_rps']:8.1f} "
+              f"{stats['p50_ms']:9.2f} {stats['p95_ms']:9.2f} {stats['p99_ms']:9.2f}")
+
+
+def compare_to_baseline(result: Dict[str, Any], baseline: Dict[str, Any], tolerance: float, slack_ms: float) -> List[str]:
+    """Return a description of every regression beyond the tolerance"""
+    problems = []
+    if baseline.get("config") != result.get("config"):
+        problems.append("benchmark configuration differs from the baseline; re-record it")
+    for label, expected in baseline["endpoints"].items():
+        actual = result["endpoints"].get(label)
+        if actual is None:
+            problems.append(f"{label}: missing from this run")
+            continue
+        if actual["errors"]:
+            problems.append(f"{label}: {actual['errors']} failed requests")
+        p95_limit = expected["p95_ms"] * (1 + tolerance) + slack_ms
+        if actual["p95_ms"] > p95_limit:
+            problems.append(f"{label}: p95 {actual['p95_ms']}ms > {p95_limit:.2f}ms (baseline {expected['p95_ms']}ms)")
+        throughput_floor = expected["throughput_rps"] * (1 - tolerance)
+        if actual["throughput_rps"] < throughput_floor:
+            problems.append(
+                f"{label}: {actual['throughput_rps']} req/s < {throughput_floor:.2f} req/s "
+                f"(baseline {expected['throughput_rps']} req/s)"
+            )
+    return problems
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--operations", type=int, default=400, help="workload actions to run")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent simulated clients")
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--projects-per-user", type=int, default=4)
+    parser.add_argument("--cells", type=int, default=40, help="cells per notebook")
+    parser.add_argument("--files-per-project", type=int, default=10)
+    parser.add_argument("--db-latency", default="fixed:2", help="per-query latency spec (ms)")
+    parser.add_argument("--auth-latency", default="fixed:2", help="per auth.get_user latency spec (ms)")
+    parser.add_argument("--storage-latency", default="fixed:2", help="per storage call latency spec (ms)")
+    parser.add_argument("--gemini-latency", default="fixed:20", help="per Gemini call latency spec (ms)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--repository", choices=("supabase", "memory"), default="supabase",
+                        help="data backend: FakeSupabase through SupabaseRepository, or InMemoryRepository")
+    parser.add_argument("--repeat", type=int, default=5, help="runs to take the median of")
+    parser.add_argument("--only", nargs="*", choices=sorted(DEFAULT_MIX), help="run only these workloads")
+    parser.add_argument("--json", metavar="PATH", help="write the full result as JSON")
+    parser.add_argument("--save-baseline", metavar="PATH", help="store this run as the baseline")
+    parser.add_argument("--baseline", metavar="PATH", help="fail if this run regresses against a baseline")
+    parser.add_argument("--max-regression", type=float, default=0.25, help="allowed relative regression")
+    parser.add_argument("--slack-ms", type=float, default=1.0, help="absolute p95 slack for very fast endpoints")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    if args.repeat > 1:
+        # Caches and fakes are module state, so every run gets a fresh interpreter
+        results = []
+        for _ in range(args.repeat):
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+                results.append(pool.submit(run_once, args).result())
+        result = median_result(results)
+    else:
+        result = run_once(args)
+    print_report(result)
+
+    for path in (args.json, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(result, f, indent=2, sort_keys=True)
+                f.write("\n")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        problems = compare_to_baseline(result, baseline, args.max_regression, args.slack_ms)
+        if problems:
+            print("\nRegressions against baseline:")
+            for problem in problems:
+                print(f"  - {problem}")
+            return 1
+        print("\nNo regressions against baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+"""
+Search latency over a large synthetic workspace
+
+Indexes --users x --projects-per-user notebooks of --cells cells each in the
+in-memory SearchIndex (what REPOSITORY_BACKEND=memory searches), then times
+queries and single-cell notebook re-saves. The Postgres search_workspace
+function is not exercised here; run EXPLAIN ANALYZE against a real database
+for that.
+
+Run from the backend/ directory:
+
+    python -m benchmarks.search
+    python -m benchmarks.search --users 20 --projects-per-user 250 --cells 30
+
+The exit status is non-zero if the p95 query latency exceeds --max-p95-ms.
+"""
+import argparse
+import random
+import statistics
+import sys
+import time
+from typing import List, Optional
+
+from services.search import SearchIndex, notebook_documents, project_documents, step_documents
+
+TOPICS = (
+    "spectrum", "baseline", "peak", "fft", "wavelet", "regression", "anova", "pca", "cluster",
+    "normalize", "calibration", "absorbance", "fluorescence", "kinetics", "titration", "western",
+    "qpcr", "microscopy", "segmentation", "histogram", "outlier", "bootstrap", "smoothing",
+)
+CODE_LINES = (
+    "df = pd.read_csv('{topic}.csv')",
+    "spectrum = np.fft.fft(df['{topic}'].values)",
+    "popt, pcov = curve_fit(gaussian, x, y, p0=[1, {n}, 2])",
+    "model = sklearn.decomposition.PCA(n_components={n}).fit(X)",
+    "plt.plot(x, {topic}_smoothed, label='{topic}')",
+    "result = scipy.stats.ttest_ind(control, treated)",
+)
+QUERIES = ("fft", "curve_fit", "baseline correction", "pca components", "wavelet -fft", "kinetics titration")
+
+
+def make_cell(rng: random.Random, position: int) -> dict:
+    topic = rng.choice(TOPICS)
+    if rng.random() < 0.3:
+        words = " ".join(rng.choice(TOPICS) for _ in range(12))
+        return {"id": str(position), "type": "markdown", "content": f"## {topic.title()}\n{words}"}
+    lines = [rng.choice(CODE_LINES).format(topic=topic, n=rng.randint(1, 9)) for _ in range(rng.randint(3, 8))]
+    return {"id": str(position), "type": "code", "content": "\n".join(lines)}
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run(args: argparse.Namespace) -> int:
+    rng = random.Random(args.seed)
+    index = SearchIndex()
+    notebooks = []
+    start = time.perf_counter()
+    for user in range(args.users):
+        user_id = f"user-{user}"
+        for number in range(args.projects_per_user):
+            project_id = f"{user_id}-project-{number}"
+            topic = rng.choice(TOPICS)
+            index.sync(project_id, user_id, "project", project_documents(
+                {"title": f"{topic.title()} study {number}", "description": f"Analysis of {topic} data"}
+            ))
+            cells = [make_cell(rng, position) for position in range(args.cells)]
+            index.sync(project_id, user_id, "cell", notebook_documents(cells))
+            index.sync(project_id, user_id, "step", step_documents(
+                [{"title": f"Step {i}", "description": rng.choice(TOPICS), "code": ""} for i in range(5)]
+            ))
+            notebooks.append((project_id, user_id, cells))
+    build_s = time.perf_counter() - start
+    print(f"indexed {len(notebooks)} notebooks, {len(index)} documents in {build_s:.2f}s")
+
+    latencies = []
+    for _ in range(args.queries):
+        user_id = f"user-{rng.randrange(args.users)}"
+        query = rng.choice(QUERIES)
+        start = time.perf_counter()
+        index.search(user_id, query, limit=20, offset=0)
+        latencies.append((time.perf_counter() - start) * 1000)
+    p50, p95 = statistics.median(latencies), percentile(latencies, 0.95)
+    print(f"search: p50 {p50:.2f}ms  p95 {p95:.2f}ms  max {max(latencies):.2f}ms ({args.queries} queries)")
+
+    resaves = []
+    for _ in range(200):
+        project_id, user_id, cells = rng.choice(notebooks)
+        cells[rng.randrange(len(cells))] = make_cell(rng, rng.randrange(args.cells))
+        start = time.perf_counter()
+        index.sync(project_id, user_id, "cell", notebook_documents(cells))
+        resaves.append((time.perf_counter() - start) * 1000)
+    print(f"notebook re-save (one cell changed): p50 {statistics.median(resaves):.2f}ms")
+
+    if p95 > args.max_p95_ms:
+        print(f"\nsearch p95 {p95:.2f}ms > budget {args.max_p95_ms}ms")
+        return 1
+    return 0
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--projects-per-user", type=int, default=300)
+    parser.add_argument("--cells", type=int, default=20, help="cells per notebook")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--max-p95-ms", type=float, default=50.0)
+    parser.add_argument("--seed", type=int, default=1)
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    return run(parse_args(argv))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
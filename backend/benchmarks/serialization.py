@@ -0,0 +1,168 @@
+"""
+Per-response CPU and allocations of the JSON response paths
+
+Builds a synthetic notebook row and encodes it the ways the API can:
+FastAPI's response_model path (validate, dump to Python, json.dumps), the
+pydantic model_dump_json path conditional GETs used before, and the trusted
+row path with orjson, the stdlib fallback and chunked streaming. Then times
+gzip and brotli (when installed) on the encoded body. CPU is process time
+per response; peak is the largest tracemalloc allocation high-water mark
+while encoding one response.
+
+Run from the backend/ directory:
+
+    python -m benchmarks.serialization
+    python -m benchmarks.serialization --cells 2000 --output-kb 4
+
+The exit status is non-zero if the trusted orjson path is not at least
+--min-speedup times faster than the response_model path.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+import tracemalloc
+from typing import Callable, List, Optional
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from services import compression, serialization
+
+# main refuses to import without Supabase settings; they are never used here
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_SERVICE_ROLE_KEY", "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoic2VydmljZV9yb2xlIn0.benchmark")
+
+from main import NotebookResponse  # noqa: E402
+
+
+def make_notebook(cells: int, output_kb: float, seed: int) -> dict:
+    rng = random.Random(seed)
+    return {
+        "id": "7d9f2a4e-5b1c-4e8a-9c3d-2f6b8e1a0c55",
+        "project_id": "0b8e3f61-2c4d-4a9b-8e7f-6d5c4b3a2918",
+        "cells": [
+            {
+                "id": f"cell-{c}",
+                "type": "code" if c % 4 else "markdown",
+                "content": f"import numpy as np\nx = np.linspace(0, {c}, 1000)\nprint(x.mean(), x.std())",
+                "outputs": [{"type": "text", "text": " ".join(
+                    f"{rng.random():.6f}" for _ in range(int(output_kb * 1024 / 9))
+                )}],
+                "executionCount": c,
+            }
+            for c in range(cells)
+        ],
+        "metadata": {"kernel": "pyodide", "package_manifest": {"packages": ["numpy", "scipy"]}},
+        "created_at": "2026-10-19T07:58:28.858125+00:00",
+        "updated_at": "2026-10-19T08:12:03.114201+00:00",
+    }
+
+
+def measure(encode: Callable[[], int], iterations: int):
+    """(CPU microseconds per call, peak KiB allocated during one call, output bytes)"""
+    size = encode()
+    start = time.process_time()
+    for _ in range(iterations):
+        encode()
+    cpu_us = (time.process_time() - start) / iterations * 1e6
+    tracemalloc.start()
+    encode()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return cpu_us, peak / 1024, size
+
+
+def run(args: argparse.Namespace) -> int:
+    row = make_notebook(args.cells, args.output_kb, args.seed)
+    field = create_response_field(name="response", type_=NotebookResponse)
+    loop = asyncio.new_event_loop()
+
+    def response_model_path() -> bytes:
+        content = loop.run_until_complete(serialize_response(field=field, response_content=row))
+        return JSONResponse(content).body
+
+    def pydantic_json() -> bytes:
+        return NotebookResponse.model_validate(row).model_dump_json().encode("utf-8")
+
+    def trusted_orjson() -> bytes:
+        return serialization.row_body(NotebookResponse, row)
+
+    def trusted_stdlib() -> bytes:
+        saved, serialization.orjson = serialization.orjson, None
+        try:
+            return serialization.row_body(NotebookResponse, row)
+        finally:
+            serialization.orjson = saved
+
+    def trusted_streamed() -> int:
+        # Pieces are sent as they are made, so only one is alive at a time
+        return sum(len(piece) for piece in serialization.iter_row_body(NotebookResponse, row))
+
+    expected = pydantic_json()
+    assert trusted_orjson() == expected and trusted_stdlib() == expected
+    assert b"".join(serialization.iter_row_body(NotebookResponse, row)) == expected
+
+    paths = [
+        ("response_model (FastAPI default)", response_model_path),
+        ("pydantic model_dump_json", pydantic_json),
+        ("trusted row, orjson" if serialization.orjson else "trusted row (orjson missing)", trusted_orjson),
+        ("trusted row, stdlib json", trusted_stdlib),
+        ("trusted row, streamed", trusted_streamed),
+    ]
+    print(f"notebook: {args.cells} cells, {len(expected) / 1024:.0f} KiB of JSON")
+    header = f"{'path':36} {'cpu us':>10} {'peak KiB':>10} {'bytes':>10}"
+    print(header)
+    print("-" * len(header))
+    results = {}
+    for name, encode in paths:
+        sized = encode if encode is trusted_streamed else (lambda encode=encode: len(encode()))
+        cpu_us, peak_kib, size = measure(sized, args.iterations)
+        results[name] = cpu_us
+        print(f"{name:36} {cpu_us:10.0f} {peak_kib:10.0f} {size:10d}")
+
+    print()
+    header = f"{'compression':36} {'cpu us':>10} {'ratio':>10} {'bytes':>10}"
+    print(header)
+    print("-" * len(header))
+    codecs = [(f"gzip level {level}", "gzip", level) for level in sorted({1, compression.GZIP_LEVEL, 6, 9})]
+    if compression.brotli is not None:
+        codecs.append((f"brotli quality {compression.BROTLI_QUALITY}", "br", None))
+    for name, encoding, level in codecs:
+        saved = compression.GZIP_LEVEL
+        if level is not None:
+            compression.GZIP_LEVEL = level
+        try:
+            cpu_us, _, size = measure(lambda: len(compression.compress(expected, encoding)), args.iterations)
+        finally:
+            compression.GZIP_LEVEL = saved
+        print(f"{name:36} {cpu_us:10.0f} {len(expected) / size:10.1f} {size:10d}")
+    loop.close()
+
+    speedup = results[paths[0][0]] / results[paths[2][0]]
+    print(f"\ntrusted orjson path is {speedup:.1f}x faster than response_model")
+    if speedup < args.min_speedup:
+        print(f"speedup below --min-speedup {args.min_speedup}")
+        return 1
+    return 0
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cells", type=int, default=400, help="cells in the notebook")
+    parser.add_argument("--output-kb", type=float, default=2.0, help="text output per cell")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--min-speedup", type=float, default=2.0)
+    parser.add_argument("--seed", type=int, default=1)
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    return run(parse_args(argv))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
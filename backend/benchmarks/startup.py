@@ -0,0 +1,193 @@
+"""
+Cold start benchmark for the LabMind API
+
+Measures, each in a fresh interpreter:
+
+- how long `import main` takes (python -X importtime), and which heavy
+  packages it pulled in;
+- how long a new `uvicorn server:app` worker takes from spawn until /health
+  answers, and until /ready reports main loaded and its clients warm.
+
+Run from the backend/ directory:
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --runs 10 --skip-serve
+
+The exit status is non-zero if importing main loads one of the deferred
+packages (the Gemini SDK, supabase, asyncpg) or a median exceeds its
+--max-*-ms budget.
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+# Packages that must only be imported on first use or by the warm-up
+DEFERRED_MODULES = ("google.generativeai", "supabase", "asyncpg")
+
+PROBE = (
+    "import json, sys, main; "
+    "print(json.dumps([name for name in {deferred!r} if name in sys.modules]))"
+)
+
+
+def child_env() -> Dict[str, str]:
+    env = dict(os.environ)
+    # main.py refuses to import without Supabase settings; the client is
+    # never used because nothing is requested beyond /health and /ready
+    env.setdefault("SUPABASE_URL", "http://localhost:54321")
+    env.setdefault("SUPABASE_SERVICE_ROLE_KEY", "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoic2VydmljZV9yb2xlIn0.benchmark")
+    env.setdefault("GEMINI_API_KEY", "benchmark-gemini-key")
+    return env
+
+
+def parse_importtime(stderr: str) -> Dict[str, int]:
+    """Cumulative import time in microseconds per top-level-ish module"""
+    cumulative = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        if cumulative_us.strip().isdigit():
+            cumulative[name.strip()] = int(cumulative_us)
+    return cumulative
+
+
+def measure_import(env: Dict[str, str]) -> Dict[str, Any]:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE.format(deferred=DEFERRED_MODULES)],
+        capture_output=True, text=True, env=env, check=True,
+    )
+    cumulative = parse_importtime(result.stderr)
+    heaviest = sorted(
+        ((name, us) for name, us in cumulative.items() if name != "main"),
+        key=lambda item: item[1], reverse=True,
+    )[:8]
+    return {
+        "import_ms": cumulative["main"] / 1000,
+        "loaded_deferred": json.loads(result.stdout.strip().splitlines()[-1]),
+        "heaviest": [(name, round(us / 1000, 1)) for name, us in heaviest],
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(client: httpx.Client, url: str, start: float, timeout: float, want: int = 200) -> Optional[float]:
+    while time.perf_counter() - start < timeout:
+        try:
+            if client.get(url).status_code == want:
+                return (time.perf_counter() - start) * 1000
+        except httpx.TransportError:
+            pass
+        time.sleep(0.005)
+    return None
+
+
+def measure_serve(env: Dict[str, str], timeout: float) -> Dict[str, Optional[float]]:
+    port = free_port()
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--port", str(port), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=1.0) as client:
+            health_ms = wait_for(client, "/health", start, timeout)
+            ready_ms = wait_for(client, "/ready", start, timeout) if health_ms else None
+        return {"health_ms": health_ms, "ready_ms": ready_ms}
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+
+def median(values: List[Optional[float]]) -> Optional[float]:
+    values = [value for value in values if value is not None]
+    return round(statistics.median(values), 1) if values else None
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    env = child_env()
+    # The first import compiles bytecode; do not count it
+    measure_import(env)
+    imports = [measure_import(env) for _ in range(args.runs)]
+    result: Dict[str, Any] = {
+        "runs": args.runs,
+        "import_ms": median([run["import_ms"] for run in imports]),
+        "loaded_deferred": sorted({name for run in imports for name in run["loaded_deferred"]}),
+        "heaviest": imports[-1]["heaviest"],
+    }
+    if not args.skip_serve:
+        serves = [measure_serve(env, args.timeout) for _ in range(args.runs)]
+        result["health_ms"] = median([serve["health_ms"] for serve in serves])
+        result["ready_ms"] = median([serve["ready_ms"] for serve in serves])
+    return result
+
+
+def check(result: Dict[str, Any], args: argparse.Namespace) -> List[str]:
+    problems = []
+    for name in result["loaded_deferred"]:
+        problems.append(f"importing main loaded {name}; import it on first use instead")
+    budgets = (("import_ms", args.max_import_ms), ("health_ms", args.max_serve_ms))
+    for key, budget in budgets:
+        if key not in result:
+            continue
+        if result[key] is None:
+            problems.append(f"{key}: worker never became healthy")
+        elif result[key] > budget:
+            problems.append(f"{key}: median {result[key]}ms > budget {budget}ms")
+    return problems
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per measurement")
+    parser.add_argument("--skip-serve", action="store_true", help="only measure `import main`")
+    parser.add_argument("--timeout", type=float, default=30.0, help="seconds to wait for a worker")
+    parser.add_argument("--max-import-ms", type=float, default=1500.0)
+    parser.add_argument(
+        "--max-serve-ms", "--max-health-ms", dest="max_serve_ms", type=float, default=1000.0,
+        help="budget for spawn -> /health",
+    )
+    parser.add_argument("--json", metavar="PATH", help="write the result as JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    result = run(args)
+
+    print(f"import main: {result['import_ms']}ms (median of {result['runs']})")
+    for name, ms in result["heaviest"]:
+        print(f"  {name:40} {ms:8.1f}ms")
+    if "health_ms" in result:
+        for key, label in (("health_ms", "/health"), ("ready_ms", "/ready")):
+            value = "never" if result[key] is None else f"{result[key]}ms"
+            print(f"spawn -> {label:8} {value}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+    problems = check(result, args)
+    if problems:
+        print("\nStartup problems:")
+        for problem in problems:
+            print(f"  - {problem}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
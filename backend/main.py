@@ -1,22 +1,245 @@
-from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File
+from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Header, Query, Response, Request, WebSocket, WebSocketDisconnect, BackgroundTasks
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel, EmailStr
-from typing import Optional, List
+from typing import Any, Dict, Optional, List, TYPE_CHECKING
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
 import os
-from supabase import create_client, Client
+import asyncio
+import base64
+import hashlib
+import json
+import threading
+import time
 from datetime import datetime
 import uuid
+from services import batch
+from services.admission import (
+    AdmissionMiddleware,
+    DeadlineExceeded,
+    extend_deadline_for,
+    within_deadline,
+    without_deadline,
+)
+from services.cache import create_cache
+from services.compression import CompressionMiddleware
+from services.export import (
+    EXPORT_FORMATS,
+    EXPORT_MEDIA_TYPES,
+    IMPORT_MAX_BYTES,
+    InvalidUpload,
+    UploadTooLarge,
+    export_filename,
+    import_contents,
+    iter_bundle,
+    iter_cells,
+    iter_html,
+    iter_ipynb,
+    notebook_metadata,
+    read_upload,
+    spool_upload,
+)
+from services.http_cache import ResponseCache, etag_matches, make_etag
+from services.instrumentation import (
+    METRICS_ENABLED,
+    InstrumentationMiddleware,
+    record_cache,
+    render_metrics,
+    span,
+)
+from services.object_store import ObjectStore, SupabaseObjectStore
+from services.realtime import ChangeHub, encode_sse, listener_from_env
+from services.repository import Repository, create_repository
+from services.package_manifest import build_manifest, cell_sources, merge_manifests, step_sources
+from services.plan_templates import create_plan_template_library
+from services.search import SEARCH_KINDS
+from services.semantic_cache import create_semantic_cache, plan_scope
+from services.serialization import FastJSONResponse, iter_row_body, row_body, rows_body, streamed_field, trusted_row
+from services.storage_cleanup import (
+    purge_project_objects,
+    remove_objects,
+    sweep_orphaned_objects,
+)
 
-# Import Gemini service
+if TYPE_CHECKING:
+    from supabase import Client
+
+# Two-level cache (per-process LRU in front of a shared tier) for verified
+# tokens, ownership checks and Gemini answers; CACHE_BACKEND=redis shares it
+# across workers and nodes
+cache = create_cache()
+AUTH_CACHE_NAMESPACE = "auth"
+AUTH_CACHE_TTL_SECONDS = float(os.getenv("AUTH_CACHE_TTL_SECONDS", "60"))
+OWNER_CACHE_NAMESPACE = "project_owner"
+OWNER_CACHE_TTL_SECONDS = float(os.getenv("OWNER_CACHE_TTL_SECONDS", "300"))
+
+# Agent chat answers reused for similar questions about the same plan step;
+# persisted to SEMANTIC_CACHE_PATH (if set) across restarts
+semantic_cache = create_semantic_cache()
+SEMANTIC_CACHE_PATH = os.getenv("SEMANTIC_CACHE_PATH")
+SEMANTIC_CACHE_SAVE_SECONDS = float(os.getenv("SEMANTIC_CACHE_SAVE_SECONDS", "300"))
+
+# Plans generated for earlier projects of the same archetype, served as
+# instant drafts; persisted to PLAN_TEMPLATES_PATH (if set) across restarts
+plan_templates = create_plan_template_library()
+PLAN_TEMPLATES_PATH = os.getenv("PLAN_TEMPLATES_PATH")
+PLAN_TEMPLATES_SAVE_SECONDS = float(os.getenv("PLAN_TEMPLATES_SAVE_SECONDS", "300"))
+# Background Gemini refinements of template drafts, by project
+plan_refinements: Dict[str, asyncio.Task] = {}
+
+# Import Gemini service; constructing it is cheap, the Gemini SDK itself is
+# imported on first use (or by the background warm-up)
 try:
     from services.gemini_service import GeminiService
-    gemini_service = GeminiService()
+    gemini_service = GeminiService(cache=cache)
 except Exception as e:
     print(f"Warning: Could not initialize GeminiService: {e}")
     gemini_service = None
 
-app = FastAPI(title="LabMind API", version="0.1.0")
+# Supabase settings are checked at import, but the client (and the supabase
+# package) is only created on first use so a new worker answers /health
+# straight away
+supabase_url = os.getenv("SUPABASE_URL")
+supabase_key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")  # Use service role key for backend
+
+if not supabase_url or not supabase_key:
+    raise ValueError("SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY must be set")
+
+supabase: Optional["Client"] = None
+repository: Optional[Repository] = None
+object_store: Optional[ObjectStore] = None
+_client_lock = threading.Lock()
+clients_ready = asyncio.Event()
+
+
+def get_supabase() -> "Client":
+    """Return the Supabase client, creating it on first use"""
+    global supabase
+    if supabase is None:
+        with _client_lock:
+            if supabase is None:
+                from supabase import create_client
+
+                supabase = create_client(supabase_url, supabase_key)
+    return supabase
+
+
+def get_repository() -> Repository:
+    """
+    Return the table repository, creating it on first use.
+
+    REPOSITORY_BACKEND picks Supabase (default), direct Postgres or in-memory
+    storage. Auth and storage always go through the Supabase client.
+    """
+    global repository
+    if repository is None:
+        with _client_lock:
+            if repository is None:
+                repository = create_repository(get_supabase)
+    return repository
+
+
+def get_object_store() -> ObjectStore:
+    """Return the client that streams project-files objects, creating it on first use"""
+    global object_store
+    if object_store is None:
+        with _client_lock:
+            if object_store is None:
+                object_store = SupabaseObjectStore(supabase_url, supabase_key)
+    return object_store
+
+
+async def warm_up_clients():
+    """Build clients in the background after the worker starts serving"""
+    try:
+        await cache.start()
+        await asyncio.to_thread(get_supabase)
+        await get_repository().connect()
+        if gemini_service:
+            await asyncio.to_thread(gemini_service.warm_up)
+        if change_listener:
+            try:
+                await change_listener.start()
+            except Exception as e:
+                print(f"Warning: Could not start change listener: {e}")
+        for name, store, path, _ in snapshots():
+            try:
+                await asyncio.to_thread(store.load, path)
+            except Exception as e:
+                print(f"Warning: Could not load {name} snapshot: {e}")
+    except Exception as e:
+        print(f"Warning: Client warm-up failed: {e}")
+    finally:
+        clients_ready.set()
+
+
+def snapshots() -> list:
+    """(name, store, path, save interval) of the in-process stores persisted to files"""
+    stores = [
+        ("semantic cache", semantic_cache, SEMANTIC_CACHE_PATH, SEMANTIC_CACHE_SAVE_SECONDS),
+        ("plan template", plan_templates, PLAN_TEMPLATES_PATH, PLAN_TEMPLATES_SAVE_SECONDS),
+    ]
+    return [snapshot for snapshot in stores if snapshot[1] is not None and snapshot[2]]
+
+
+async def save_snapshot(name: str, store, path: str):
+    """Snapshot a store if it changed since the last save"""
+    if not store.dirty:
+        return
+    try:
+        await asyncio.to_thread(store.save, path)
+    except Exception as e:
+        print(f"Warning: Could not save {name} snapshot: {e}")
+
+
+async def run_snapshot_saver(name: str, store, path: str, interval: float):
+    """Periodically snapshot a store"""
+    while True:
+        await asyncio.sleep(interval)
+        await save_snapshot(name, store, path)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start background work without holding up the first request"""
+    background = [asyncio.create_task(warm_up_clients())]
+    interval = os.getenv("STORAGE_SWEEP_INTERVAL_SECONDS")
+    if interval:
+        background.append(asyncio.create_task(run_storage_sweeper(float(interval))))
+    for name, store, path, save_interval in snapshots():
+        if save_interval > 0:
+            background.append(asyncio.create_task(run_snapshot_saver(name, store, path, save_interval)))
+    try:
+        yield
+    finally:
+        for task in [*background, *plan_refinements.values()]:
+            task.cancel()
+        if change_listener:
+            await change_listener.stop()
+        if repository is not None:
+            await get_repository().close()
+        if object_store is not None:
+            await object_store.close()
+        # Stops the shared tier's invalidation listener and its connection
+        await cache.close()
+        for name, store, path, _ in snapshots():
+            await save_snapshot(name, store, path)
+
+
+app = FastAPI(
+    title="LabMind API", version="0.1.0", lifespan=lifespan, default_response_class=FastJSONResponse
+)
+
+# gzip/brotli for large responses; innermost, so Server-Timing totals
+# include compression
+app.add_middleware(CompressionMiddleware)
+
+# Per-class concurrency limits with deadline-aware queueing; added first so
+# it runs inside CORS and instrumentation and rejections are still visible
+# to browsers and metrics
+app.add_middleware(AdmissionMiddleware)
 
 # CORS middleware
 app.add_middleware(
@@ -25,19 +248,44 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Server-Timing", "Retry-After"],
 )
 
-# Supabase client
-supabase_url = os.getenv("SUPABASE_URL")
-supabase_key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")  # Use service role key for backend
-
-if not supabase_url or not supabase_key:
-    raise ValueError("SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY must be set")
-
-supabase: Client = create_client(supabase_url, supabase_key)
+# Per-phase timings (Server-Timing header, /metrics); a no-op unless
+# METRICS_ENABLED=true
+app.add_middleware(InstrumentationMiddleware)
 
 # Security
 security = HTTPBearer()
+# (token, user) verified by POST /api/batch; its sub-requests skip verification
+_batch_user: ContextVar[Optional[tuple]] = ContextVar("batch_user", default=None)
+BATCH_MAX_OPERATIONS = int(os.getenv("BATCH_MAX_OPERATIONS", "50"))
+
+# Serialized GET bodies keyed on ETag, so repeat reads of an unchanged row
+# skip serialization entirely
+response_cache = ResponseCache(
+    max_entries=int(os.getenv("RESPONSE_CACHE_ENTRIES", "512"))
+)
+
+
+def token_cache_ttl(token: str) -> float:
+    """Cache a verified token for AUTH_CACHE_TTL_SECONDS, but never past its exp"""
+    try:
+        payload = token.split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        return min(AUTH_CACHE_TTL_SECONDS, float(claims["exp"]) - time.time())
+    except Exception:
+        return AUTH_CACHE_TTL_SECONDS
+
+
+async def verify_token(token: str) -> Optional[dict]:
+    """Ask Supabase who a token belongs to"""
+    response = await asyncio.to_thread(get_supabase().auth.get_user, token)
+    user = response.user if response else None
+    if not user:
+        return None
+    # gotrue returns a pydantic model; handlers index the user like a dict
+    return user.model_dump(mode="json") if hasattr(user, "model_dump") else dict(user)
 
 
 async def get_current_user(
@@ -46,14 +294,26 @@ async def get_current_user(
     """Verify JWT token and return user"""
     try:
         token = credentials.credentials
-        # Verify token with Supabase
-        response = supabase.auth.get_user(token)
-        if not response.user:
+        batch_user = _batch_user.get()
+        if batch_user and batch_user[0] == token:
+            return batch_user[1]
+        # Verify token with Supabase; workers share verified tokens, keyed by
+        # hash so raw tokens never reach the shared cache
+        with span("auth"):
+            user = await within_deadline(cache.get_or_load(
+                AUTH_CACHE_NAMESPACE,
+                hashlib.sha256(token.encode("utf-8")).hexdigest(),
+                lambda: verify_token(token),
+                ttl=token_cache_ttl(token),
+            ))
+        if not user:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid authentication credentials",
             )
-        return response.user
+        return user
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -61,6 +321,170 @@ async def get_current_user(
         )
 
 
+async def load_project_owner(project_id: str) -> Optional[str]:
+    project = await get_repository().get_project_by_id(project_id)
+    return project["user_id"] if project else None
+
+
+async def require_project(project_id: str, user_id: str, columns=("id",)) -> dict:
+    """Load a project owned by the user, or raise 404"""
+    if tuple(columns) == ("id",):
+        # Plain ownership checks use the cached owner; deleting the project
+        # invalidates it
+        owner = await cache.get_or_load(
+            OWNER_CACHE_NAMESPACE, project_id, lambda: load_project_owner(project_id), ttl=OWNER_CACHE_TTL_SECONDS
+        )
+        project = {"id": project_id} if owner == user_id else None
+    else:
+        project = await get_repository().get_project(project_id, user_id, columns=columns)
+    if not project:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Project not found"
+        )
+    return project
+
+
+def etag_headers(etag: str) -> dict:
+    # no-cache lets browsers keep the body but revalidate with If-None-Match
+    return {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=etag_headers(etag))
+
+
+def precondition_failed() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_412_PRECONDITION_FAILED,
+        detail="Resource has been modified since it was fetched",
+    )
+
+
+async def conditional_row_response(
+    if_none_match: Optional[str], model, load, not_found: str
+) -> Response:
+    """
+    Serve a row with an ETag derived from (id, updated_at).
+
+    load(columns) fetches the row; columns=None means the whole row. When
+    the client sends If-None-Match, only id/updated_at are loaded first; a
+    match returns 304 and a cached body skips the full fetch. Otherwise the
+    full row is loaded and its body is cached, unless it is large enough to
+    be streamed.
+    """
+    if if_none_match:
+        version = await load(("id", "updated_at"))
+        if not version:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=not_found)
+        etag = make_etag(version["id"], version["updated_at"])
+        if etag_matches(if_none_match, etag):
+            record_cache("etag", True)
+            return not_modified(etag)
+        record_cache("etag", False)
+        body = response_cache.get(etag)
+        record_cache("response", body is not None)
+        if body is not None:
+            return Response(content=body, media_type="application/json", headers=etag_headers(etag))
+
+    row = await load(None)
+    if not row:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=not_found)
+    etag = make_etag(row["id"], row["updated_at"])
+    if streamed_field(trusted_row(model, row)):
+        # Too big to hold as one body, and to cache
+        return StreamingResponse(
+            iter_row_body(model, row), media_type="application/json", headers=etag_headers(etag)
+        )
+    body = row_body(model, row)
+    response_cache.put(etag, body)
+    return Response(content=body, media_type="application/json", headers=etag_headers(etag))
+
+
+def row_response(model, row: dict, status_code: int = status.HTTP_200_OK, etag: bool = False) -> Response:
+    """
+    Serve a row from our own tables without revalidating it against the
+    response model, optionally with its ETag
+    """
+    headers = {"ETag": make_etag(row["id"], row["updated_at"])} if etag else None
+    if streamed_field(trusted_row(model, row)):
+        return StreamingResponse(
+            iter_row_body(model, row), status_code=status_code, media_type="application/json", headers=headers
+        )
+    return Response(content=row_body(model, row), status_code=status_code, media_type="application/json", headers=headers)
+
+
+def check_if_match(current: Optional[dict], if_match: str, not_found: str) -> str:
+    """
+    Check If-Match against the current (id, updated_at) of a row and return
+    the updated_at to pin the write to, so a concurrent write between the
+    check and the update is still detected (compare-and-set).
+    """
+    if not current:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=not_found)
+    current_etag = make_etag(current["id"], current["updated_at"])
+    if not etag_matches(if_match, current_etag, weak=False):
+        raise precondition_failed()
+    return current["updated_at"]
+
+
+async def load_change_row(project_id: str, table: str) -> Optional[dict]:
+    """Load the current state of a realtime table for a project"""
+    if table == "projects":
+        project = await get_repository().get_project_by_id(project_id)
+        if project is None:
+            # Also catches deletes made directly through Supabase
+            await cache.invalidate(OWNER_CACHE_NAMESPACE, project_id)
+        return project
+    if table == "notebooks":
+        return await get_repository().get_notebook(project_id)
+    if table == "agent_sessions":
+        return await get_repository().get_agent_session(project_id)
+    # File lists are sent as ids; clients refetch the page they show
+    files = await get_repository().list_files(project_id, columns=("id",))
+    return {"file_ids": [row["id"] for row in files]}
+
+
+# Realtime change fan-out; write paths publish into it. Other workers' writes
+# arrive through Postgres NOTIFY (REALTIME_SOURCE=postgres) or the Redis
+# cache's pub/sub (CACHE_BACKEND=redis); with neither, run a single worker or
+# live clients miss writes handled by the others
+change_hub = ChangeHub(
+    load_change_row,
+    coalesce_window=float(os.getenv("REALTIME_COALESCE_SECONDS", "0.1")),
+)
+change_listener = listener_from_env(change_hub, cache)
+
+
+async def run_storage_sweeper(interval: float):
+    """Periodically purge storage objects left behind by deleted projects and files"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            stats = await sweep_orphaned_objects(
+                get_supabase(),
+                get_repository(),
+                deep=os.getenv("STORAGE_SWEEP_DEEP", "false").lower() == "true",
+            )
+            if stats["orphaned_objects"]:
+                print(f"Storage sweep removed {stats['orphaned_objects']} orphaned objects")
+        except Exception as e:
+            print(f"Warning: Storage sweep failed: {e}")
+
+
+async def authorize_project_stream(project_id: str, token: Optional[str]) -> bool:
+    """Authenticate a streaming client by token and check project ownership"""
+    if not token:
+        return False
+    try:
+        user = await get_current_user(
+            HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+        )
+        await require_project(project_id, user["id"])
+        return True
+    except Exception:
+        return False
+
+
 # Pydantic models
 class ProjectCreate(BaseModel):
     title: str
@@ -116,6 +540,15 @@ class FileResponse(BaseModel):
     created_at: str
 
 
+class FileBulkDeleteRequest(BaseModel):
+    file_ids: List[str]
+
+
+class FileBulkDeleteResponse(BaseModel):
+    deleted: List[str]
+    not_found: List[str]
+
+
 class AgentStep(BaseModel):
     step_number: int
     title: str
@@ -156,25 +589,125 @@ class AgentChatResponse(BaseModel):
     response: str
 
 
+class NotebookSummary(BaseModel):
+    id: str
+    project_id: str
+    metadata: Optional[dict]
+    created_at: str
+    updated_at: str
+
+
+class AgentSessionSummary(BaseModel):
+    id: str
+    project_id: str
+    current_step: int
+    status: str
+    metadata: Optional[dict]
+    created_at: str
+    updated_at: str
+
+
+class WorkspaceResponse(BaseModel):
+    project: ProjectResponse
+    notebook: Optional[NotebookSummary] = None
+    files: Optional[List[FileResponse]] = None
+    agent_session: Optional[AgentSessionSummary] = None
+
+
+WORKSPACE_SECTIONS = {"notebook", "files", "agent"}
+
+
+class SearchResult(BaseModel):
+    project_id: str
+    project_title: str
+    kind: str
+    ref: str
+    title: str
+    title_highlight: str
+    snippet: str
+    rank: float
+
+
+class SearchResponse(BaseModel):
+    query: str
+    total: int
+    limit: int
+    offset: int
+    results: List[SearchResult]
+
+
+SEARCH_MAX_QUERY_LENGTH = 256
+
+
+class BatchOperation(BaseModel):
+    id: Optional[str] = None
+    method: str
+    path: str
+    body: Optional[Any] = None
+    headers: Optional[Dict[str, str]] = None
+    depends_on: Optional[List[str]] = None
+
+
+class BatchRequest(BaseModel):
+    operations: List[BatchOperation]
+    atomic: bool = False
+
+
+class BatchResult(BaseModel):
+    id: str
+    status: int
+    body: Optional[Any] = None
+    etag: Optional[str] = None
+    # Set on applied writes of an atomic batch that failed later
+    reverted: Optional[bool] = None
+    revert_status: Optional[int] = None
+
+
+class BatchResponse(BaseModel):
+    results: List[BatchResult]
+    committed: bool
+    rolled_back: Optional[bool] = None
+
+
+class PackageManifestResponse(BaseModel):
+    packages: List[str]
+    imports: List[str]
+    files: List[str]
+    sources: dict
+
+
 # Health check
 @app.get("/health")
 async def health_check():
     return {"status": "ok"}
 
 
+@app.get("/ready")
+async def readiness_check(response: Response):
+    """503 until the background client warm-up has finished"""
+    if not clients_ready.is_set():
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+        return {"status": "starting"}
+    return {"status": "ready"}
+
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def metrics():
+    """Prometheus exposition of request, phase, token and cache metrics"""
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Metrics are disabled")
+    return render_metrics()
+
+
 # Projects endpoints
 @app.get("/api/projects", response_model=List[ProjectResponse])
 async def list_projects(current_user: dict = Depends(get_current_user)):
     """List all projects for the current user"""
     try:
-        response = (
-            supabase.table("projects")
-            .select("*")
-            .eq("user_id", current_user["id"])
-            .order("created_at", desc=True)
-            .execute()
-        )
-        return response.data
+        projects = await get_repository().list_projects(current_user["id"])
+        return Response(content=rows_body(ProjectResponse, projects), media_type="application/json")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -195,13 +728,13 @@ async def create_project(
             "quiz_responses": project.quiz_responses,
             "status": project.status,
         }
-        response = supabase.table("projects").insert(project_data).execute()
-        if not response.data:
+        created = await get_repository().create_project(project_data)
+        if not created:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Failed to create project",
             )
-        return response.data[0]
+        return row_response(ProjectResponse, created, status_code=status.HTTP_201_CREATED)
     except HTTPException:
         raise
     except Exception as e:
@@ -213,23 +746,18 @@ async def create_project(
 
 @app.get("/api/projects/{project_id}", response_model=ProjectResponse)
 async def get_project(
-    project_id: str, current_user: dict = Depends(get_current_user)
+    project_id: str,
+    if_none_match: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user),
 ):
     """Get a specific project"""
     try:
-        response = (
-            supabase.table("projects")
-            .select("*")
-            .eq("id", project_id)
-            .eq("user_id", current_user["id"])
-            .single()
-            .execute()
-        )
-        if not response.data:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND, detail="Project not found"
-            )
-        return response.data
+        return await conditional_row_response(
+            if_none_match,
+            ProjectResponse,
+            lambda columns: get_repository().get_project(project_id, current_user["id"], columns=columns),
+            not_found="Project not found",
+        )
     except HTTPException:
         raise
     except Exception as e:
@@ -243,38 +771,32 @@ async def get_project(
 async def update_project(
     project_id: str,
     project_update: ProjectUpdate,
+    if_match: Optional[str] = Header(None),
     current_user: dict = Depends(get_current_user),
 ):
     """Update a project"""
     try:
         # Verify ownership
-        existing = (
-            supabase.table("projects")
-            .select("*")
-            .eq("id", project_id)
-            .eq("user_id", current_user["id"])
-            .single()
-            .execute()
-        )
-        if not existing.data:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND, detail="Project not found"
-            )
+        existing = await require_project(
+            project_id, current_user["id"], columns=("id", "updated_at")
+        )
 
         # Update only provided fields
         update_data = project_update.dict(exclude_unset=True)
-        response = (
-            supabase.table("projects")
-            .update(update_data)
-            .eq("id", project_id)
-            .eq("user_id", current_user["id"])
-            .execute()
-        )
-        if not response.data:
+        expected_updated_at = None
+        if if_match:
+            expected_updated_at = check_if_match(existing, if_match, "Project not found")
+        updated = await get_repository().update_project(
+            project_id, current_user["id"], update_data, expected_updated_at
+        )
+        if not updated:
+            if if_match:
+                raise precondition_failed()
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST, detail="Failed to update project"
             )
-        return response.data[0]
+        change_hub.publish(project_id, "projects", updated)
+        return row_response(ProjectResponse, updated, etag=True)
     except HTTPException:
         raise
     except Exception as e:
@@ -286,20 +808,22 @@ async def update_project(
 
 @app.delete("/api/projects/{project_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_project(
-    project_id: str, current_user: dict = Depends(get_current_user)
+    project_id: str,
+    background_tasks: BackgroundTasks,
+    current_user: dict = Depends(get_current_user),
 ):
     """Delete a project"""
     try:
-        # Verify ownership and delete
-        response = (
-            supabase.table("projects")
-            .delete()
-            .eq("id", project_id)
-            .eq("user_id", current_user["id"])
-            .execute()
-        )
-        # Supabase delete returns empty array on success
+        # Verify ownership and delete; False means the project did not exist
+        # or belongs to someone else, so its folder is left alone
+        if await get_repository().delete_project(project_id, current_user["id"]):
+            await cache.invalidate(OWNER_CACHE_NAMESPACE, project_id)
+            # The cascade removes the files rows but not the stored objects
+            background_tasks.add_task(purge_project_objects, get_supabase(), project_id)
+            change_hub.publish(project_id, "projects", None)
         return None
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -307,40 +831,240 @@ async def delete_project(
         )
 
 
-# Notebook endpoints
-@app.get("/api/projects/{project_id}/notebook", response_model=NotebookResponse)
-async def get_notebook(
-    project_id: str, current_user: dict = Depends(get_current_user)
+@app.get(
+    "/api/projects/{project_id}/workspace",
+    response_model=WorkspaceResponse,
+    response_model_exclude_unset=True,
+)
+async def get_project_workspace(
+    project_id: str,
+    include: Optional[str] = None,
+    files_limit: int = 50,
+    current_user: dict = Depends(get_current_user),
 ):
-    """Get notebook for a project"""
+    """Get a project with its notebook, files and agent session in one round trip"""
+    sections = WORKSPACE_SECTIONS
+    if include:
+        sections = {part.strip() for part in include.split(",") if part.strip()}
+        unknown = sections - WORKSPACE_SECTIONS
+        if unknown:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Unknown include section(s): {', '.join(sorted(unknown))}",
+            )
+    files_limit = max(1, min(files_limit, 200))
+
     try:
-        # Verify project ownership
-        project = (
-            supabase.table("projects")
-            .select("*")
-            .eq("id", project_id)
-            .eq("user_id", current_user["id"])
-            .single()
-            .execute()
-        )
-        if not project.data:
+        # All sections are fetched concurrently. The project query doubles
+        # as the ownership check; the other results are only returned once
+        # it succeeds.
+        queries = {"project": get_repository().get_project(project_id, current_user["id"])}
+        if "notebook" in sections:
+            queries["notebook"] = get_repository().get_notebook(
+                project_id, columns=("id", "project_id", "metadata", "created_at", "updated_at")
+            )
+        if "files" in sections:
+            queries["files"] = get_repository().list_files(project_id, limit=files_limit)
+        if "agent" in sections:
+            queries["agent_session"] = get_repository().get_agent_session(
+                project_id,
+                columns=("id", "project_id", "current_step", "status", "metadata", "created_at", "updated_at"),
+            )
+
+        workspace = dict(zip(queries.keys(), await asyncio.gather(*queries.values())))
+        if not workspace["project"]:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND, detail="Project not found"
             )
+        return workspace
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error fetching workspace: {str(e)}",
+        )
+
+
+# Batch endpoint
+@app.post("/api/batch", response_model=BatchResponse)
+async def run_batch(
+    batch_request: BatchRequest,
+    request: Request,
+    current_user: dict = Depends(get_current_user),
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+):
+    """Run several API operations in one round trip"""
+    operations = [
+        {
+            **operation.dict(),
+            "id": operation.id if operation.id is not None else str(position),
+            "method": operation.method.upper(),
+        }
+        for position, operation in enumerate(batch_request.operations)
+    ]
+    try:
+        batch.validate(app, operations, batch_request.atomic, BATCH_MAX_OPERATIONS)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    # A batch with agent operations gets the agent timeout; those operations
+    # each wait for an agent slot
+    extend_deadline_for(request.scope, [(operation["method"], operation["path"]) for operation in operations])
+
+    try:
+        # Sub-requests carry the same token; it was verified once, above
+        token = _batch_user.set((credentials.credentials, current_user))
+        try:
+            if batch_request.atomic:
+                # Check ownership up front so nothing runs for a foreign project
+                project_ids = {batch.resource_key(operation["path"])[0] for operation in operations}
+                await asyncio.gather(*(
+                    require_project(project_id, current_user["id"])
+                    for project_id in project_ids if project_id
+                ))
+            dispatch = batch.asgi_dispatcher(app, request.scope, f"Bearer {credentials.credentials}")
+            if batch_request.atomic:
+                results, committed, rolled_back = await batch.run_atomic(operations, dispatch)
+            else:
+                results = await batch.run_concurrent(operations, dispatch)
+                committed, rolled_back = all(result["status"] < 400 for result in results), None
+        finally:
+            _batch_user.reset(token)
+        return {"results": results, "committed": committed, "rolled_back": rolled_back}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error running batch: {str(e)}",
+        )
 
-        # Get notebook
-        response = (
-            supabase.table("notebooks")
-            .select("*")
-            .eq("project_id", project_id)
-            .maybe_single()
-            .execute()
+
+# Search endpoint
+@app.get("/api/search", response_model=SearchResponse)
+async def search_workspace(
+    q: str,
+    kind: Optional[str] = None,
+    limit: int = 20,
+    offset: int = 0,
+    current_user: dict = Depends(get_current_user),
+):
+    """Search the user's project titles and descriptions, notebook cells and agent steps"""
+    query = q.strip()
+    if not query or len(query) > SEARCH_MAX_QUERY_LENGTH:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Query must be 1 to {SEARCH_MAX_QUERY_LENGTH} characters",
         )
-        if not response.data:
+    kinds = None
+    if kind:
+        kinds = sorted({part.strip() for part in kind.split(",") if part.strip()})
+        unknown = set(kinds) - set(SEARCH_KINDS)
+        if unknown:
             raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND, detail="Notebook not found"
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Unknown search kind(s): {', '.join(sorted(unknown))}",
             )
-        return response.data
+    limit = max(1, min(limit, 100))
+    offset = max(0, offset)
+
+    try:
+        results, total = await get_repository().search(
+            current_user["id"], query, kinds=kinds, limit=limit, offset=offset
+        )
+        return {"query": query, "total": total, "limit": limit, "offset": offset, "results": results}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error searching: {str(e)}",
+        )
+
+
+# Realtime endpoints
+@app.websocket("/api/projects/{project_id}/live")
+async def project_live_socket(websocket: WebSocket, project_id: str, token: Optional[str] = None):
+    """Push project changes over a WebSocket (browsers pass the JWT as ?token=)"""
+    if not await authorize_project_stream(project_id, token):
+        await websocket.close(code=4401)
+        return
+
+    await websocket.accept()
+    subscription = change_hub.subscribe(project_id)
+
+    async def pump():
+        while True:
+            event = await subscription.next_event(timeout=25)
+            await websocket.send_json(event or {"type": "ping"})
+
+    pump_task = asyncio.create_task(pump())
+    try:
+        # Reading keeps disconnects visible while the pump waits for events
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+    except WebSocketDisconnect:
+        pass
+    finally:
+        pump_task.cancel()
+        subscription.close()
+
+
+@app.get("/api/projects/{project_id}/events")
+async def project_event_stream(
+    project_id: str,
+    request: Request,
+    token: Optional[str] = None,
+    authorization: Optional[str] = Header(None),
+):
+    """Push project changes as Server-Sent Events"""
+    if not token and authorization and authorization.lower().startswith("bearer "):
+        token = authorization[7:]
+    if not await authorize_project_stream(project_id, token):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid authentication credentials",
+        )
+
+    subscription = change_hub.subscribe(project_id)
+
+    async def stream():
+        try:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                event = await subscription.next_event(timeout=15)
+                # Comment lines keep proxies from closing an idle stream
+                yield encode_sse(event) if event else ": ping\n\n"
+        finally:
+            subscription.close()
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# Notebook endpoints
+@app.get("/api/projects/{project_id}/notebook", response_model=NotebookResponse)
+async def get_notebook(
+    project_id: str,
+    if_none_match: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user),
+):
+    """Get notebook for a project"""
+    try:
+        # Verify project ownership
+        await require_project(project_id, current_user["id"])
+
+        return await conditional_row_response(
+            if_none_match,
+            NotebookResponse,
+            lambda columns: get_repository().get_notebook(project_id, columns=columns),
+            not_found="Notebook not found",
+        )
     except HTTPException:
         raise
     except Exception as e:
@@ -359,30 +1083,20 @@ async def create_notebook(
     """Create a notebook for a project"""
     try:
         # Verify project ownership
-        project = (
-            supabase.table("projects")
-            .select("*")
-            .eq("id", project_id)
-            .eq("user_id", current_user["id"])
-            .single()
-            .execute()
-        )
-        if not project.data:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND, detail="Project not found"
-            )
+        await require_project(project_id, current_user["id"])
 
         notebook_data = {
             "project_id": project_id,
             "cells": notebook.cells,
         }
-        response = supabase.table("notebooks").insert(notebook_data).execute()
-        if not response.data:
+        created = await get_repository().create_notebook(notebook_data)
+        if not created:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Failed to create notebook",
             )
-        return response.data[0]
+        change_hub.publish(project_id, "notebooks", created)
+        return row_response(NotebookResponse, created, status_code=status.HTTP_201_CREATED)
     except HTTPException:
         raise
     except Exception as e:
@@ -396,37 +1110,29 @@ async def create_notebook(
 async def update_notebook(
     project_id: str,
     notebook_update: NotebookUpdate,
+    if_match: Optional[str] = Header(None),
     current_user: dict = Depends(get_current_user),
 ):
     """Update a notebook"""
     try:
         # Verify project ownership
-        project = (
-            supabase.table("projects")
-            .select("*")
-            .eq("id", project_id)
-            .eq("user_id", current_user["id"])
-            .single()
-            .execute()
-        )
-        if not project.data:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND, detail="Project not found"
-            )
+        await require_project(project_id, current_user["id"])
 
         # Update notebook
         update_data = notebook_update.dict(exclude_unset=True)
-        response = (
-            supabase.table("notebooks")
-            .update(update_data)
-            .eq("project_id", project_id)
-            .execute()
-        )
-        if not response.data:
+        expected_updated_at = None
+        if if_match:
+            current = await get_repository().get_notebook(project_id, columns=("id", "updated_at"))
+            expected_updated_at = check_if_match(current, if_match, "Notebook not found")
+        updated = await get_repository().update_notebook(project_id, update_data, expected_updated_at)
+        if not updated:
+            if if_match:
+                raise precondition_failed()
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND, detail="Notebook not found"
             )
-        return response.data[0]
+        change_hub.publish(project_id, "notebooks", updated)
+        return row_response(NotebookResponse, updated, etag=True)
     except HTTPException:
         raise
     except Exception as e:
@@ -444,27 +1150,9 @@ async def list_files(
     """List files for a project"""
     try:
         # Verify project ownership
-        project = (
-            supabase.table("projects")
-            .select("*")
-            .eq("id", project_id)
-            .eq("user_id", current_user["id"])
-            .single()
-            .execute()
-        )
-        if not project.data:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND, detail="Project not found"
-            )
+        await require_project(project_id, current_user["id"])
 
-        response = (
-            supabase.table("files")
-            .select("*")
-            .eq("project_id", project_id)
-            .order("created_at", desc=True)
-            .execute()
-        )
-        return response.data
+        return await get_repository().list_files(project_id)
     except HTTPException:
         raise
     except Exception as e:
@@ -483,25 +1171,20 @@ async def delete_file(
     """Delete a file"""
     try:
         # Verify project ownership and file ownership
-        file_record = (
-            supabase.table("files")
-            .select("*, projects!inner(user_id)")
-            .eq("id", file_id)
-            .eq("project_id", project_id)
-            .single()
-            .execute()
-        )
-        if not file_record.data:
+        await require_project(project_id, current_user["id"])
+        file_record = await get_repository().get_file(project_id, file_id)
+        if not file_record:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND, detail="File not found"
             )
 
         # Delete from storage
-        supabase.storage.from_("project-files").remove([file_record.data["path"]])
+        await asyncio.to_thread(remove_objects, get_supabase(), [file_record["path"]])
 
         # Delete from database
-        supabase.table("files").delete().eq("id", file_id).execute()
+        await get_repository().delete_files([file_id])
 
+        change_hub.publish(project_id, "files")
         return None
     except HTTPException:
         raise
@@ -512,10 +1195,215 @@ async def delete_file(
         )
 
 
+@app.post("/api/projects/{project_id}/files/bulk-delete", response_model=FileBulkDeleteResponse)
+async def bulk_delete_files(
+    project_id: str,
+    request: FileBulkDeleteRequest,
+    current_user: dict = Depends(get_current_user),
+):
+    """Delete many files with batched storage and database calls"""
+    try:
+        # Verify project ownership
+        await require_project(project_id, current_user["id"])
+
+        file_ids = list(dict.fromkeys(request.file_ids))
+        records = await get_repository().get_files(project_id, file_ids)
+
+        if records:
+            # Delete from storage, then from the database
+            await asyncio.to_thread(
+                remove_objects, get_supabase(), [record["path"] for record in records]
+            )
+            await get_repository().delete_files([record["id"] for record in records])
+            change_hub.publish(project_id, "files")
+
+        deleted = {record["id"] for record in records}
+        return FileBulkDeleteResponse(
+            deleted=[file_id for file_id in file_ids if file_id in deleted],
+            not_found=[file_id for file_id in file_ids if file_id not in deleted],
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error deleting files: {str(e)}",
+        )
+
+
+# Export and import endpoints
+@app.get("/api/projects/{project_id}/export")
+async def export_project(
+    project_id: str,
+    export_format: str = Query("zip", alias="format"),
+    current_user: dict = Depends(get_current_user),
+):
+    """Download the project as a notebook (.ipynb), rendered HTML or a zip bundle with its files"""
+    if export_format not in EXPORT_FORMATS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"format must be one of: {', '.join(EXPORT_FORMATS)}",
+        )
+    try:
+        project = await require_project(
+            project_id, current_user["id"], columns=("id", "title", "description", "quiz_responses", "status")
+        )
+        notebook = await get_repository().get_notebook(project_id, columns=("id", "metadata"))
+        if export_format == "ipynb":
+            if not notebook:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND, detail="Notebook not found"
+                )
+            body = iter_ipynb(iter_cells(get_repository(), project_id), notebook_metadata(project, notebook))
+        elif export_format == "html":
+            session = await get_repository().get_agent_session(project_id, columns=("steps",))
+            cells = iter_cells(get_repository(), project_id)
+            body = iter_html(project, cells, session["steps"] if session else [])
+        else:
+            session = await get_repository().get_agent_session(project_id)
+            body = iter_bundle(get_repository(), get_object_store(), project, notebook, session)
+
+        filename = export_filename(project, export_format)
+        return StreamingResponse(
+            body,
+            media_type=EXPORT_MEDIA_TYPES[export_format],
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error exporting project: {str(e)}",
+        )
+
+
+async def discard_import(project_id: str, user_id: str):
+    """Remove a partly imported project and whatever it uploaded"""
+    with without_deadline():
+        try:
+            await get_repository().delete_project(project_id, user_id)
+            await cache.invalidate(OWNER_CACHE_NAMESPACE, project_id)
+            await asyncio.to_thread(purge_project_objects, get_supabase(), project_id)
+        except Exception as e:
+            print(f"Warning: Could not clean up failed import of project {project_id}: {e}")
+
+
+@app.post("/api/projects/import", response_model=ProjectResponse, status_code=status.HTTP_201_CREATED)
+async def import_project(
+    request: Request,
+    title: Optional[str] = None,
+    current_user: dict = Depends(get_current_user),
+):
+    """Create a project from an exported zip bundle or a .ipynb sent as the request body"""
+    upload = None
+    try:
+        declared = request.headers.get("content-length")
+        if declared and declared.isdigit() and int(declared) > IMPORT_MAX_BYTES:
+            raise UploadTooLarge(f"Upload is larger than {IMPORT_MAX_BYTES} bytes")
+        spool = await spool_upload(request.stream())
+        upload = await asyncio.to_thread(read_upload, spool)
+
+        project_data = {**upload.project, "user_id": current_user["id"]}
+        project_data["title"] = title or project_data.get("title") or "Imported project"
+        created = await get_repository().create_project(project_data)
+        if not created:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Failed to create project",
+            )
+        try:
+            await import_contents(get_repository(), get_object_store(), created["id"], current_user["id"], upload)
+        except Exception:
+            await discard_import(created["id"], current_user["id"])
+            raise
+        return row_response(ProjectResponse, created, status_code=status.HTTP_201_CREATED)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+    except InvalidUpload as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error importing project: {str(e)}",
+        )
+    finally:
+        if upload is not None:
+            upload.close()
+
+
+def cancel_plan_refinement(project_id: str):
+    """Stop a background refinement whose draft has been replaced"""
+    task = plan_refinements.pop(project_id, None)
+    if task is not None:
+        task.cancel()
+
+
+def start_plan_refinement(project_id: str, owner_id: str, quiz_responses: dict, metadata: dict, draft_updated_at):
+    """Have Gemini write the plan for a project that got a template draft"""
+    if not draft_updated_at:
+        return
+    task = asyncio.create_task(refine_plan(project_id, owner_id, quiz_responses, metadata, draft_updated_at))
+    plan_refinements[project_id] = task
+
+    def forget(done: asyncio.Task):
+        if plan_refinements.get(project_id) is done:
+            del plan_refinements[project_id]
+
+    task.add_done_callback(forget)
+
+
+async def refine_plan(project_id: str, owner_id: str, quiz_responses: dict, metadata: dict, draft_updated_at):
+    """
+    Replace a template draft with Gemini's plan, unless the session changed
+    since the draft was stored (the user edited or started running it)
+    """
+    # The analyze request has been answered; its deadline no longer applies
+    with without_deadline():
+        try:
+            steps = await gemini_service.analyze_research_goal(quiz_responses)
+            plan_templates.record(owner_id, quiz_responses, steps)
+            # The plan no longer comes from the template, so it must not be
+            # scored as one
+            metadata = {key: value for key, value in metadata.items() if key != "plan_template"}
+            update_data = {
+                "steps": steps,
+                "metadata": {
+                    **metadata,
+                    "plan_source": "gemini",
+                    "package_manifest": build_manifest(step_sources(steps)),
+                },
+            }
+            updated = await get_repository().update_agent_session(project_id, update_data, draft_updated_at)
+            if updated:
+                change_hub.publish(project_id, "agent_sessions", updated)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Warning: Could not refine template plan for project {project_id}: {e}")
+
+
+# Agent session metadata the server derives; clients cannot set it
+SERVER_METADATA = ("plan_template", "plan_source", "package_manifest")
+
+
+def record_template_feedback(offered: Optional[dict], steps: Optional[list], owner_id: str):
+    """Score the template a plan started from by how many of its steps are still in it"""
+    if not offered or offered.get("scored") or plan_templates is None:
+        return
+    key = offered.get("key")
+    # Only the owner's own archetypes are scored
+    if isinstance(key, str) and key.startswith(f"{owner_id}|"):
+        plan_templates.record_feedback(key, offered.get("titles") or [], steps or [])
+
+
 # Agent endpoints
 @app.post("/api/projects/{project_id}/agent/analyze", response_model=AgentSessionResponse, status_code=status.HTTP_201_CREATED)
 async def analyze_research_goal(
     project_id: str,
+    templates: bool = False,
     current_user: dict = Depends(get_current_user),
 ):
     """Analyze quiz responses and create agent session with steps"""
@@ -526,29 +1414,52 @@ async def analyze_research_goal(
                 detail="Gemini service is not available",
             )
 
-        # Verify project ownership
-        project = (
-            supabase.table("projects")
-            .select("*")
-            .eq("id", project_id)
-            .eq("user_id", current_user["id"])
-            .single()
-            .execute()
-        )
-        if not project.data:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND, detail="Project not found"
+        # Verify project ownership; the existing session's metadata is read
+        # meanwhile so settings such as the semantic cache opt-out survive
+        # re-analysis
+        with span("ownership"):
+            project, existing = await asyncio.gather(
+                require_project(project_id, current_user["id"], columns=("id", "quiz_responses")),
+                get_repository().get_agent_session(project_id, columns=("metadata",)),
             )
 
-        quiz_responses = project.data.get("quiz_responses")
+        quiz_responses = project.get("quiz_responses")
         if not quiz_responses:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Quiz responses not found. Please complete the quiz first.",
             )
 
-        # Generate steps using Gemini
-        steps = gemini_service.analyze_research_goal(quiz_responses)
+        metadata = dict((existing or {}).get("metadata") or {})
+        # Projects take part in plan templates only once they opt in, with
+        # ?templates=true here or metadata.plan_templates = true
+        if templates:
+            metadata["plan_templates"] = True
+        use_templates = plan_templates is not None and metadata.get("plan_templates") is True
+
+        # A template from the owner's earlier plans for this archetype and a
+        # similar question is served as a draft right away and refined by
+        # Gemini in the background; otherwise wait for Gemini
+        draft = plan_templates.lookup(current_user["id"], quiz_responses) if use_templates else None
+        if use_templates:
+            record_cache("plan_template", draft is not None)
+        if draft is None:
+            steps = await gemini_service.analyze_research_goal(quiz_responses)
+
+        metadata.pop("plan_template", None)
+        if draft is not None:
+            template_key, steps = draft
+            plan_templates.served(template_key)
+            metadata["plan_source"] = "template"
+            # The titles offered are scored when the user first edits or runs the plan
+            metadata["plan_template"] = {
+                "key": template_key, "titles": [step.get("title") or "" for step in steps]
+            }
+        else:
+            metadata["plan_source"] = "gemini"
+            if use_templates:
+                plan_templates.record(current_user["id"], quiz_responses, steps)
+        metadata["package_manifest"] = build_manifest(step_sources(steps))
 
         # Create or update agent session
         session_data = {
@@ -557,21 +1468,23 @@ async def analyze_research_goal(
             "current_step": 0,
             "status": "planning",
             "conversation_history": [],
+            "metadata": metadata,
         }
 
-        response = (
-            supabase.table("agent_sessions")
-            .upsert(session_data, on_conflict="project_id")
-            .execute()
-        )
+        # A new plan supersedes any refinement still running for the old one
+        cancel_plan_refinement(project_id)
+        session = await get_repository().upsert_agent_session(session_data)
 
-        if not response.data:
+        if not session:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Failed to create agent session",
             )
 
-        return response.data[0]
+        if draft is not None:
+            start_plan_refinement(project_id, current_user["id"], quiz_responses, metadata, session.get("updated_at"))
+        change_hub.publish(project_id, "agent_sessions", session)
+        return row_response(AgentSessionResponse, session, status_code=status.HTTP_201_CREATED, etag=True)
     except HTTPException:
         raise
     except Exception as e:
@@ -583,39 +1496,22 @@ async def analyze_research_goal(
 
 @app.get("/api/projects/{project_id}/agent", response_model=AgentSessionResponse)
 async def get_agent_session(
-    project_id: str, current_user: dict = Depends(get_current_user)
+    project_id: str,
+    if_none_match: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user),
 ):
     """Get agent session for a project"""
     try:
         # Verify project ownership
-        project = (
-            supabase.table("projects")
-            .select("*")
-            .eq("id", project_id)
-            .eq("user_id", current_user["id"])
-            .single()
-            .execute()
-        )
-        if not project.data:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND, detail="Project not found"
-            )
-
-        # Get agent session
-        response = (
-            supabase.table("agent_sessions")
-            .select("*")
-            .eq("project_id", project_id)
-            .maybe_single()
-            .execute()
+        await require_project(project_id, current_user["id"])
+
+        # Get agent session; polling clients mostly get a 304 here
+        return await conditional_row_response(
+            if_none_match,
+            AgentSessionResponse,
+            lambda columns: get_repository().get_agent_session(project_id, columns=columns),
+            not_found="Agent session not found",
         )
-
-        if not response.data:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND, detail="Agent session not found"
-            )
-
-        return response.data
     except HTTPException:
         raise
     except Exception as e:
@@ -629,39 +1525,67 @@ async def get_agent_session(
 async def update_agent_steps(
     project_id: str,
     update: AgentSessionUpdate,
+    request: Request,
+    if_match: Optional[str] = Header(None),
     current_user: dict = Depends(get_current_user),
 ):
     """Update agent session steps"""
     try:
         # Verify project ownership
-        project = (
-            supabase.table("projects")
-            .select("*")
-            .eq("id", project_id)
-            .eq("user_id", current_user["id"])
-            .single()
-            .execute()
-        )
-        if not project.data:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND, detail="Project not found"
-            )
+        await require_project(project_id, current_user["id"])
 
         # Update agent session
         update_data = update.dict(exclude_unset=True)
-        response = (
-            supabase.table("agent_sessions")
-            .update(update_data)
-            .eq("project_id", project_id)
-            .execute()
-        )
-
-        if not response.data:
+        # A reverted batch write brings back the metadata as it was
+        restoring = request.scope.get(batch.RESTORE_SCOPE_KEY, False)
+        expected_updated_at = None
+        current = None
+        if if_match or restoring or "steps" in update_data or "metadata" in update_data:
+            current = await get_repository().get_agent_session(
+                project_id, columns=("id", "updated_at", "metadata")
+            )
+        if if_match:
+            expected_updated_at = check_if_match(current, if_match, "Agent session not found")
+
+        # Server-derived metadata always comes from the stored row
+        stored_metadata = (current or {}).get("metadata") or {}
+        if update_data.get("metadata") is not None and not restoring:
+            update_data["metadata"] = {
+                **{key: value for key, value in update_data["metadata"].items() if key not in SERVER_METADATA},
+                **{key: stored_metadata[key] for key in SERVER_METADATA if key in stored_metadata},
+            }
+
+        # Keep the package manifest in step with the steps' code; the first
+        # edit of a plan that started as a template scores the template
+        offered = None
+        if restoring:
+            restored_template = (update_data.get("metadata") or {}).get("plan_template")
+            if restored_template and not stored_metadata.get("plan_template"):
+                # The reverted edit already scored the template
+                update_data["metadata"] = {
+                    **update_data["metadata"], "plan_template": {**restored_template, "scored": True}
+                }
+        elif update_data.get("steps") is not None:
+            metadata = update_data.get("metadata")
+            if metadata is None:
+                metadata = stored_metadata
+            metadata = dict(metadata)
+            offered = metadata.pop("plan_template", None)
+            update_data["metadata"] = {
+                **metadata, "package_manifest": build_manifest(step_sources(update_data["steps"]))
+            }
+        updated = await get_repository().update_agent_session(project_id, update_data, expected_updated_at)
+
+        if not updated:
+            if if_match:
+                raise precondition_failed()
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND, detail="Agent session not found"
             )
 
-        return response.data[0]
+        record_template_feedback(offered, update_data.get("steps"), current_user["id"])
+        change_hub.publish(project_id, "agent_sessions", updated)
+        return row_response(AgentSessionResponse, updated, etag=True)
     except HTTPException:
         raise
     except Exception as e:
@@ -671,6 +1595,39 @@ async def update_agent_steps(
         )
 
 
+@app.get("/api/projects/{project_id}/packages", response_model=PackageManifestResponse)
+async def get_package_manifest(
+    project_id: str,
+    current_user: dict = Depends(get_current_user),
+):
+    """Packages and data files the plan's steps and the notebook's code cells need"""
+    try:
+        await require_project(project_id, current_user["id"])
+
+        session, notebook = await asyncio.gather(
+            get_repository().get_agent_session(project_id, columns=("steps", "metadata")),
+            get_repository().get_notebook(project_id, columns=("cells",)),
+        )
+
+        steps_manifest = None
+        if session:
+            steps_manifest = (session.get("metadata") or {}).get("package_manifest")
+            if not steps_manifest:
+                # Sessions created before manifests were stored
+                steps_manifest = build_manifest(step_sources(session.get("steps")))
+        # Cells change with every autosave; each one is only parsed when its
+        # code changes
+        cells_manifest = build_manifest(cell_sources((notebook or {}).get("cells")))
+        return merge_manifests(steps_manifest, cells_manifest)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error building package manifest: {str(e)}",
+        )
+
+
 @app.post("/api/projects/{project_id}/agent/chat", response_model=AgentChatResponse)
 async def chat_with_agent(
     project_id: str,
@@ -686,42 +1643,44 @@ async def chat_with_agent(
             )
 
         # Verify project ownership
-        project = (
-            supabase.table("projects")
-            .select("*")
-            .eq("id", project_id)
-            .eq("user_id", current_user["id"])
-            .single()
-            .execute()
-        )
-        if not project.data:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND, detail="Project not found"
-            )
+        with span("ownership"):
+            await require_project(project_id, current_user["id"])
 
         # Get agent session
-        session_response = (
-            supabase.table("agent_sessions")
-            .select("*")
-            .eq("project_id", project_id)
-            .maybe_single()
-            .execute()
-        )
+        session = await get_repository().get_agent_session(project_id)
 
-        if not session_response.data:
+        if not session:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Agent session not found. Please analyze your research goal first.",
             )
 
-        session = session_response.data
         steps = session.get("steps", [])
         conversation_history = session.get("conversation_history", [])
 
+        # Reuse an answer to a similar question about the same plan step,
+        # unless the project opted out with metadata.semantic_cache = false.
+        # Answers to a conversation's first question are shared across owners;
+        # later ones may quote the conversation and stay with their owner
+        metadata = session.get("metadata") or {}
+        use_semantic_cache = semantic_cache is not None and metadata.get("semantic_cache") is not False
+        current_step = session.get("current_step", 0)
+        scope = plan_scope(current_user["id"], steps, current_step)
+        shared_scope = plan_scope(None, steps, current_step)
+        ai_response = None
+        if use_semantic_cache:
+            with span("semantic_cache"):
+                ai_response = semantic_cache.lookup(scope, chat_request.message, shared_scope)
+
         # Get AI response
-        ai_response = gemini_service.chat_with_agent(
-            chat_request.message, conversation_history, steps
-        )
+        if ai_response is None:
+            ai_response = await gemini_service.chat_with_agent(
+                chat_request.message, conversation_history, steps
+            )
+            if use_semantic_cache:
+                semantic_cache.add(
+                    scope if conversation_history else shared_scope, chat_request.message, ai_response
+                )
 
         # Update conversation history
         new_history = conversation_history + [
@@ -730,9 +1689,12 @@ async def chat_with_agent(
         ]
 
         # Update session with new conversation history
-        supabase.table("agent_sessions").update(
-            {"conversation_history": new_history}
-        ).eq("project_id", project_id).execute()
+        with span("history_write"):
+            updated = await get_repository().update_agent_session(
+                project_id, {"conversation_history": new_history}
+            )
+        if updated:
+            change_hub.publish(project_id, "agent_sessions", updated)
 
         return AgentChatResponse(response=ai_response)
     except HTTPException:
@@ -753,34 +1715,16 @@ async def execute_agent_step(
     """Execute a specific agent step"""
     try:
         # Verify project ownership
-        project = (
-            supabase.table("projects")
-            .select("*")
-            .eq("id", project_id)
-            .eq("user_id", current_user["id"])
-            .single()
-            .execute()
-        )
-        if not project.data:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND, detail="Project not found"
-            )
+        await require_project(project_id, current_user["id"])
 
         # Get agent session
-        session_response = (
-            supabase.table("agent_sessions")
-            .select("*")
-            .eq("project_id", project_id)
-            .maybe_single()
-            .execute()
-        )
+        session = await get_repository().get_agent_session(project_id, columns=("id", "steps", "metadata"))
 
-        if not session_response.data:
+        if not session:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND, detail="Agent session not found"
             )
 
-        session = session_response.data
         steps = session.get("steps", [])
 
         if step_index < 0 or step_index >= len(steps):
@@ -793,21 +1737,23 @@ async def execute_agent_step(
             "current_step": step_index,
             "status": "executing",
         }
+        # Running a plan that started as a template keeps its steps
+        metadata = session.get("metadata") or {}
+        offered = metadata.get("plan_template")
+        if offered:
+            update_data["metadata"] = {key: value for key, value in metadata.items() if key != "plan_template"}
 
-        response = (
-            supabase.table("agent_sessions")
-            .update(update_data)
-            .eq("project_id", project_id)
-            .execute()
-        )
+        updated = await get_repository().update_agent_session(project_id, update_data)
 
-        if not response.data:
+        if not updated:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Failed to update agent session",
             )
 
-        return response.data[0]
+        record_template_feedback(offered, steps, current_user["id"])
+        change_hub.publish(project_id, "agent_sessions", updated)
+        return row_response(AgentSessionResponse, updated, etag=True)
     except HTTPException:
         raise
     except Exception as e:
@@ -820,4 +1766,4 @@ async def execute_agent_step(
 if __name__ == "__main__":
     import uvicorn
 
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=8000)
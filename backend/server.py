@@ -0,0 +1,91 @@
+"""
+Fast-starting ASGI entry point for the LabMind API
+
+Importing main (FastAPI, pydantic and every route and response model) takes
+most of a second on a small container, longer than a new worker may take to
+pass its health check. server:app answers /health as soon as uvicorn is up
+and imports main in a worker thread right after startup. /ready answers 503
+until then; every other request waits for the import and is then served by
+main.app, whose lifespan (client warm-up, snapshot savers) starts once it is
+loaded.
+
+    uvicorn server:app --host 0.0.0.0 --port $PORT
+"""
+import asyncio
+import importlib
+from typing import Optional
+
+
+async def _send_json(send, status_code: int, body: bytes):
+    await send({
+        "type": "http.response.start",
+        "status": status_code,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class LazyApp:
+    """ASGI app that loads module.app in the background and then hands every request to it"""
+
+    def __init__(self, module: str = "main"):
+        self.module = module
+        self._app = None
+        self._lifespan = None
+        self._loading: Optional[asyncio.Task] = None
+
+    async def _load(self):
+        try:
+            module = await asyncio.to_thread(importlib.import_module, self.module)
+        except Exception as e:
+            print(f"Warning: Could not import {self.module}: {e}")
+            raise
+        app = module.app
+        self._lifespan = app.router.lifespan_context(app)
+        await self._lifespan.__aenter__()
+        self._app = app
+        return app
+
+    def _start_loading(self) -> asyncio.Task:
+        if self._loading is None:
+            self._loading = asyncio.create_task(self._load())
+        return self._loading
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._run_lifespan(receive, send)
+            return
+        if self._app is not None:
+            await self._app(scope, receive, send)
+            return
+        loading = self._start_loading()
+        # Answered here only while main is loading; a failed import fails them too
+        if scope["type"] == "http" and not loading.done():
+            if scope["path"] == "/health":
+                await _send_json(send, 200, b'{"status":"ok"}')
+                return
+            if scope["path"] == "/ready":
+                await _send_json(send, 503, b'{"status":"starting"}')
+                return
+        app = await loading
+        await app(scope, receive, send)
+
+    async def _run_lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                self._start_loading()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                try:
+                    if self._loading is not None:
+                        await self._loading
+                    if self._lifespan is not None:
+                        await self._lifespan.__aexit__(None, None, None)
+                except Exception as e:
+                    print(f"Warning: Shutdown failed: {e}")
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+app = LazyApp()
@@ -0,0 +1,318 @@
+"""
+Admission control, load shedding and request deadlines
+
+Every API request belongs to a route class: "agent" for the Gemini-bound
+POST /agent/analyze, /agent/chat and /agent/execute routes, "transfer" for
+project export and import (long, bandwidth-bound downloads and uploads),
+"crud" for everything else. Each class admits a limited number of requests at once.
+Further requests wait in a short FIFO queue, but only as long as they could
+still finish before their deadline; when the queue is full, or the wait
+would use up the budget, the request is turned away straight away with 503
+and a Retry-After estimate. Under overload the server keeps finishing the
+work it has accepted instead of starting everything late.
+
+Clients can send their remaining budget in X-Request-Timeout-Ms; otherwise
+(and at most) the class timeout applies. A batch is admitted as crud but held
+to the timeout of its most expensive operation; its agent operations each
+take an agent slot, and no operation outlives the batch's deadline. The deadline is held in a context
+variable, and within_deadline() bounds Supabase, Postgres, auth and Gemini
+calls by the time left, failing with 504 once it has passed.
+"""
+import asyncio
+import json
+import math
+import os
+import re
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Deque, Dict, Iterable, Iterator, Optional, Tuple
+
+from fastapi import HTTPException, status
+
+from services.instrumentation import record_admission
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_CONTROL_ENABLED", "true").lower() == "true"
+TIMEOUT_HEADER = b"x-request-timeout-ms"
+# Sub-requests of POST /api/batch run inside the batch's own crud slot, except
+# agent operations, which take an agent slot of their own
+BATCH_SCOPE_KEY = "labmind.batch"
+# Arrival time, client budget and route classes of an admitted request
+ADMISSION_SCOPE_KEY = "labmind.admission"
+
+# Probes, metrics and long-lived streams are never queued or shed
+EXEMPT_PATHS = {"/health", "/ready", "/metrics"}
+STREAM_PATH = re.compile(r"/(live|events)$")
+AGENT_PATH = re.compile(r"^/api/projects/[^/]+/agent/(analyze|chat|execute)(/|$)")
+TRANSFER_PATH = re.compile(r"^/api/projects/(import|[^/]+/export)$")
+
+_deadline: ContextVar[Optional[float]] = ContextVar("labmind_deadline", default=None)
+
+
+class DeadlineExceeded(HTTPException):
+    """The request ran out of time; handlers re-raise it like any HTTPException"""
+
+    def __init__(self):
+        super().__init__(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail="Request deadline exceeded")
+
+
+def time_left() -> Optional[float]:
+    """Seconds until the current request's deadline, or None without one"""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def check_deadline() -> None:
+    """Raise DeadlineExceeded if the current request is already out of time"""
+    remaining = time_left()
+    if remaining is not None and remaining <= 0:
+        raise DeadlineExceeded()
+
+
+async def within_deadline(awaitable: Awaitable[Any]) -> Any:
+    """Await with a timeout of the time left, raising DeadlineExceeded when it runs out"""
+    remaining = time_left()
+    if remaining is None:
+        return await awaitable
+    if remaining <= 0:
+        # Don't start work nobody will wait for
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        elif asyncio.isfuture(awaitable):
+            awaitable.cancel()
+        raise DeadlineExceeded()
+    try:
+        return await asyncio.wait_for(awaitable, remaining)
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded() from None
+
+
+@contextmanager
+def without_deadline() -> Iterator[None]:
+    """Lift the deadline for cleanup that has to finish even after it passed"""
+    token = _deadline.set(None)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+class RouteClass:
+    """Concurrency limit with a bounded FIFO of waiting requests"""
+
+    def __init__(self, name: str, limit: int, max_queue: int, max_wait: float, timeout: float):
+        self.name = name
+        self.limit = max(1, limit)
+        self.max_queue = max(0, max_queue)
+        self.max_wait = max_wait
+        self.timeout = timeout
+        self.in_flight = 0
+        # Moving average of how long an admitted request holds its slot
+        self.service_time = 0.0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def retry_after(self) -> int:
+        """Whole seconds until the queue ahead of a new request should have drained"""
+        backlog = (self.queued + 1) * self.service_time / self.limit
+        return max(1, min(60, math.ceil(backlog)))
+
+    async def acquire(self, deadline: float) -> bool:
+        """Take a slot, waiting while the request could still finish in time"""
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+            record_admission(self.name, "admitted")
+            return True
+        if self.queued >= self.max_queue:
+            record_admission(self.name, "rejected")
+            return False
+        wait = min(self.max_wait, deadline - time.monotonic() - self.service_time)
+        if wait <= 0:
+            record_admission(self.name, "rejected")
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, wait)
+        except asyncio.TimeoutError:
+            record_admission(self.name, "timed_out")
+            return False
+        except BaseException:
+            if waiter.done() and not waiter.cancelled():
+                # Handed a slot just as the client went away
+                self.release()
+            raise
+        finally:
+            if not waiter.done() or waiter.cancelled():
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+        record_admission(self.name, "queued")
+        return True
+
+    def release(self, seconds: Optional[float] = None) -> None:
+        if seconds is not None:
+            self.service_time = seconds if not self.service_time else 0.8 * self.service_time + 0.2 * seconds
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                # The slot passes straight to the next waiter
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.getenv(name, str(default)))
+
+
+def default_route_classes() -> Dict[str, RouteClass]:
+    return {
+        "crud": RouteClass(
+            "crud",
+            limit=int(os.getenv("ADMISSION_CRUD_CONCURRENCY", "64")),
+            max_queue=int(os.getenv("ADMISSION_CRUD_QUEUE", "256")),
+            max_wait=_env_float("ADMISSION_CRUD_MAX_WAIT_SECONDS", 2.0),
+            timeout=_env_float("ADMISSION_CRUD_TIMEOUT_SECONDS", 15.0),
+        ),
+        "agent": RouteClass(
+            "agent",
+            limit=int(os.getenv("ADMISSION_AGENT_CONCURRENCY", "8")),
+            max_queue=int(os.getenv("ADMISSION_AGENT_QUEUE", "32")),
+            max_wait=_env_float("ADMISSION_AGENT_MAX_WAIT_SECONDS", 10.0),
+            timeout=_env_float("ADMISSION_AGENT_TIMEOUT_SECONDS", 90.0),
+        ),
+        "transfer": RouteClass(
+            "transfer",
+            limit=int(os.getenv("ADMISSION_TRANSFER_CONCURRENCY", "4")),
+            max_queue=int(os.getenv("ADMISSION_TRANSFER_QUEUE", "16")),
+            max_wait=_env_float("ADMISSION_TRANSFER_MAX_WAIT_SECONDS", 10.0),
+            timeout=_env_float("ADMISSION_TRANSFER_TIMEOUT_SECONDS", 3600.0),
+        ),
+    }
+
+
+def classify(scope) -> Optional[str]:
+    """Route class of a request, or None if it bypasses admission control"""
+    path = scope["path"]
+    method = scope["method"]
+    if method == "OPTIONS" or path in EXEMPT_PATHS or STREAM_PATH.search(path):
+        return None
+    if method == "POST" and AGENT_PATH.match(path):
+        return "agent"
+    if TRANSFER_PATH.match(path):
+        return "transfer"
+    if scope.get(BATCH_SCOPE_KEY):
+        return None
+    return "crud"
+
+
+def extend_deadline_for(scope, operations: Iterable[Tuple[str, str]]) -> None:
+    """
+    Hold the current request to the longest timeout of the route classes of
+    (method, path) operations, measured from its arrival and capped by the
+    client's budget. POST /api/batch calls it once it has read its operations.
+    """
+    admission = scope.get(ADMISSION_SCOPE_KEY)
+    current = _deadline.get()
+    if not admission or current is None:
+        return
+    names = {
+        classify({"method": method, "path": path.partition("?")[0]}) or "crud" for method, path in operations
+    }
+    timeout = max(admission["classes"][name].timeout for name in names if name in admission["classes"])
+    requested = admission["requested"]
+    deadline = admission["arrived"] + (timeout if requested is None else min(requested, timeout))
+    if deadline > current:
+        _deadline.set(deadline)
+
+
+def requested_timeout(scope) -> Optional[float]:
+    """Client's remaining budget in seconds from X-Request-Timeout-Ms"""
+    for name, value in scope.get("headers") or []:
+        if name == TIMEOUT_HEADER:
+            try:
+                milliseconds = float(value)
+            except ValueError:
+                return None
+            return milliseconds / 1000 if milliseconds > 0 else None
+    return None
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware that admits, queues or sheds each API request by route
+    class and sets its deadline. Add it inside CORS so rejections still carry
+    CORS headers.
+    """
+
+    def __init__(self, app, enabled: bool = ADMISSION_ENABLED, classes: Optional[Dict[str, RouteClass]] = None):
+        self.app = app
+        self.enabled = enabled
+        self.classes = classes or default_route_classes()
+
+    async def __call__(self, scope, receive, send):
+        if not self.enabled or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        name = classify(scope)
+        if name is None:
+            await self.app(scope, receive, send)
+            return
+
+        route_class = self.classes[name]
+        arrived = time.monotonic()
+        requested = requested_timeout(scope)
+        budget = route_class.timeout if requested is None else min(requested, route_class.timeout)
+        deadline = arrived + budget
+        if scope.get(BATCH_SCOPE_KEY) and _deadline.get() is not None:
+            # Batched operations never outlive the batch
+            deadline = min(deadline, _deadline.get())
+        scope[ADMISSION_SCOPE_KEY] = {"arrived": arrived, "requested": requested, "classes": self.classes}
+        if not await route_class.acquire(deadline):
+            await self._reject(send, route_class.retry_after())
+            return
+
+        admitted = time.monotonic()
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                route_class.release(time.monotonic() - admitted)
+
+        async def send_and_release(message):
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                # Background tasks run after the response; they neither hold
+                # the slot nor inherit the deadline
+                release()
+                _deadline.set(None)
+
+        token = _deadline.set(deadline)
+        try:
+            await self.app(scope, receive, send_and_release)
+        finally:
+            release()
+            _deadline.reset(token)
+
+    @staticmethod
+    async def _reject(send, retry_after: int) -> None:
+        body = json.dumps({"detail": "Server is busy, please retry later"}).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": status.HTTP_503_SERVICE_UNAVAILABLE,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode("latin-1")),
+                (b"retry-after", str(retry_after).encode("latin-1")),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
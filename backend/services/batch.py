@@ -0,0 +1,313 @@
+"""
+Batched API operations
+
+POST /api/batch runs an ordered list of sub-requests against the app's own
+routes in this process, so a bulk edit is one round trip. Each sub-request
+is dispatched through the ASGI app, with the same validation, ownership
+checks and realtime events as when it is sent on its own.
+
+Operations that touch the same project resource run in list order when
+either of them writes: the project row (/api/projects/{id}) orders against
+all of that project's operations, and notebook, files and agent orders
+against itself. Everything else runs concurrently. depends_on adds explicit
+ordering, and a dependent operation is skipped (424) if its dependency
+failed.
+
+In atomic mode operations run one at a time and stop at the first failure.
+Earlier project, notebook and step updates are then restored, and created
+projects are deleted. A restore writes back the whole previous value of the
+fields the update changed, plus what the server derived from them (the plan's
+metadata for step updates), and each result reports whether it was reverted. Other writes (deletes, analyze, chat, execute,
+notebook creation) cannot be undone, so an atomic batch may contain only
+one of them, as its last operation.
+"""
+import asyncio
+import json
+import re
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from starlette.routing import Match
+
+from services.admission import BATCH_SCOPE_KEY
+
+READ_METHODS = {"GET"}
+ALLOWED_METHODS = {"GET", "POST", "PUT", "DELETE"}
+FORWARDED_HEADERS = {"if-match", "if-none-match"}
+# Streams never finish, exports and imports are raw bodies and batches do not nest
+EXCLUDED_PATH = re.compile(r"^/api/batch\b|/(live|events|export)$|^/api/projects/import$")
+
+# Updates that can be reverted by writing back the fields they changed, with
+# the route that reads the current values and the fields the server derives
+# from the update (step updates rebuild the package manifest and score plan
+# templates in metadata)
+REVERTIBLE_UPDATES = (
+    (re.compile(r"^/api/projects/[^/]+$"), "", ()),
+    (re.compile(r"^/api/projects/[^/]+/notebook$"), "", ()),
+    (re.compile(r"^/api/projects/[^/]+/agent/steps$"), "/steps", ("metadata",)),
+)
+# Set on the scope of a sub-request that writes back a reverted update, so the
+# route stores the values as given instead of deriving them again
+RESTORE_SCOPE_KEY = "labmind.batch_restore"
+PROJECT_COLLECTION = "/api/projects"
+
+Operation = Dict[str, Any]
+Result = Dict[str, Any]
+Dispatch = Callable[..., Awaitable[Result]]
+
+
+def _split(path: str) -> Tuple[str, str]:
+    path, _, query = path.partition("?")
+    return path, query
+
+
+def resource_key(path: str) -> Tuple[str, str]:
+    """(project id, area) an operation touches; area "" is the project row itself"""
+    parts = _split(path)[0].strip("/").split("/")
+    if len(parts) >= 3 and parts[:2] == ["api", "projects"]:
+        return parts[2], parts[3] if len(parts) > 3 else ""
+    return "", "/".join(parts[1:2])
+
+
+def conflicts(a: Operation, b: Operation) -> bool:
+    if a["method"] in READ_METHODS and b["method"] in READ_METHODS:
+        return False
+    (project_a, area_a), (project_b, area_b) = resource_key(a["path"]), resource_key(b["path"])
+    if project_a != project_b:
+        return False
+    return not project_a or area_a == area_b or "" in (area_a, area_b)
+
+
+def plan(operations: List[Operation]) -> List[Set[int]]:
+    """Indexes of the earlier operations each operation has to wait for"""
+    positions = {operation["id"]: position for position, operation in enumerate(operations)}
+    waits = []
+    for position, operation in enumerate(operations):
+        depends = {positions[dependency] for dependency in operation.get("depends_on") or []}
+        depends.update(
+            earlier for earlier in range(position) if conflicts(operations[earlier], operation)
+        )
+        waits.append(depends)
+    return waits
+
+
+def validate(app, operations: List[Operation], atomic: bool, max_operations: int) -> None:
+    """Raise ValueError if the batch as a whole cannot be run"""
+    if not operations:
+        raise ValueError("A batch needs at least one operation")
+    if len(operations) > max_operations:
+        raise ValueError(f"A batch can have at most {max_operations} operations")
+    seen: Set[str] = set()
+    for operation in operations:
+        if operation["method"] not in ALLOWED_METHODS:
+            raise ValueError(f"Operation {operation['id']}: unsupported method {operation['method']}")
+        path = _split(operation["path"])[0]
+        if not path.startswith("/api/") or EXCLUDED_PATH.search(path):
+            raise ValueError(f"Operation {operation['id']}: {path} cannot be batched")
+        for dependency in operation.get("depends_on") or []:
+            if dependency not in seen:
+                raise ValueError(
+                    f"Operation {operation['id']}: depends_on must name an earlier operation ({dependency})"
+                )
+        if operation["id"] in seen:
+            raise ValueError(f"Duplicate operation id {operation['id']}")
+        seen.add(operation["id"])
+
+    if atomic:
+        # Fail before anything runs rather than roll back a typo
+        for operation in operations:
+            if not route_exists(app, operation):
+                raise ValueError(
+                    f"Operation {operation['id']}: no route for {operation['method']} {operation['path']}"
+                )
+        irreversible = [
+            position for position, operation in enumerate(operations)
+            if operation["method"] not in READ_METHODS and not reversible(operation)
+        ]
+        if len(irreversible) > 1 or (irreversible and irreversible[0] != len(operations) - 1):
+            raise ValueError(
+                "An atomic batch can only include one operation that cannot be undone "
+                "(delete, analyze, chat, execute or notebook creation), as its last operation"
+            )
+
+
+def reversible(operation: Operation) -> bool:
+    path = _split(operation["path"])[0]
+    if operation["method"] == "POST":
+        return path == PROJECT_COLLECTION
+    if operation["method"] == "PUT":
+        return any(pattern.match(path) for pattern, _, _ in REVERTIBLE_UPDATES)
+    return False
+
+
+def route_exists(app, operation: Operation) -> bool:
+    scope = {"type": "http", "method": operation["method"], "path": _split(operation["path"])[0]}
+    return any(route.matches(scope)[0] == Match.FULL for route in app.router.routes)
+
+
+def asgi_dispatcher(app, base_scope: Dict[str, Any], authorization: str) -> Dispatch:
+    """Build a function that runs one sub-request through the ASGI app"""
+
+    async def dispatch(method: str, path: str, body: Any, headers: Dict[str, str], restore: bool = False) -> Result:
+        path, query = _split(path)
+        payload = b"" if body is None else json.dumps(body).encode("utf-8")
+        raw_headers = [
+            (b"authorization", authorization.encode("latin-1")),
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(payload)).encode("latin-1")),
+        ]
+        raw_headers += [
+            (name.lower().encode("latin-1"), value.encode("latin-1"))
+            for name, value in headers.items()
+            if name.lower() in FORWARDED_HEADERS
+        ]
+        host = dict(base_scope.get("headers") or []).get(b"host")
+        if host:
+            raw_headers.append((b"host", host))
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": method,
+            "scheme": base_scope.get("scheme", "http"),
+            "path": path,
+            "raw_path": path.encode("utf-8"),
+            "root_path": base_scope.get("root_path", ""),
+            "query_string": query.encode("latin-1"),
+            "headers": raw_headers,
+            "client": base_scope.get("client"),
+            "server": base_scope.get("server"),
+            # Admitted as part of the batch, and bound by its deadline
+            BATCH_SCOPE_KEY: True,
+            RESTORE_SCOPE_KEY: restore,
+        }
+
+        sent = False
+
+        async def receive():
+            nonlocal sent
+            if sent:
+                # Nothing else will arrive; wait like a connection that stays open
+                await asyncio.Event().wait()
+            sent = True
+            return {"type": "http.request", "body": payload, "more_body": False}
+
+        response: Result = {"status": 500, "headers": {}, "body": b""}
+        chunks: List[bytes] = []
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = {
+                    name.decode("latin-1").lower(): value.decode("latin-1")
+                    for name, value in message.get("headers", [])
+                }
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        try:
+            await app(scope, receive, send)
+        except Exception as e:
+            # ServerErrorMiddleware re-raises after sending its 500
+            print(f"Warning: Batched {method} {path} failed: {e}")
+        raw = b"".join(chunks)
+        content = None
+        if raw:
+            try:
+                content = json.loads(raw)
+            except ValueError:
+                content = raw.decode("utf-8", errors="replace")
+        return {"status": response["status"], "headers": response["headers"], "body": content}
+
+    return dispatch
+
+
+def _result(operation: Operation, response: Result) -> Result:
+    result = {"id": operation["id"], "status": response["status"], "body": response["body"]}
+    if response["headers"].get("etag"):
+        result["etag"] = response["headers"]["etag"]
+    return result
+
+
+def _skipped(operation: Operation, detail: str) -> Result:
+    return {"id": operation["id"], "status": 424, "body": {"detail": detail}}
+
+
+def _ok(result: Result) -> bool:
+    return result["status"] < 400
+
+
+async def run_concurrent(operations: List[Operation], dispatch: Dispatch) -> List[Result]:
+    """Run operations as soon as the ones they wait for have finished"""
+    waits = plan(operations)
+    tasks: List[asyncio.Task] = []
+
+    async def run(position: int) -> Result:
+        operation = operations[position]
+        for earlier in waits[position]:
+            result = await tasks[earlier]
+            if operations[earlier]["id"] in (operation.get("depends_on") or []) and not _ok(result):
+                return _skipped(operation, f"Dependency {operations[earlier]['id']} failed")
+        response = await dispatch(
+            operation["method"], operation["path"], operation.get("body"), operation.get("headers") or {}
+        )
+        return _result(operation, response)
+
+    for position in range(len(operations)):
+        tasks.append(asyncio.ensure_future(run(position)))
+    return list(await asyncio.gather(*tasks))
+
+
+async def _restore_body(operation: Operation, dispatch: Dispatch) -> Optional[Dict[str, Any]]:
+    """Current values of the fields an update is about to change, directly or through the server"""
+    path = _split(operation["path"])[0]
+    suffix, derived = next((suffix, derived) for pattern, suffix, derived in REVERTIBLE_UPDATES if pattern.match(path))
+    before = await dispatch("GET", path[: len(path) - len(suffix)], None, {})
+    if not _ok(before) or not isinstance(before["body"], dict) or not isinstance(operation.get("body"), dict):
+        return None
+    return {field: before["body"].get(field) for field in (*operation["body"], *derived)}
+
+
+async def run_atomic(operations: List[Operation], dispatch: Dispatch) -> Tuple[List[Result], bool, Optional[bool]]:
+    """
+    Run operations in order, stopping at the first failure and reverting what
+    already ran. Returns the results, whether everything was applied and,
+    after a failure, whether the revert fully succeeded. The result of each
+    write that had to be undone carries "reverted" and, if the revert failed,
+    "revert_status".
+    """
+    results: List[Result] = []
+    undo: List[Tuple[Result, str, str, Any, Dict[str, str]]] = []
+    failed_at = None
+    for position, operation in enumerate(operations):
+        restore = None
+        if operation["method"] == "PUT" and reversible(operation):
+            restore = await _restore_body(operation, dispatch)
+        response = await dispatch(
+            operation["method"], operation["path"], operation.get("body"), operation.get("headers") or {}
+        )
+        result = _result(operation, response)
+        results.append(result)
+        if not _ok(result):
+            failed_at = position
+            break
+        if restore is not None:
+            # Only revert our own write: a later edit by someone else wins
+            headers = {"If-Match": result["etag"]} if result.get("etag") else {}
+            undo.append((result, "PUT", operation["path"], restore, headers))
+        elif operation["method"] == "POST" and reversible(operation) and isinstance(result["body"], dict):
+            undo.append((result, "DELETE", f"{PROJECT_COLLECTION}/{result['body'].get('id')}", None, {}))
+
+    if failed_at is None:
+        return results, True, None
+
+    for operation in operations[failed_at + 1:]:
+        results.append(_skipped(operation, f"Batch stopped at operation {operations[failed_at]['id']}"))
+    rolled_back = True
+    for result, method, path, body, headers in reversed(undo):
+        response = await dispatch(method, path, body, headers, restore=method == "PUT")
+        result["reverted"] = _ok(response)
+        if not result["reverted"]:
+            print(f"Warning: Could not revert batched write {method} {path}: {response['status']}")
+            result["revert_status"] = response["status"]
+            rolled_back = False
+    return results, False, rolled_back
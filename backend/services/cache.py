@@ -0,0 +1,427 @@
+"""
+Two-level cache shared by every worker
+
+Each process keeps a small LRU in front of a shared back end, so hit rates
+hold up when the API runs as many uvicorn workers on several nodes:
+
+- MemoryBackend: a process-local stand-in with the same semantics, used by
+  default and in benchmarks (several caches can share one instance to
+  simulate workers).
+- RedisBackend: any Redis-compatible server (CACHE_BACKEND=redis plus
+  REDIS_URL; needs the `redis` package).
+
+Keys are namespaced ("labmind:<namespace>:<key>") and JSON values expire
+after a per-namespace TTL. invalidate() deletes the shared entry and
+publishes the key so other workers drop their local copies. get_or_load()
+coalesces concurrent misses: one loader call per key per process, and a
+short-lived lock key so only one worker fills a key while the others wait
+for its result. If the shared tier is unreachable the cache degrades to
+calling the loader.
+"""
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from services.instrumentation import record_cache
+
+KEY_PREFIX = "labmind"
+INVALIDATION_CHANNEL = "labmind:cache:invalidate"
+
+Handler = Callable[[str], None]
+
+
+class LocalLRU:
+    """Thread-safe LRU with per-entry expiry"""
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return False, None
+            self._entries.move_to_end(key)
+            return True, value
+
+    def put(self, key: str, value: Any, ttl: float) -> None:
+        if self.max_entries <= 0 or ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, keys: Iterable[str]) -> None:
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class CacheBackend:
+    """Shared tier; values are strings"""
+
+    async def get(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: str, ttl: float) -> None:
+        raise NotImplementedError
+
+    async def add(self, key: str, value: str, ttl: float) -> bool:
+        """Set only if the key does not exist; returns whether it was set"""
+        raise NotImplementedError
+
+    async def delete(self, keys: List[str]) -> None:
+        raise NotImplementedError
+
+    async def release(self, key: str, value: str) -> None:
+        """Delete a key only if it still holds value (lock release)"""
+        raise NotImplementedError
+
+    async def publish(self, channel: str, message: str) -> None:
+        raise NotImplementedError
+
+    async def subscribe(self, channel: str, handler: Handler) -> None:
+        """Call handler for every message published on channel until close()"""
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        pass
+
+
+class MemoryBackend(CacheBackend):
+    """In-process stand-in for Redis"""
+
+    def __init__(self):
+        self._values: Dict[str, Tuple[float, str]] = {}
+        self._subscribers: Dict[str, List[Handler]] = {}
+        self._lock = threading.Lock()
+
+    def _live(self, key: str) -> Optional[str]:
+        entry = self._values.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self._values[key]
+            return None
+        return entry[1]
+
+    async def get(self, key):
+        with self._lock:
+            return self._live(key)
+
+    async def set(self, key, value, ttl):
+        with self._lock:
+            self._values[key] = (time.monotonic() + ttl, value)
+
+    async def add(self, key, value, ttl):
+        with self._lock:
+            if self._live(key) is not None:
+                return False
+            self._values[key] = (time.monotonic() + ttl, value)
+            return True
+
+    async def delete(self, keys):
+        with self._lock:
+            for key in keys:
+                self._values.pop(key, None)
+
+    async def release(self, key, value):
+        with self._lock:
+            if self._live(key) == value:
+                del self._values[key]
+
+    async def publish(self, channel, message):
+        for handler in list(self._subscribers.get(channel, ())):
+            handler(message)
+
+    async def subscribe(self, channel, handler):
+        self._subscribers.setdefault(channel, []).append(handler)
+
+
+# Delete the lock key only if this worker still owns it
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class RedisBackend(CacheBackend):
+    """Shared tier on a Redis-compatible server (redis.asyncio)"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self._redis = None
+        self._listeners: List[asyncio.Task] = []
+
+    def _client(self):
+        if self._redis is None:
+            import redis.asyncio as redis
+
+            self._redis = redis.from_url(self.url, decode_responses=True)
+        return self._redis
+
+    async def get(self, key):
+        return await self._client().get(key)
+
+    async def set(self, key, value, ttl):
+        await self._client().set(key, value, px=max(1, int(ttl * 1000)))
+
+    async def add(self, key, value, ttl):
+        return bool(await self._client().set(key, value, px=max(1, int(ttl * 1000)), nx=True))
+
+    async def delete(self, keys):
+        if keys:
+            await self._client().delete(*keys)
+
+    async def release(self, key, value):
+        await self._client().eval(_RELEASE_SCRIPT, 1, key, value)
+
+    async def publish(self, channel, message):
+        await self._client().publish(channel, message)
+
+    async def subscribe(self, channel, handler):
+        self._listeners.append(asyncio.create_task(self._listen(channel, handler)))
+
+    async def _listen(self, channel: str, handler: Handler) -> None:
+        while True:
+            pubsub = self._client().pubsub()
+            try:
+                await pubsub.subscribe(channel)
+                # Messages may have been missed while disconnected
+                handler("*")
+                async for message in pubsub.listen():
+                    if message.get("type") == "message":
+                        handler(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Warning: Cache invalidation subscription lost: {e}")
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.close()
+
+    async def close(self):
+        for task in self._listeners:
+            task.cancel()
+        # Let each listener close its pub/sub connection before the client goes
+        await asyncio.gather(*self._listeners, return_exceptions=True)
+        self._listeners.clear()
+        if self._redis is not None:
+            await self._redis.close()
+            self._redis = None
+
+
+class TwoLevelCache:
+    """Local LRU in front of a shared CacheBackend"""
+
+    def __init__(
+        self,
+        backend: CacheBackend,
+        local_max_entries: int = 10000,
+        local_ttl: float = 30.0,
+        lock_ttl: float = 30.0,
+    ):
+        self.backend = backend
+        self.local = LocalLRU(local_max_entries)
+        # Local copies live at most this long, bounding staleness if an
+        # invalidation message is lost
+        self.local_ttl = local_ttl
+        # How long one worker may hold a key's fill lock
+        self.lock_ttl = lock_ttl
+        self.instance_id = uuid.uuid4().hex
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._backend_warned = False
+
+    @staticmethod
+    def key(namespace: str, key: str) -> str:
+        return f"{KEY_PREFIX}:{namespace}:{key}"
+
+    async def start(self) -> None:
+        """Subscribe to invalidations from other workers"""
+        await self._safe(self.backend.subscribe(INVALIDATION_CHANNEL, self._on_invalidate))
+
+    async def close(self) -> None:
+        await self.backend.close()
+
+    def _on_invalidate(self, message: str) -> None:
+        if message == "*":
+            self.local.clear()
+            return
+        try:
+            payload = json.loads(message)
+        except ValueError:
+            return
+        if payload.get("origin") != self.instance_id:
+            self.local.discard(payload.get("keys", []))
+
+    async def _safe(self, call: Awaitable, default: Any = None) -> Any:
+        # The shared tier is an optimization; never fail a request over it
+        try:
+            result = await call
+            self._backend_warned = False
+            return result
+        except Exception as e:
+            if not self._backend_warned:
+                print(f"Warning: Shared cache unavailable: {e}")
+                self._backend_warned = True
+            return default
+
+    @staticmethod
+    def _jitter(ttl: float) -> float:
+        # Spread expiries so keys filled together do not all miss together
+        return ttl * random.uniform(0.9, 1.0)
+
+    async def get(self, namespace: str, key: str) -> Optional[Any]:
+        full_key = self.key(namespace, key)
+        hit, value = self.local.get(full_key)
+        record_cache(f"{namespace}_local", hit)
+        if hit:
+            return value
+        raw = await self._safe(self.backend.get(full_key))
+        record_cache(f"{namespace}_shared", raw is not None)
+        if raw is None:
+            return None
+        value = json.loads(raw)
+        self.local.put(full_key, value, self.local_ttl)
+        return value
+
+    async def set(self, namespace: str, key: str, value: Any, ttl: float) -> None:
+        if ttl <= 0:
+            return
+        full_key = self.key(namespace, key)
+        ttl = self._jitter(ttl)
+        self.local.put(full_key, value, min(ttl, self.local_ttl))
+        await self._safe(self.backend.set(full_key, json.dumps(value), ttl))
+
+    async def invalidate(self, namespace: str, *keys: str) -> None:
+        """Drop keys here, in the shared tier and in every other worker"""
+        full_keys = [self.key(namespace, key) for key in keys]
+        self.local.discard(full_keys)
+        await self._safe(self.backend.delete(full_keys))
+        message = json.dumps({"origin": self.instance_id, "keys": full_keys})
+        await self._safe(self.backend.publish(INVALIDATION_CHANNEL, message))
+
+    async def get_or_load(
+        self,
+        namespace: str,
+        key: str,
+        loader: Callable[[], Awaitable[Any]],
+        ttl: float,
+    ) -> Any:
+        """
+        Return the cached value or await loader() to produce it. None results
+        are returned but not cached. With ttl <= 0 the cache is bypassed.
+        """
+        if ttl <= 0:
+            return await loader()
+        full_key = self.key(namespace, key)
+        hit, value = self.local.get(full_key)
+        record_cache(f"{namespace}_local", hit)
+        if hit:
+            return value
+
+        # One load per key per process; later callers share its result
+        inflight = self._inflight.get(full_key)
+        if inflight is not None:
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                if not inflight.cancelled():
+                    raise
+                # The request doing the load was cancelled, not this one
+                return await self.get_or_load(namespace, key, loader, ttl)
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[full_key] = future
+        try:
+            value = await self._load_shared(namespace, key, full_key, loader, ttl)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark the exception retrieved when nobody else was waiting
+            future.exception()
+            raise
+        finally:
+            del self._inflight[full_key]
+
+    async def _read_shared(self, full_key: str) -> Tuple[bool, Any]:
+        raw = await self._safe(self.backend.get(full_key))
+        if raw is None:
+            return False, None
+        value = json.loads(raw)
+        self.local.put(full_key, value, self.local_ttl)
+        return True, value
+
+    async def _load_shared(self, namespace, key, full_key, loader, ttl) -> Any:
+        hit, value = await self._read_shared(full_key)
+        record_cache(f"{namespace}_shared", hit)
+        if hit:
+            return value
+
+        # Across workers, whoever takes the fill lock calls the loader and
+        # the rest poll the shared tier for its result
+        lock_key = f"{full_key}:lock"
+        token = uuid.uuid4().hex
+        locked = await self._safe(self.backend.add(lock_key, token, self.lock_ttl), default=True)
+        if not locked:
+            deadline = time.monotonic() + self.lock_ttl
+            delay = 0.01
+            while time.monotonic() < deadline:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 0.25)
+                hit, value = await self._read_shared(full_key)
+                if hit:
+                    return value
+                if await self._safe(self.backend.get(lock_key)) is None:
+                    # The holder gave up (failed or produced None)
+                    break
+        try:
+            value = await loader()
+            if value is not None:
+                await self.set(namespace, key, value, ttl)
+            return value
+        finally:
+            if locked:
+                await self._safe(self.backend.release(lock_key, token))
+
+
+def create_cache() -> TwoLevelCache:
+    """Build the cache from CACHE_BACKEND (memory or redis)"""
+    backend_name = os.getenv("CACHE_BACKEND", "memory").lower()
+    if backend_name == "redis":
+        backend: CacheBackend = RedisBackend(os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+    elif backend_name == "memory":
+        backend = MemoryBackend()
+    else:
+        raise ValueError(f"Unknown CACHE_BACKEND: {backend_name}")
+    return TwoLevelCache(
+        backend,
+        local_max_entries=int(os.getenv("CACHE_LOCAL_ENTRIES", "10000")),
+        local_ttl=float(os.getenv("CACHE_LOCAL_TTL_SECONDS", "30")),
+    )
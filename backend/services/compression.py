@@ -0,0 +1,188 @@
+"""
+Response compression negotiated from Accept-Encoding
+
+Text responses of at least COMPRESSION_MIN_BYTES are compressed with brotli
+when the client accepts it and the brotli package is installed, otherwise
+with gzip. Unlike Starlette's GZipMiddleware, compressed GET bodies that
+carry an ETag are kept in a small LRU keyed on (ETag, encoding), so repeat
+reads of an unchanged notebook are not compressed again. Streamed responses
+are compressed incrementally; event streams are left alone so each event is
+delivered as it is sent. A compressed response's ETag gets a per-coding
+suffix ("-gz", "-br"), which the conditional request checks strip again.
+"""
+import asyncio
+import os
+import zlib
+from typing import Dict, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+
+from services.http_cache import ResponseCache, encoded_etag
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", "true").lower() == "true"
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "1"))
+BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+COMPRESSIBLE_TYPES = {"application/json", "application/x-ipynb+json", "text/plain", "text/html", "text/csv"}
+# Larger bodies are compressed in a worker thread (zlib and brotli release the GIL)
+OFFLOAD_BYTES = 256 * 1024
+
+
+def negotiate(accept_encoding: Optional[str]) -> Optional[str]:
+    """Preferred supported content coding ("br" or "gzip"), or None"""
+    if not accept_encoding:
+        return None
+    weights: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        weight = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[coding.strip().lower()] = weight
+    available = ["br", "gzip"] if brotli is not None else ["gzip"]
+    best, best_weight = None, 0.0
+    for coding in available:
+        weight = weights.get(coding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = coding, weight
+    return best
+
+
+class _Compressor:
+    def __init__(self, encoding: str):
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=BROTLI_QUALITY)
+            self._zlib = None
+        else:
+            self._brotli = None
+            # wbits 31: gzip container
+            self._zlib = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def feed(self, data: bytes) -> bytes:
+        return self._brotli.process(data) if self._brotli else self._zlib.compress(data)
+
+    def finish(self) -> bytes:
+        return self._brotli.finish() if self._brotli else self._zlib.flush()
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    compressor = _Compressor(encoding)
+    return compressor.feed(body) + compressor.finish()
+
+
+class CompressionMiddleware:
+    """ASGI middleware that compresses eligible responses"""
+
+    def __init__(
+        self,
+        app,
+        enabled: bool = COMPRESSION_ENABLED,
+        minimum_size: int = COMPRESSION_MIN_BYTES,
+        cache_entries: int = int(os.getenv("COMPRESSION_CACHE_ENTRIES", "256")),
+    ):
+        self.app = app
+        self.enabled = enabled
+        self.minimum_size = minimum_size
+        self.cache = ResponseCache(max_entries=cache_entries)
+
+    async def __call__(self, scope, receive, send):
+        if not self.enabled or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        mode = None  # "plain", "stream" once the first body message is seen
+        compressor: Optional[_Compressor] = None
+
+        async def send_compressed(message):
+            nonlocal start_message, mode, compressor
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if mode is None:
+                headers = MutableHeaders(raw=list(start_message["headers"]))
+                start = {**start_message, "headers": headers.raw}
+                if start_message["status"] == 304:
+                    self._revalidated_etag(scope, headers, encoding)
+                if not self._compressible(headers) or (not more_body and len(body) < self.minimum_size):
+                    mode = "plain"
+                    await send(start)
+                    await send(message)
+                    return
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                if "etag" in headers:
+                    headers["ETag"] = encoded_etag(headers["etag"], encoding)
+                if more_body:
+                    mode = "stream"
+                    del headers["Content-Length"]
+                    compressor = _Compressor(encoding)
+                    await send(start)
+                else:
+                    compressed = await self._compress_whole(scope, headers, body, encoding)
+                    headers["Content-Length"] = str(len(compressed))
+                    await send(start)
+                    await send({"type": "http.response.body", "body": compressed})
+                    return
+
+            if mode == "plain":
+                await send(message)
+                return
+            data = compressor.feed(body)
+            if not more_body:
+                data += compressor.finish()
+            if data or not more_body:
+                await send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
+
+    @staticmethod
+    def _compressible(headers: MutableHeaders) -> bool:
+        if "content-encoding" in headers:
+            return False
+        content_type = headers.get("content-type", "").split(";")[0].strip().lower()
+        return content_type in COMPRESSIBLE_TYPES
+
+    @staticmethod
+    def _revalidated_etag(scope, headers: MutableHeaders, encoding: str) -> None:
+        # A 304 repeats the ETag of the representation the client holds
+        etag = headers.get("etag")
+        if not etag:
+            return
+        encoded = encoded_etag(etag, encoding)
+        if encoded in (Headers(scope=scope).get("if-none-match") or ""):
+            headers["ETag"] = encoded
+
+    async def _compress_whole(self, scope, headers: MutableHeaders, body: bytes, encoding: str) -> bytes:
+        etag = headers.get("etag")
+        key = f"{etag}:{encoding}" if etag and scope["method"] == "GET" else None
+        if key:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+        if len(body) >= OFFLOAD_BYTES:
+            compressed = await asyncio.to_thread(compress, body, encoding)
+        else:
+            compressed = compress(body, encoding)
+        if key:
+            self.cache.put(key, compressed)
+        return compressed
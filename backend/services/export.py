@@ -0,0 +1,644 @@
+"""
+Project export (.ipynb, HTML, zip bundle) and bundle import
+
+Exports are generated a piece at a time and streamed: notebook cells are
+read from the repository a page at a time and each is encoded on its own,
+and stored files are piped from the Storage API into the zip chunk by chunk.
+Memory stays flat however large the project is. The zip is written without
+seeking, so each entry's CRC and sizes follow its data in a data descriptor
+(zip64 throughout, so entries over 4 GiB are fine). Files are stored as
+they are; the notebook and plan are deflated.
+
+A bundle holds:
+
+    project.json        title, description, quiz responses and status
+    notebook.ipynb      nbformat 4.5; cell outputs become stream/error outputs
+    agent_plan.json     the agent session's steps, status, conversation and
+                        settings (the semantic cache opt-out, template opt-in)
+    files/<name>        every uploaded file
+
+Imports are spooled to a temporary file (in memory up to
+IMPORT_SPOOL_BYTES), then read back entry by entry; a plain .ipynb is also
+accepted. Declared sizes are checked before anything is unpacked, and zipfile
+refuses to read past them, so a zip bomb cannot outgrow IMPORT_MAX_BYTES.
+"""
+import asyncio
+import html
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import tempfile
+import time
+import uuid
+import zipfile
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, IO, List, Optional, Set, Tuple
+
+from services.object_store import STORAGE_CHUNK_BYTES, ObjectNotFound, ObjectStore
+from services.package_manifest import build_manifest, step_sources
+from services.serialization import dumps
+
+Row = Dict[str, Any]
+
+EXPORT_FORMATS = ("ipynb", "html", "zip")
+EXPORT_MEDIA_TYPES = {
+    "ipynb": "application/x-ipynb+json",
+    "html": "text/html; charset=utf-8",
+    "zip": "application/zip",
+}
+EXPORT_CELL_PAGE_SIZE = int(os.getenv("EXPORT_CELL_PAGE_SIZE", "100"))
+EXPORT_FILES_PAGE_SIZE = 500
+# Encoded pieces are collected up to this size before being sent
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+IMPORT_MAX_BYTES = int(os.getenv("IMPORT_MAX_BYTES", str(10 * 1024 ** 3)))
+IMPORT_MAX_FILES = int(os.getenv("IMPORT_MAX_FILES", "10000"))
+IMPORT_MAX_NOTEBOOK_BYTES = int(os.getenv("IMPORT_MAX_NOTEBOOK_BYTES", str(64 * 1024 ** 2)))
+IMPORT_SPOOL_BYTES = int(os.getenv("IMPORT_SPOOL_BYTES", str(1024 * 1024)))
+
+BUNDLE_FORMAT = "labmind-project"
+BUNDLE_VERSION = 1
+PROJECT_FIELDS = ("title", "description", "quiz_responses", "status")
+PLAN_FIELDS = ("steps", "current_step", "status", "conversation_history", "metadata")
+# Agent metadata a bundle carries: the project's own boolean settings. The
+# rest is server bookkeeping (template scoring, plan source) that must not be
+# forged by an upload, or derived data (the package manifest) that import
+# rebuilds from the steps.
+PLAN_SETTINGS = ("semantic_cache", "plan_templates")
+KERNELSPEC = {"name": "python3", "display_name": "Python 3 (Pyodide)", "language": "python"}
+
+# nbformat 4.5 cell ids
+CELL_ID_INVALID = re.compile(r"[^A-Za-z0-9_-]")
+ANSI_ESCAPE = re.compile(r"\x1b\[[0-9;]*[A-Za-z]")
+# Same rule as components/FileUpload.tsx
+STORAGE_NAME_INVALID = re.compile(r"[^a-zA-Z0-9.-]")
+
+
+class InvalidUpload(ValueError):
+    """The upload is not a notebook or project bundle that can be imported"""
+
+
+class UploadTooLarge(ValueError):
+    """The upload (or what it unpacks to) is over IMPORT_MAX_BYTES"""
+
+
+# Notebook conversion
+
+def ipynb_outputs(output: Optional[Row]) -> List[Row]:
+    if not output or output.get("content") in (None, ""):
+        return []
+    text = str(output["content"])
+    if output.get("type") != "error":
+        return [{"output_type": "stream", "name": "stdout", "text": text}]
+    # Pyodide errors end with "NameError: name 'x' is not defined"
+    last_line = text.strip().splitlines()[-1] if text.strip() else ""
+    name, separator, value = last_line.partition(": ")
+    if not separator or not name.replace(".", "").isidentifier():
+        name, value = "Error", last_line
+    return [{"output_type": "error", "ename": name, "evalue": value, "traceback": text.splitlines()}]
+
+
+def ipynb_cell(cell: Row) -> Row:
+    cell_id = CELL_ID_INVALID.sub("-", str(cell.get("id") or ""))[:64] or uuid.uuid4().hex
+    source = cell.get("content") or ""
+    if cell.get("type") == "markdown":
+        return {"cell_type": "markdown", "id": cell_id, "metadata": {}, "source": source}
+    return {
+        "cell_type": "code",
+        "id": cell_id,
+        "metadata": {},
+        "execution_count": None,
+        "source": source,
+        "outputs": ipynb_outputs(cell.get("output")),
+    }
+
+
+def _text(value: Any) -> str:
+    # nbformat multiline strings may be split into a list of lines
+    return "".join(value) if isinstance(value, list) else str(value or "")
+
+
+def labmind_output(outputs: List[Row]) -> Optional[Row]:
+    """Collapse ipynb outputs into the notebook's single output per cell"""
+    for output in outputs:
+        if output.get("output_type") == "error":
+            traceback = "\n".join(_text(line) for line in output.get("traceback") or [])
+            content = ANSI_ESCAPE.sub("", traceback) or f"{output.get('ename')}: {output.get('evalue')}"
+            return {"type": "error", "content": content}
+    texts = []
+    for output in outputs:
+        if output.get("output_type") == "stream":
+            texts.append(_text(output.get("text")))
+        elif output.get("output_type") in ("execute_result", "display_data"):
+            texts.append(_text((output.get("data") or {}).get("text/plain")))
+    text = "".join(texts)
+    return {"type": "output", "content": text} if text else None
+
+
+def labmind_cell(cell: Row) -> Row:
+    if cell.get("cell_type") == "code":
+        return {
+            "id": str(cell.get("id") or uuid.uuid4()),
+            "type": "code",
+            "content": _text(cell.get("source")),
+            "output": labmind_output(cell.get("outputs") or []),
+        }
+    # Markdown and raw cells
+    return {"id": str(cell.get("id") or uuid.uuid4()), "type": "markdown", "content": _text(cell.get("source"))}
+
+
+def plan_settings(metadata: Any) -> Row:
+    """The exportable settings in an agent session's metadata"""
+    if not isinstance(metadata, dict):
+        return {}
+    return {key: metadata[key] for key in PLAN_SETTINGS if isinstance(metadata.get(key), bool)}
+
+
+def notebook_metadata(project: Row, notebook: Row) -> Row:
+    return {
+        "kernelspec": KERNELSPEC,
+        "language_info": {"name": "python"},
+        "labmind": {"title": project.get("title"), "metadata": notebook.get("metadata") or {}},
+    }
+
+
+async def iter_cells(repository, project_id: str, page_size: int = EXPORT_CELL_PAGE_SIZE) -> AsyncIterator[Row]:
+    """A notebook's cells, streamed by the repository a page at a time"""
+    async for cell in repository.iter_notebook_cells(project_id, page_size):
+        yield cell
+
+
+async def iter_ipynb(cells: AsyncIterator[Row], metadata: Row) -> AsyncIterator[bytes]:
+    # Cells go last so everything before them is known up front
+    buffer = bytearray(b'{"nbformat":4,"nbformat_minor":5,"metadata":' + dumps(metadata) + b',"cells":[')
+    first = True
+    async for cell in cells:
+        if not first:
+            buffer += b","
+        buffer += dumps(ipynb_cell(cell))
+        first = False
+        if len(buffer) >= EXPORT_CHUNK_BYTES:
+            yield bytes(buffer)
+            buffer.clear()
+    buffer += b"]}"
+    yield bytes(buffer)
+
+
+# HTML
+
+HTML_HEAD = """<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>
+body {{ font-family: system-ui, sans-serif; max-width: 60rem; margin: 2rem auto; padding: 0 1rem; color: #1f2937; }}
+pre {{ background: #f3f4f6; padding: 0.75rem; overflow-x: auto; white-space: pre-wrap; word-break: break-word; }}
+.output {{ background: #fff; border-left: 3px solid #9ca3af; }}
+.error {{ background: #fef2f2; border-left: 3px solid #dc2626; }}
+.cell {{ margin: 1.5rem 0; }}
+</style>
+</head>
+<body>
+<h1>{title}</h1>
+"""
+
+INLINE_CODE = re.compile(r"`([^`]+)`")
+BOLD = re.compile(r"\*\*(.+?)\*\*")
+ITALIC = re.compile(r"(?<![*\w])\*(?![\s*])(.+?)(?<![\s*])\*(?![*\w])")
+HEADING = re.compile(r"^(#{1,6})\s+(.*?)\s*#*$")
+BULLET = re.compile(r"^\s*[-*+]\s+(.*)$")
+NUMBERED = re.compile(r"^\s*\d+[.)]\s+(.*)$")
+
+
+def _inline(text: str) -> str:
+    # Odd parts are inside backticks and only escaped
+    parts = INLINE_CODE.split(text)
+    rendered = []
+    for index, part in enumerate(parts):
+        if index % 2:
+            rendered.append(f"<code>{html.escape(part)}</code>")
+        else:
+            part = BOLD.sub(r"<strong>\1</strong>", html.escape(part))
+            rendered.append(ITALIC.sub(r"<em>\1</em>", part))
+    return "".join(rendered)
+
+
+def render_markdown(text: str) -> str:
+    """Headings, paragraphs, lists, fenced code, emphasis and inline code; everything else is escaped text"""
+    blocks: List[str] = []
+    paragraph: List[str] = []
+    items: List[str] = []
+    list_tag: Optional[str] = None
+    fence: Optional[List[str]] = None
+
+    def flush() -> None:
+        nonlocal list_tag
+        if paragraph:
+            blocks.append(f"<p>{_inline(' '.join(paragraph))}</p>")
+            paragraph.clear()
+        if items:
+            blocks.append(f"<{list_tag}>" + "".join(f"<li>{_inline(item)}</li>" for item in items) + f"</{list_tag}>")
+            items.clear()
+            list_tag = None
+
+    for line in text.splitlines():
+        stripped = line.strip()
+        if fence is not None:
+            if stripped.startswith("```"):
+                blocks.append(f"<pre><code>{html.escape(chr(10).join(fence))}</code></pre>")
+                fence = None
+            else:
+                fence.append(line)
+            continue
+        if stripped.startswith("```"):
+            flush()
+            fence = []
+            continue
+        if not stripped:
+            flush()
+            continue
+        heading = HEADING.match(stripped)
+        if heading:
+            flush()
+            level = len(heading.group(1))
+            blocks.append(f"<h{level}>{_inline(heading.group(2))}</h{level}>")
+            continue
+        for tag, pattern in (("ul", BULLET), ("ol", NUMBERED)):
+            item = pattern.match(line)
+            if item:
+                if paragraph or list_tag not in (None, tag):
+                    flush()
+                list_tag = tag
+                items.append(item.group(1))
+                break
+        else:
+            if items:
+                flush()
+            paragraph.append(stripped)
+    if fence is not None:
+        blocks.append(f"<pre><code>{html.escape(chr(10).join(fence))}</code></pre>")
+    flush()
+    return "\n".join(blocks)
+
+
+def render_cell(cell: Row) -> str:
+    content = cell.get("content") or ""
+    if cell.get("type") == "markdown":
+        return f'<div class="cell markdown">\n{render_markdown(content)}\n</div>\n'
+    parts = [f'<div class="cell code">\n<pre><code>{html.escape(content)}</code></pre>\n']
+    output = cell.get("output")
+    if output and output.get("content"):
+        css = "error" if output.get("type") == "error" else "output"
+        parts.append(f'<pre class="{css}">{html.escape(str(output["content"]))}</pre>\n')
+    parts.append("</div>\n")
+    return "".join(parts)
+
+
+def render_steps(steps: List[Row]) -> str:
+    parts = ["<h2>Analysis plan</h2>\n<ol>\n"]
+    for step in steps:
+        parts.append(
+            f"<li><strong>{html.escape(str(step.get('title') or ''))}</strong>"
+            f"<p>{html.escape(str(step.get('description') or ''))}</p>"
+        )
+        if step.get("code"):
+            parts.append(f"<pre><code>{html.escape(str(step['code']))}</code></pre>")
+        parts.append("</li>\n")
+    parts.append("</ol>\n")
+    return "".join(parts)
+
+
+async def iter_html(project: Row, cells: AsyncIterator[Row], steps: List[Row]) -> AsyncIterator[bytes]:
+    head = HTML_HEAD.format(title=html.escape(project.get("title") or "Untitled project"))
+    if project.get("description"):
+        head += f'<p class="description">{html.escape(project["description"])}</p>\n'
+    buffer = head
+    async for cell in cells:
+        buffer += render_cell(cell)
+        if len(buffer) >= EXPORT_CHUNK_BYTES:
+            yield buffer.encode("utf-8")
+            buffer = ""
+    if steps:
+        buffer += render_steps(steps)
+    yield (buffer + "</body>\n</html>\n").encode("utf-8")
+
+
+# Zip bundles
+
+class _ZipSink:
+    """Unseekable write target for zipfile that hands back what was written so far"""
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._position = 0
+
+    def write(self, data) -> int:
+        self._buffer += data
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        pass
+
+    @property
+    def pending(self) -> int:
+        return len(self._buffer)
+
+    def take(self) -> bytes:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+class ZipStream:
+    """A zip archive produced a piece at a time"""
+
+    def __init__(self):
+        self._sink = _ZipSink()
+        self._zip = zipfile.ZipFile(
+            self._sink, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=1, allowZip64=True
+        )
+
+    async def entry(
+        self,
+        name: str,
+        chunks: AsyncIterator[bytes],
+        compress: bool = True,
+        date_time: Optional[Tuple[int, ...]] = None,
+    ) -> AsyncIterator[bytes]:
+        """Add an entry from a stream of chunks, yielding archive bytes as they are ready"""
+        target: Any = name
+        if not compress or date_time:
+            target = zipfile.ZipInfo(name, date_time or time.localtime()[:6])
+            target.compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+        with self._zip.open(target, "w", force_zip64=True) as entry:
+            async for chunk in chunks:
+                entry.write(chunk)
+                if self._sink.pending >= EXPORT_CHUNK_BYTES:
+                    yield self._sink.take()
+        yield self._sink.take()
+
+    def close(self) -> bytes:
+        """Write the central directory and return the archive's last bytes"""
+        self._zip.close()
+        return self._sink.take()
+
+
+async def _once(data: bytes) -> AsyncIterator[bytes]:
+    yield data
+
+
+async def _prepend(first: bytes, rest: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    yield first
+    async for chunk in rest:
+        yield chunk
+
+
+def archive_name(name: str, taken: Set[str]) -> str:
+    """File name for files/ that is unique within the archive"""
+    base = posixpath.basename(name.replace("\\", "/")).strip() or "file"
+    stem, extension = posixpath.splitext(base)
+    candidate, copy = base, 2
+    while candidate in taken:
+        candidate = f"{stem} ({copy}){extension}"
+        copy += 1
+    taken.add(candidate)
+    return candidate
+
+
+def zip_date_time(timestamp: Optional[str]) -> Tuple[int, ...]:
+    try:
+        moment = datetime.fromisoformat((timestamp or "").replace("Z", "+00:00"))
+    except ValueError:
+        return time.localtime()[:6]
+    # Zip timestamps start in 1980
+    return max(moment.timetuple()[:6], (1980, 1, 1, 0, 0, 0))
+
+
+async def iter_files(repository, project_id: str, page_size: int = EXPORT_FILES_PAGE_SIZE) -> AsyncIterator[Row]:
+    offset = 0
+    while True:
+        page = await repository.list_files(project_id, limit=page_size, offset=offset)
+        for row in page:
+            yield row
+        if len(page) < page_size:
+            return
+        offset += len(page)
+
+
+async def iter_bundle(
+    repository, store: ObjectStore, project: Row, notebook: Optional[Row], session: Optional[Row]
+) -> AsyncIterator[bytes]:
+    archive = ZipStream()
+    manifest = {
+        "format": BUNDLE_FORMAT,
+        "version": BUNDLE_VERSION,
+        "exported_at": datetime.now(timezone.utc).isoformat(),
+        "project": {field: project.get(field) for field in PROJECT_FIELDS},
+    }
+    async for piece in archive.entry("project.json", _once(dumps(manifest))):
+        yield piece
+    if notebook is not None:
+        cells = iter_cells(repository, project["id"])
+        async for piece in archive.entry("notebook.ipynb", iter_ipynb(cells, notebook_metadata(project, notebook))):
+            yield piece
+    if session is not None:
+        plan = {field: session.get(field) for field in PLAN_FIELDS}
+        plan["metadata"] = plan_settings(plan["metadata"])
+        async for piece in archive.entry("agent_plan.json", _once(dumps(plan))):
+            yield piece
+
+    taken: Set[str] = set()
+    async for row in iter_files(repository, project["id"]):
+        chunks = store.iter_object(row["path"])
+        # Open the object before writing its entry, so a missing one is skipped
+        try:
+            first = await chunks.__anext__()
+        except StopAsyncIteration:
+            first = b""
+        except ObjectNotFound:
+            print(f"Warning: Skipping missing object {row['path']} in export of project {project['id']}")
+            continue
+        name = f"files/{archive_name(row['name'], taken)}"
+        entry = archive.entry(name, _prepend(first, chunks), compress=False, date_time=zip_date_time(row.get("created_at")))
+        async for piece in entry:
+            yield piece
+    yield archive.close()
+
+
+def export_filename(project: Row, export_format: str) -> str:
+    stem = re.sub(r"[^A-Za-z0-9._-]+", "_", project.get("title") or "").strip("._") or "project"
+    return f"{stem[:100]}.{export_format}"
+
+
+# Import
+
+async def spool_upload(chunks: AsyncIterator[bytes], max_bytes: int = IMPORT_MAX_BYTES) -> IO[bytes]:
+    """Copy a request body to a temporary file, kept in memory while it is small"""
+    spool = tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_BYTES)
+    size = 0
+    try:
+        async for chunk in chunks:
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadTooLarge(f"Upload is larger than {max_bytes} bytes")
+            spool.write(chunk)
+        spool.seek(0)
+    except BaseException:
+        spool.close()
+        raise
+    return spool
+
+
+def _load_json(handle: IO[bytes], size: int, what: str) -> Any:
+    if size > IMPORT_MAX_NOTEBOOK_BYTES:
+        raise UploadTooLarge(f"{what} is larger than {IMPORT_MAX_NOTEBOOK_BYTES} bytes")
+    try:
+        return json.load(handle)
+    except (ValueError, UnicodeDecodeError):
+        raise InvalidUpload(f"{what} is not valid JSON") from None
+
+
+def _notebook_cells(notebook: Any) -> List[Row]:
+    if not isinstance(notebook, dict) or not isinstance(notebook.get("cells"), list):
+        raise InvalidUpload("notebook.ipynb is not a Jupyter notebook")
+    if notebook.get("nbformat", 4) < 4:
+        raise InvalidUpload("Only nbformat 4 notebooks can be imported")
+    return [labmind_cell(cell) for cell in notebook["cells"] if isinstance(cell, dict)]
+
+
+class ProjectUpload:
+    """A parsed upload: project fields, notebook and plan, and file entries still in the archive"""
+
+    def __init__(self, spool: IO[bytes]):
+        self.spool = spool
+        self.archive: Optional[zipfile.ZipFile] = None
+        self.project: Row = {}
+        self.cells: Optional[List[Row]] = None
+        self.notebook_metadata: Row = {}
+        self.plan: Optional[Row] = None
+        self.files: List[zipfile.ZipInfo] = []
+
+    def close(self) -> None:
+        if self.archive is not None:
+            self.archive.close()
+        self.spool.close()
+
+    def _read_notebook(self, notebook: Any) -> None:
+        self.cells = _notebook_cells(notebook)
+        labmind = (notebook.get("metadata") or {}).get("labmind") or {}
+        self.notebook_metadata = labmind.get("metadata") or {}
+        if labmind.get("title"):
+            self.project.setdefault("title", labmind["title"])
+
+    def _read_bundle(self) -> None:
+        self.archive = archive = zipfile.ZipFile(self.spool)
+        entries = {info.filename: info for info in archive.infolist() if not info.is_dir()}
+        if sum(info.file_size for info in entries.values()) > IMPORT_MAX_BYTES:
+            raise UploadTooLarge(f"Bundle unpacks to more than {IMPORT_MAX_BYTES} bytes")
+
+        if "project.json" in entries:
+            info = entries["project.json"]
+            with archive.open(info) as handle:
+                manifest = _load_json(handle, info.file_size, "project.json")
+            if not isinstance(manifest, dict) or manifest.get("format") != BUNDLE_FORMAT:
+                raise InvalidUpload("project.json is not a LabMind project manifest")
+            if manifest.get("version", BUNDLE_VERSION) > BUNDLE_VERSION:
+                raise InvalidUpload("The bundle was exported by a newer version of LabMind")
+            project = manifest.get("project") or {}
+            self.project = {field: project[field] for field in PROJECT_FIELDS if project.get(field) is not None}
+
+        notebooks = [name for name in entries if name.endswith(".ipynb") and "/" not in name]
+        if "notebook.ipynb" in entries or len(notebooks) == 1:
+            info = entries.get("notebook.ipynb") or entries[notebooks[0]]
+            with archive.open(info) as handle:
+                self._read_notebook(_load_json(handle, info.file_size, info.filename))
+
+        if "agent_plan.json" in entries:
+            info = entries["agent_plan.json"]
+            with archive.open(info) as handle:
+                plan = _load_json(handle, info.file_size, "agent_plan.json")
+            if not isinstance(plan, dict) or not isinstance(plan.get("steps", []), list):
+                raise InvalidUpload("agent_plan.json is not an agent plan")
+            self.plan = {field: plan[field] for field in PLAN_FIELDS if field in plan}
+            self.plan["metadata"] = plan_settings(plan.get("metadata"))
+
+        self.files = [
+            info for name, info in entries.items()
+            if name.startswith("files/") and posixpath.basename(name)
+        ]
+        if len(self.files) > IMPORT_MAX_FILES:
+            raise UploadTooLarge(f"Bundle has more than {IMPORT_MAX_FILES} files")
+        if self.cells is None and self.plan is None and not self.files:
+            raise InvalidUpload("The zip contains no notebook, agent plan or files")
+
+
+def read_upload(spool: IO[bytes]) -> ProjectUpload:
+    """Parse a spooled bundle or .ipynb; blocking, so run it in a thread"""
+    upload = ProjectUpload(spool)
+    try:
+        if zipfile.is_zipfile(spool):
+            upload._read_bundle()
+        else:
+            spool.seek(0, os.SEEK_END)
+            size = spool.tell()
+            spool.seek(0)
+            upload._read_notebook(_load_json(spool, size, "Notebook"))
+    except zipfile.BadZipFile as e:
+        upload.close()
+        raise InvalidUpload(f"Corrupt zip file: {e}") from None
+    except BaseException:
+        upload.close()
+        raise
+    return upload
+
+
+async def _read_entry(archive: zipfile.ZipFile, info: zipfile.ZipInfo) -> AsyncIterator[bytes]:
+    # Inflating and disk reads happen in worker threads
+    handle = await asyncio.to_thread(archive.open, info)
+    try:
+        while True:
+            chunk = await asyncio.to_thread(handle.read, STORAGE_CHUNK_BYTES)
+            if not chunk:
+                return
+            yield chunk
+    finally:
+        handle.close()
+
+
+async def import_contents(repository, store: ObjectStore, project_id: str, user_id: str, upload: ProjectUpload) -> None:
+    """Create the notebook, agent session and files of a newly created project"""
+    if upload.cells is not None:
+        await repository.create_notebook(
+            {"project_id": project_id, "cells": upload.cells, "metadata": upload.notebook_metadata}
+        )
+    if upload.plan is not None:
+        manifest = build_manifest(step_sources(upload.plan.get("steps")))
+        await repository.upsert_agent_session({
+            **upload.plan,
+            "metadata": {**upload.plan["metadata"], "package_manifest": manifest},
+            "project_id": project_id,
+        })
+
+    # Paths follow "{project_id}/{timestamp}_{name}"; one millisecond apart so
+    # files with the same name never collide
+    timestamp = int(time.time() * 1000)
+    for index, info in enumerate(upload.files):
+        name = posixpath.basename(info.filename)
+        path = f"{project_id}/{timestamp + index}_{STORAGE_NAME_INVALID.sub('_', name)}"
+        mime_type = mimetypes.guess_type(name)[0]
+        await store.put_object(path, _read_entry(upload.archive, info), mime_type)
+        await repository.create_file({
+            "project_id": project_id,
+            "user_id": user_id,
+            "name": name,
+            "path": path,
+            "size": info.file_size,
+            "mime_type": mime_type,
+        })
@@ -1,26 +1,53 @@
 """
 Gemini API service for LabMind AI Agent
 """
+import asyncio
+import hashlib
 import os
-import google.generativeai as genai
+import threading
 from typing import List, Dict, Any, Optional
 import json
+from services.admission import DeadlineExceeded, check_deadline, within_deadline
+from services.instrumentation import record_gemini_usage, span
 
-# Configure Gemini API
 gemini_api_key = os.getenv("GEMINI_API_KEY")
-if gemini_api_key:
-    genai.configure(api_key=gemini_api_key)
+
+GEMINI_MODEL = "gemini-pro"
+# Identical prompts get the stored answer instead of a new Gemini call
+GEMINI_CACHE_NAMESPACE = "gemini"
+GEMINI_CACHE_TTL_SECONDS = float(os.getenv("GEMINI_CACHE_TTL_SECONDS", "86400"))
 
 
 class GeminiService:
     """Service for interacting with Google Gemini API"""
 
-    def __init__(self):
+    def __init__(self, cache=None):
         if not gemini_api_key:
             raise ValueError("GEMINI_API_KEY environment variable is not set")
-        self.model = genai.GenerativeModel('gemini-pro')
+        # Optional services.cache.TwoLevelCache shared with other workers
+        self.cache = cache
+        self._model = None
+        self._model_lock = threading.Lock()
+
+    @property
+    def model(self):
+        """The Gemini model, created on first use"""
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    # google.generativeai pulls in gRPC and protobuf, which
+                    # dominates cold starts; import it only when needed
+                    import google.generativeai as genai
+
+                    genai.configure(api_key=gemini_api_key)
+                    self._model = genai.GenerativeModel(GEMINI_MODEL)
+        return self._model
 
-    def analyze_research_goal(self, quiz_responses: Dict[str, Any]) -> List[Dict[str, Any]]:
+    def warm_up(self) -> None:
+        """Import and configure the Gemini client ahead of the first request"""
+        self.model
+
+    async def analyze_research_goal(self, quiz_responses: Dict[str, Any]) -> List[Dict[str, Any]]:
         """
         Analyze quiz responses and generate a step-by-step research plan
         
@@ -34,13 +61,15 @@ class GeminiService:
         prompt = self._build_analysis_prompt(quiz_responses)
         
         try:
-            response = self.model.generate_content(prompt)
-            steps = self._parse_steps_response(response.text)
+            text = await self._generate("analyze", prompt)
+            steps = self._parse_steps_response(text)
             return steps
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             raise Exception(f"Error generating research plan: {str(e)}")
 
-    def generate_code_for_step(
+    async def generate_code_for_step(
         self,
         step: Dict[str, Any],
         context: Dict[str, Any],
@@ -50,12 +79,14 @@ class GeminiService:
         prompt = self._build_code_generation_prompt(step, context, previous_code)
         
         try:
-            response = self.model.generate_content(prompt)
-            return self._extract_code_from_response(response.text)
+            text = await self._generate("generate_code", prompt)
+            return self._extract_code_from_response(text)
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             raise Exception(f"Error generating code: {str(e)}")
 
-    def chat_with_agent(
+    async def chat_with_agent(
         self,
         message: str,
         conversation_history: List[Dict[str, str]],
@@ -65,11 +96,39 @@ class GeminiService:
         prompt = self._build_chat_prompt(message, conversation_history, current_steps)
         
         try:
-            response = self.model.generate_content(prompt)
-            return response.text
+            return await self._generate("chat", prompt)
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             raise Exception(f"Error in agent chat: {str(e)}")
 
+    async def _generate(self, operation: str, prompt: str) -> str:
+        """
+        Return Gemini's answer to a prompt, from the cache when possible.
+
+        The wait is bounded by the request deadline. The SDK call itself
+        cannot be interrupted, so with a cache the load carries on after a
+        timeout and its answer is there for the client's retry.
+        """
+        if self.cache is None:
+            return await within_deadline(self._call_model(operation, prompt))
+        key = hashlib.sha256(f"{GEMINI_MODEL}\0{operation}\0{prompt}".encode("utf-8")).hexdigest()
+        check_deadline()
+        return await within_deadline(asyncio.shield(self.cache.get_or_load(
+            GEMINI_CACHE_NAMESPACE,
+            key,
+            lambda: self._call_model(operation, prompt),
+            ttl=GEMINI_CACHE_TTL_SECONDS,
+        )))
+
+    async def _call_model(self, operation: str, prompt: str) -> str:
+        """Call Gemini, timing the call and recording token usage"""
+        with span("gemini"):
+            # The SDK is synchronous; keep it off the event loop
+            response = await asyncio.to_thread(self.model.generate_content, prompt)
+        record_gemini_usage(operation, prompt, response)
+        return response.text
+
     def _build_analysis_prompt(self, quiz_responses: Dict[str, Any]) -> str:
         """Build prompt for analyzing research goals"""
         field = quiz_responses.get('field', 'General')
@@ -0,0 +1,98 @@
+"""
+Conditional request helpers (ETag, If-None-Match, If-Match) and an
+in-process cache of serialized responses keyed on ETag
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+
+def make_etag(row_id: str, updated_at: str) -> str:
+    """Build a strong ETag from a row's id and trigger-maintained updated_at"""
+    digest = hashlib.sha1(f"{row_id}:{updated_at}".encode("utf-8")).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+# Compressed responses carry their own ETag per content coding (RFC 9110
+# 8.8.3), so a cache never pairs a gzip body with a brotli one
+ENCODING_SUFFIXES = {"gzip": "-gz", "br": "-br"}
+
+
+def encoded_etag(etag: str, encoding: str) -> str:
+    """ETag of a representation compressed with the given content coding"""
+    suffix = ENCODING_SUFFIXES[encoding]
+    if etag.endswith('"'):
+        return f"{etag[:-1]}{suffix}\""
+    return f"{etag}{suffix}"
+
+
+def strip_encoding(etag: str) -> str:
+    """ETag of the uncompressed representation behind an encoded_etag"""
+    for suffix in ENCODING_SUFFIXES.values():
+        if etag.endswith(f'{suffix}"'):
+            return f'{etag[:-len(suffix) - 1]}"'
+    return etag
+
+
+def etag_matches(header: Optional[str], etag: str, weak: bool = True) -> bool:
+    """
+    Check an If-None-Match / If-Match header value against an ETag.
+
+    If-None-Match uses weak comparison (a W/ prefix is ignored), If-Match
+    requires strong comparison, so pass weak=False there. Candidates taken
+    from a compressed response have their content-coding suffix removed, as
+    they name the same row version.
+    """
+    if not header:
+        return False
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            if not weak:
+                continue
+            candidate = candidate[2:]
+        if strip_encoding(candidate) == etag:
+            return True
+    return False
+
+
+class ResponseCache:
+    """Thread-safe LRU of serialized response bodies keyed on ETag"""
+
+    def __init__(self, max_entries: int = 512, max_bytes: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, etag: str) -> Optional[bytes]:
+        with self._lock:
+            body = self._entries.get(etag)
+            if body is not None:
+                self._entries.move_to_end(etag)
+            return body
+
+    def put(self, etag: str, body: bytes) -> None:
+        # Bodies larger than a quarter of the budget would just churn the cache
+        if self.max_entries <= 0 or len(body) > self.max_bytes // 4:
+            return
+        with self._lock:
+            previous = self._entries.pop(etag, None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._entries[etag] = body
+            self._size += len(body)
+            while self._entries and (
+                len(self._entries) > self.max_entries or self._size > self.max_bytes
+            ):
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
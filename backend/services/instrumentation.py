@@ -0,0 +1,310 @@
+"""
+Request instrumentation: per-phase spans, Server-Timing headers and
+Prometheus-style metrics
+
+Spans are recorded into a per-request trace held in a context variable, so
+code anywhere in a request (including worker threads started with
+asyncio.to_thread, which copy the context) can time a phase with
+`with span("gemini"):`. Outside a traced request span() is a no-op, and the
+middleware does nothing unless METRICS_ENABLED=true.
+"""
+import os
+import random
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "false").lower() == "true"
+
+# Latency buckets in seconds, from cache hits up to long Gemini generations
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class RequestTrace:
+    """Phase timings collected for a single request"""
+
+    def __init__(self):
+        self.spans: List[Tuple[str, float]] = []
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.spans.append((name, seconds))
+
+    def totals(self) -> Dict[str, float]:
+        totals: Dict[str, float] = {}
+        with self._lock:
+            for name, seconds in self.spans:
+                totals[name] = totals.get(name, 0.0) + seconds
+        return totals
+
+
+_current_trace: ContextVar[Optional[RequestTrace]] = ContextVar("labmind_trace", default=None)
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """Time a phase of the current request; free when tracing is off"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, time.perf_counter() - start)
+
+
+class Histogram:
+    """Cumulative-bucket histogram with label sets, Prometheus style"""
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...], buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels: Tuple[str, ...], value: float) -> None:
+        with self._lock:
+            # [bucket counts..., +Inf count, sum]
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, series in sorted(self._series.items()):
+                base = _format_labels(self.label_names, labels)
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f'{self.name}_bucket{{{base},le="{bound}"}} {int(count)}')
+                lines.append(f'{self.name}_bucket{{{base},le="+Inf"}} {int(series[-2])}')
+                lines.append(f"{self.name}_sum{{{base}}} {series[-1]}")
+                lines.append(f"{self.name}_count{{{base}}} {int(series[-2])}")
+        return lines
+
+
+class CounterMetric:
+    """Monotonic counter with label sets"""
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...]):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def inc(self, labels: Tuple[str, ...], amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] += amount
+
+    def value(self, labels: Tuple[str, ...]) -> float:
+        with self._lock:
+            return self._values[labels]
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{{{_format_labels(self.label_names, labels)}}} {value}")
+        return lines
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"') for value in values)
+    return ",".join(f'{name}="{value}"' for name, value in zip(names, escaped))
+
+
+REQUEST_DURATION = Histogram(
+    "labmind_request_duration_seconds",
+    "Request latency by route",
+    ("route", "method", "status"),
+)
+PHASE_DURATION = Histogram(
+    "labmind_phase_duration_seconds",
+    "Time spent per request phase (auth, ownership, db, gemini, ...)",
+    ("route", "phase"),
+)
+GEMINI_TOKENS = CounterMetric(
+    "labmind_gemini_tokens_total",
+    "Gemini prompt and response tokens (estimated when the API does not report usage)",
+    ("operation", "kind"),
+)
+CACHE_REQUESTS = CounterMetric(
+    "labmind_cache_requests_total",
+    "Cache lookups by cache and result",
+    ("cache", "result"),
+)
+ADMISSION_DECISIONS = CounterMetric(
+    "labmind_admission_total",
+    "Admission decisions by route class (admitted, queued, rejected, timed_out)",
+    ("route_class", "result"),
+)
+
+_METRICS = (REQUEST_DURATION, PHASE_DURATION, GEMINI_TOKENS, CACHE_REQUESTS, ADMISSION_DECISIONS)
+
+
+def render_metrics() -> str:
+    lines: List[str] = []
+    for metric in _METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    if METRICS_ENABLED:
+        CACHE_REQUESTS.inc((cache, "hit" if hit else "miss"))
+
+
+def record_admission(route_class: str, result: str) -> None:
+    if METRICS_ENABLED:
+        ADMISSION_DECISIONS.inc((route_class, result))
+
+
+def estimate_tokens(text: str) -> int:
+    # Roughly four characters per token for English prose and code
+    return max(1, len(text) // 4) if text else 0
+
+
+def record_gemini_usage(operation: str, prompt: str, response) -> None:
+    """Count prompt/response tokens, preferring usage reported by the API"""
+    if not METRICS_ENABLED:
+        return
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None:
+        prompt_tokens = getattr(usage, "prompt_token_count", 0)
+        response_tokens = getattr(usage, "candidates_token_count", 0)
+    else:
+        prompt_tokens = estimate_tokens(prompt)
+        try:
+            response_tokens = estimate_tokens(response.text)
+        except Exception:
+            response_tokens = 0
+    GEMINI_TOKENS.inc((operation, "prompt"), prompt_tokens)
+    GEMINI_TOKENS.inc((operation, "response"), response_tokens)
+
+
+# Slow request profiling
+
+SlowRequestHook = Callable[[str, float, Counter], None]
+
+
+def _print_slow_request(route: str, seconds: float, samples: Counter) -> None:
+    print(f"Slow request: {route} took {seconds * 1000:.0f}ms; hottest frames:")
+    for frame, count in samples.most_common(10):
+        print(f"  {count:5d}  {frame}")
+
+
+_slow_request_hook: SlowRequestHook = _print_slow_request
+
+
+def set_slow_request_hook(hook: SlowRequestHook) -> None:
+    """Replace the default handler that prints hot frames of slow requests"""
+    global _slow_request_hook
+    _slow_request_hook = hook
+
+
+class StackSampler:
+    """Sample one thread's stack on a timer while a request is in flight"""
+
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        self._thread.join()
+        return self.samples
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            summary = traceback.extract_stack(frame, limit=1)[-1]
+            self.samples[f"{summary.filename}:{summary.lineno} {summary.name}"] += 1
+
+
+class InstrumentationMiddleware:
+    """
+    ASGI middleware that traces each HTTP request, adds a Server-Timing
+    header and feeds the Prometheus histograms.
+
+    With SLOW_REQUEST_PROFILE_MS set, a PROFILE_SAMPLE_RATE fraction of
+    requests also run under a stack sampler, and those slower than the
+    threshold are reported to the slow request hook. Samples come from the
+    event loop thread, so concurrent requests can show up in each other's
+    profiles.
+    """
+
+    def __init__(self, app, enabled: bool = METRICS_ENABLED):
+        self.app = app
+        self.enabled = enabled
+        threshold = os.getenv("SLOW_REQUEST_PROFILE_MS")
+        self.slow_threshold = float(threshold) / 1000 if threshold else None
+        self.sample_rate = float(os.getenv("PROFILE_SAMPLE_RATE", "0.1"))
+
+    async def __call__(self, scope, receive, send):
+        if not self.enabled or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace = RequestTrace()
+        token = _current_trace.set(trace)
+        start = time.perf_counter()
+        status_code = 500
+        sampler = None
+        if self.slow_threshold is not None and random.random() < self.sample_rate:
+            sampler = StackSampler(threading.get_ident())
+            sampler.start()
+
+        async def send_with_timing(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                entries = [
+                    f"{name};dur={seconds * 1000:.1f}"
+                    for name, seconds in trace.totals().items()
+                ]
+                entries.append(f"total;dur={(time.perf_counter() - start) * 1000:.1f}")
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", ", ".join(entries).encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current_trace.reset(token)
+            elapsed = time.perf_counter() - start
+            endpoint = scope.get("endpoint")
+            route = getattr(endpoint, "__name__", "unmatched")
+            REQUEST_DURATION.observe((route, scope["method"], str(status_code)), elapsed)
+            for name, seconds in trace.totals().items():
+                PHASE_DURATION.observe((route, name), seconds)
+            if sampler is not None:
+                samples = sampler.stop()
+                if elapsed >= self.slow_threshold:
+                    try:
+                        _slow_request_hook(route, elapsed, samples)
+                    except Exception as e:
+                        print(f"Warning: Slow request hook failed: {e}")
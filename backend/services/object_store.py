@@ -0,0 +1,87 @@
+"""
+Streamed reads and writes of project-files objects
+
+supabase-py's storage client downloads an object into one bytes value and
+uploads from one, so exports and imports talk to the Storage API directly
+over httpx instead: objects are read and written a chunk at a time and
+never held whole in memory. Listing and removing objects still go through
+the client (services/storage_cleanup.py).
+"""
+from typing import TYPE_CHECKING, AsyncIterator, Optional
+from urllib.parse import quote
+
+from services.storage_cleanup import PROJECT_FILES_BUCKET
+
+if TYPE_CHECKING:
+    import httpx
+
+STORAGE_CHUNK_BYTES = 256 * 1024
+
+
+class ObjectNotFound(Exception):
+    """The object does not exist in the bucket"""
+
+
+class ObjectStore:
+    """Interface for chunked object access"""
+
+    async def iter_object(self, path: str, chunk_size: int = STORAGE_CHUNK_BYTES) -> AsyncIterator[bytes]:
+        """Yield an object's bytes in chunks; raises ObjectNotFound before the first one"""
+        raise NotImplementedError
+        yield b""
+
+    async def put_object(
+        self, path: str, chunks: AsyncIterator[bytes], content_type: Optional[str] = None
+    ) -> None:
+        """Create an object from a stream of chunks"""
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        """Release connections; called on application shutdown"""
+
+
+class SupabaseObjectStore(ObjectStore):
+    """Storage API client for one bucket, authenticated with the service role key"""
+
+    def __init__(self, url: str, key: str, bucket: str = PROJECT_FILES_BUCKET, timeout: float = 60.0):
+        self.base_url = f"{url.rstrip('/')}/storage/v1/object/{bucket}/"
+        self.headers = {"Authorization": f"Bearer {key}", "apikey": key}
+        self.timeout = timeout
+        self._client: Optional["httpx.AsyncClient"] = None
+
+    def _http(self) -> "httpx.AsyncClient":
+        if self._client is None:
+            import httpx
+
+            self._client = httpx.AsyncClient(headers=self.headers, timeout=self.timeout)
+        return self._client
+
+    def _url(self, path: str) -> str:
+        return self.base_url + quote(path)
+
+    async def iter_object(self, path, chunk_size=STORAGE_CHUNK_BYTES):
+        async with self._http().stream("GET", self._url(path)) as response:
+            # Storage answers 400 with a "not_found" body for missing objects
+            if response.status_code in (400, 404):
+                raise ObjectNotFound(path)
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes(chunk_size):
+                yield chunk
+
+    async def put_object(self, path, chunks, content_type=None):
+        # An async iterator body goes out with chunked transfer encoding
+        response = await self._http().post(
+            self._url(path),
+            content=chunks,
+            headers={
+                "content-type": content_type or "application/octet-stream",
+                "cache-control": "max-age=3600",
+                "x-upsert": "false",
+            },
+        )
+        response.raise_for_status()
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
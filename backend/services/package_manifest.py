@@ -0,0 +1,213 @@
+"""
+Static analysis of step and cell code for package prefetching
+
+The browser runs notebook code in Pyodide, which installs packages on first
+import; the first cell that imports pandas or scipy stalls while they
+download. Parsing the plan's step code and the notebook's cells with `ast`
+up front gives a manifest of the packages and data files they need, so the
+client (or a server-side worker) can fetch them all in parallel before the
+first run. Only packages built into the Pyodide distribution the client
+loads are listed: an unknown import (a local helper module, a typo) is never
+turned into a package name for the client to fetch from PyPI.
+
+Analysis is a pure function of the code, so results are cached in process by
+the code's hash.
+"""
+import ast
+import hashlib
+import os
+import re
+import sys
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from services.cache import LocalLRU
+
+MANIFEST_VERSION = 1
+
+# Import names whose installable package is named differently
+IMPORT_PACKAGES = {
+    "Bio": "biopython",
+    "Crypto": "pycryptodome",
+    "PIL": "Pillow",
+    "attr": "attrs",
+    "bs4": "beautifulsoup4",
+    "cv2": "opencv-python",
+    "dateutil": "python-dateutil",
+    "mpl_toolkits": "matplotlib",
+    "pylab": "matplotlib",
+    "pywt": "PyWavelets",
+    "skimage": "scikit-image",
+    "sklearn": "scikit-learn",
+    "yaml": "pyyaml",
+}
+# Available in every Pyodide runtime without installing anything
+PRELOADED_IMPORTS = {"js", "micropip", "pyodide", "pyodide_js"}
+# Scientific packages shipped with Pyodide 0.24.1 (lib/pyodide-executor.ts),
+# in canonical form; anything else is left out of manifests
+PYODIDE_PACKAGES = frozenset("""
+astropy attrs beautifulsoup4 biopython bokeh cftime contourpy cycler fonttools h5py imageio
+joblib kiwisolver lightgbm lxml matplotlib mpmath netcdf4 networkx nltk numpy opencv-python
+packaging pandas patsy pillow pyarrow pycryptodome pyerfa pyparsing python-dateutil pytz
+pywavelets pyyaml regex requests scikit-image scikit-learn scipy shapely six statsmodels
+sympy threadpoolctl tqdm uncertainties xarray xgboost xlrd
+""".split())
+
+DATA_FILE_PATTERN = re.compile(
+    r"^[^\s'\"<>|*?]+\.(csv|tsv|txt|json|xlsx?|parquet|feather|h5|hdf5|npy|npz|mat|pkl|pickle|"
+    r"fasta|fa|fastq|xml|png|jpe?g|tiff?|zip|gz|dat|nc)$",
+    re.IGNORECASE,
+)
+# IPython magics and shell escapes are not Python; "%pip install x" still names packages
+MAGIC_LINE_PATTERN = re.compile(r"^(\s*)[%!]")
+PIP_INSTALL_PATTERN = re.compile(r"^\s*[%!]\s*pip\s+install\s+(.+)$")
+IMPORT_LINE_PATTERN = re.compile(r"^\s*(?:from\s+([A-Za-z_]\w*)[\w.]*\s+import|import\s+([A-Za-z_][\w., ]*))")
+
+ANALYSIS_CACHE_TTL_SECONDS = 7 * 86400
+_analysis_cache = LocalLRU(int(os.getenv("PACKAGE_ANALYSIS_CACHE_ENTRIES", "4096")))
+
+
+def canonical_package(name: str) -> str:
+    """PEP 503 normalized package name, e.g. pywavelets for PyWavelets"""
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def prefetchable(package: str) -> bool:
+    return canonical_package(package) in PYODIDE_PACKAGES
+
+
+def package_for_import(name: str) -> Optional[str]:
+    """
+    Pyodide package for a top-level import, or None for stdlib, built-ins and
+    imports that are not a known Pyodide package
+    """
+    if name in sys.stdlib_module_names or name in PRELOADED_IMPORTS:
+        return None
+    package = IMPORT_PACKAGES.get(name, name)
+    return package if prefetchable(package) else None
+
+
+def _pip_requirements(line: str) -> List[str]:
+    requirements = []
+    for argument in line.split():
+        if argument.startswith("-"):
+            continue
+        # Strip version pins and extras: "scipy>=1.10" -> "scipy"
+        name = re.split(r"[<>=!~\[;]", argument, maxsplit=1)[0]
+        if name:
+            requirements.append(name)
+    return requirements
+
+
+def _strip_magics(code: str) -> Tuple[str, List[str]]:
+    lines = []
+    installs: List[str] = []
+    for line in code.splitlines():
+        install = PIP_INSTALL_PATTERN.match(line)
+        if install:
+            installs.extend(_pip_requirements(install.group(1)))
+        magic = MAGIC_LINE_PATTERN.match(line)
+        # Keep line numbers and indentation so the rest still parses
+        lines.append(f"{magic.group(1)}pass" if magic else line)
+    return "\n".join(lines), installs
+
+
+def _analyze(code: str) -> Dict[str, List[str]]:
+    source, installs = _strip_magics(code)
+    imports: Set[str] = set()
+    files: Set[str] = set()
+    try:
+        tree = ast.parse(source)
+    except SyntaxError:
+        # Half-written cells still tell us what they import
+        for line in source.splitlines():
+            match = IMPORT_LINE_PATTERN.match(line)
+            if match and match.group(1):
+                imports.add(match.group(1))
+            elif match:
+                # "import numpy as np, scipy.stats" -> numpy, scipy
+                imports.update(part.split()[0].split(".")[0] for part in match.group(2).split(",") if part.strip())
+    else:
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                imports.update(alias.name.split(".")[0] for alias in node.names)
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                imports.add(node.module.split(".")[0])
+            elif isinstance(node, ast.Constant) and isinstance(node.value, str):
+                value = node.value.strip()
+                if DATA_FILE_PATTERN.match(value):
+                    files.add(value)
+
+    packages = {package for package in map(package_for_import, imports) if package}
+    packages.update(package for package in installs if prefetchable(package))
+    return {
+        "imports": sorted(name for name in imports if package_for_import(name)),
+        "packages": sorted(packages),
+        "files": sorted(files),
+    }
+
+
+def analyze_code(code: str) -> Dict[str, List[str]]:
+    """Third-party imports, installable packages and data file paths used by code"""
+    key = hashlib.sha256(code.encode("utf-8")).hexdigest()
+    hit, analysis = _analysis_cache.get(key)
+    if not hit:
+        analysis = _analyze(code)
+        _analysis_cache.put(key, analysis, ANALYSIS_CACHE_TTL_SECONDS)
+    return analysis
+
+
+def build_manifest(sources: Iterable[Tuple[str, str]]) -> Dict[str, Any]:
+    """
+    Combine the analyses of (source id, code) pairs, e.g. ("step:0", code) or
+    ("cell:<id>", code), into one manifest with a per-source breakdown.
+    """
+    manifest: Dict[str, Any] = {"version": MANIFEST_VERSION, "sources": {}}
+    totals: Dict[str, Set[str]] = {"imports": set(), "packages": set(), "files": set()}
+    for source_id, code in sources:
+        if not code or not code.strip():
+            continue
+        analysis = analyze_code(code)
+        if not (analysis["packages"] or analysis["files"]):
+            continue
+        manifest["sources"][source_id] = {"packages": analysis["packages"], "files": analysis["files"]}
+        for field, values in totals.items():
+            values.update(analysis[field])
+    for field, values in totals.items():
+        manifest[field] = sorted(values)
+    return manifest
+
+
+def step_sources(steps: Any) -> List[Tuple[str, str]]:
+    return [
+        (f"step:{position}", step.get("code") or "")
+        for position, step in enumerate(steps if isinstance(steps, list) else [])
+        if isinstance(step, dict)
+    ]
+
+
+def cell_sources(cells: Any) -> List[Tuple[str, str]]:
+    return [
+        (f"cell:{cell.get('id', position)}", cell.get("content") or "")
+        for position, cell in enumerate(cells if isinstance(cells, list) else [])
+        if isinstance(cell, dict) and cell.get("type", "code") == "code"
+    ]
+
+
+def merge_manifests(*manifests: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Union of manifests, e.g. the stored step manifest and the notebook's"""
+    merged: Dict[str, Any] = {"version": MANIFEST_VERSION, "sources": {}}
+    totals: Dict[str, Set[str]] = {"imports": set(), "packages": set(), "files": set()}
+    for manifest in manifests:
+        if not manifest:
+            continue
+        # Manifests stored before packages were checked against the allowlist
+        # may name others
+        for source_id, source in (manifest.get("sources") or {}).items():
+            packages = [package for package in source.get("packages") or [] if prefetchable(package)]
+            merged["sources"][source_id] = {**source, "packages": packages}
+        for field, values in totals.items():
+            values.update(manifest.get(field) or [])
+    totals["packages"] = {package for package in totals["packages"] if prefetchable(package)}
+    for field, values in totals.items():
+        merged[field] = sorted(values)
+    return merged
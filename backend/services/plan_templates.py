@@ -0,0 +1,340 @@
+"""
+Plan templates for common research archetypes
+
+A researcher who runs many projects of the same kind gets plans that mostly
+share their structure. A project's archetype is its normalized quiz field,
+data type and data formats. Every plan Gemini writes for a project that
+opted in is recorded under its owner and archetype, with the field as the
+researcher wrote it and data file names replaced by placeholders. Once an
+owner's archetype has min_samples plans that agree closely enough, the most
+representative plan written for a similar research question is served as an
+instant draft while Gemini writes the project's own plan.
+
+Templates only ever come from the same owner's plans: a plan's descriptions
+and code carry details of its research, so they are never shown to anyone
+else.
+
+Templates are scored by how many of their steps users keep: the first time
+a user edits or runs a plan that is still a template draft, the template's
+step titles are matched against the plan's. An archetype whose keep rate
+falls below min_keep_rate stops being served. The library is per-process and
+can be saved to and loaded from a JSON file like the semantic cache.
+"""
+import copy
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, List, Optional, Sequence, Tuple
+
+from services.semantic_cache import HashingVectorizer, Vector, cosine
+
+Steps = List[Dict[str, Any]]
+
+FIELD = "{{labmind:field}}"
+DATA_FILE = "{{labmind:data_file}}"
+# File names in quotes, as in pd.read_csv('spectra.csv')
+DATA_FILE_PATTERN = re.compile(
+    r"(?<=['\"])[\w./-]+\.(?:csv|tsv|xlsx|xls|json|txt|dat|h5|hdf5|parquet)(?=['\"])", re.IGNORECASE
+)
+DATA_FILES = {
+    "csv": "data.csv",
+    "excel": "data.xlsx",
+    "json": "data.json",
+    "text": "data.txt",
+    "hdf5": "data.h5",
+    "parquet": "data.parquet",
+}
+STEP_KEYS = ("step_number", "title", "description", "code", "dependencies")
+# Title token overlap at which a step counts as the same step
+KEEP_SIMILARITY = 0.6
+# Version 1 snapshots were shared across owners and are not loaded
+SNAPSHOT_VERSION = 2
+
+_vectorizer = HashingVectorizer()
+
+
+def _tokens(text: Any) -> List[str]:
+    return _vectorizer.tokens(str(text or ""))
+
+
+def _jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def _formats(quiz_responses: Dict[str, Any]) -> List[str]:
+    formats = quiz_responses.get("dataFormat") or []
+    if isinstance(formats, str):
+        formats = [formats]
+    # "Not sure yet" and anything else unknown says nothing about the plan
+    return sorted({str(value).strip().lower() for value in formats} & DATA_FILES.keys())
+
+
+def archetype_key(owner_id: str, quiz_responses: Dict[str, Any]) -> Optional[str]:
+    """Owner and normalized field, data type and formats of a quiz; None without a field"""
+    field = " ".join(sorted(set(_tokens(quiz_responses.get("field")))))
+    if not owner_id or not field:
+        return None
+    data_type = " ".join(_tokens(quiz_responses.get("dataType"))) or "any"
+    return f"{owner_id}|{field}|{data_type}|{'+'.join(_formats(quiz_responses)) or 'any'}"
+
+
+def _question(quiz_responses: Dict[str, Any]) -> str:
+    return str(quiz_responses.get("question") or "").strip()
+
+
+def parameterize(steps: Steps, quiz_responses: Dict[str, Any]) -> Steps:
+    """Replace the project's field and data file names in a plan with placeholders"""
+    field = str(quiz_responses.get("field") or "").strip()
+    field_pattern = re.compile(re.escape(field), re.IGNORECASE) if field else None
+    template = []
+    for step in steps:
+        step = {key: copy.deepcopy(step[key]) for key in STEP_KEYS if key in step}
+        for key in ("title", "description"):
+            if field_pattern and isinstance(step.get(key), str):
+                step[key] = field_pattern.sub(FIELD, step[key])
+        for key in ("description", "code"):
+            if isinstance(step.get(key), str):
+                step[key] = DATA_FILE_PATTERN.sub(DATA_FILE, step[key])
+        template.append(step)
+    return template
+
+
+def render(template: Steps, quiz_responses: Dict[str, Any]) -> Steps:
+    """Fill a template's placeholders in for a project"""
+    field = str(quiz_responses.get("field") or "").strip()
+    formats = _formats(quiz_responses)
+    data_file = DATA_FILES[formats[0]] if formats else DATA_FILES["csv"]
+    steps = copy.deepcopy(template)
+    for step in steps:
+        for key in ("title", "description", "code"):
+            if isinstance(step.get(key), str):
+                step[key] = step[key].replace(FIELD, field).replace(DATA_FILE, data_file)
+    return steps
+
+
+def _title_tokens(title: Any) -> FrozenSet[str]:
+    return frozenset(_tokens(str(title or "").replace(FIELD, " ")))
+
+
+def _plan_tokens(steps: Steps) -> FrozenSet[str]:
+    return frozenset().union(*(_title_tokens(step.get("title")) for step in steps)) if steps else frozenset()
+
+
+def steps_kept(titles: Sequence[str], steps: Steps) -> int:
+    """How many of titles still have a matching step in steps"""
+    current = [_title_tokens(step.get("title")) for step in steps or [] if isinstance(step, dict)]
+    kept = 0
+    for title in titles:
+        offered = _title_tokens(title)
+        if any(_jaccard(offered, tokens) >= KEEP_SIMILARITY for tokens in current):
+            kept += 1
+    return kept
+
+
+class _Sample:
+    __slots__ = ("steps", "question", "vector", "agreement")
+
+    def __init__(self, steps: Steps, question: str):
+        self.steps = steps
+        self.question = question
+        self.vector: Vector = _vectorizer.transform(question)
+        # Mean title overlap with the archetype's other samples
+        self.agreement = 0.0
+
+
+class _Archetype:
+    __slots__ = ("samples", "served", "judged", "offered", "kept")
+
+    def __init__(self):
+        self.samples: List[_Sample] = []
+        self.served = 0
+        # Sessions that gave feedback, and the template steps they were offered and kept
+        self.judged = 0
+        self.offered = 0
+        self.kept = 0
+
+    @property
+    def keep_rate(self) -> Optional[float]:
+        return self.kept / self.offered if self.offered else None
+
+    def score_samples(self) -> None:
+        plans = [_plan_tokens(sample.steps) for sample in self.samples]
+        for index, sample in enumerate(self.samples):
+            others = [other for other_index, other in enumerate(plans) if other_index != index]
+            sample.agreement = sum(_jaccard(plans[index], other) for other in others) / len(others) if others else 0.0
+
+
+class PlanTemplateLibrary:
+    """Per-process library of plan templates by owner and research archetype"""
+
+    def __init__(
+        self,
+        min_samples: int = 2,
+        max_samples: int = 5,
+        min_agreement: float = 0.5,
+        min_question_similarity: float = 0.4,
+        min_keep_rate: float = 0.5,
+        min_judged: int = 5,
+        max_archetypes: int = 1000,
+    ):
+        self.min_samples = max(2, min_samples)
+        self.max_samples = max(self.min_samples, max_samples)
+        self.min_agreement = min_agreement
+        # A plan written for a different question is not a draft for this one
+        self.min_question_similarity = min_question_similarity
+        self.min_keep_rate = min_keep_rate
+        # Keep rates from fewer sessions than this are not trusted yet
+        self.min_judged = min_judged
+        self.max_archetypes = max_archetypes
+        self._archetypes: "OrderedDict[str, _Archetype]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.dirty = False
+
+    def __len__(self) -> int:
+        return len(self._archetypes)
+
+    def _servable(self, archetype: _Archetype) -> bool:
+        if len(archetype.samples) < self.min_samples:
+            return False
+        keep_rate = archetype.keep_rate
+        return archetype.judged < self.min_judged or keep_rate is None or keep_rate >= self.min_keep_rate
+
+    def _template(self, archetype: _Archetype, question: str) -> Optional[_Sample]:
+        # The most representative sample among those written for a similar question
+        vector = _vectorizer.transform(question)
+        best, best_score = None, None
+        for sample in archetype.samples:
+            similarity = cosine(vector, sample.vector) if vector and sample.vector else 0.0
+            if similarity < self.min_question_similarity or sample.agreement < self.min_agreement:
+                continue
+            score = (sample.agreement, similarity)
+            if best_score is None or score > best_score:
+                best, best_score = sample, score
+        return best
+
+    def lookup(self, owner_id: str, quiz_responses: Dict[str, Any]) -> Optional[Tuple[str, Steps]]:
+        """(archetype key, draft steps) for an owner's quiz, or None without a good template"""
+        key = archetype_key(owner_id, quiz_responses)
+        if key is None:
+            return None
+        with self._lock:
+            archetype = self._archetypes.get(key)
+            if archetype is None or not self._servable(archetype):
+                return None
+            template = self._template(archetype, _question(quiz_responses))
+            if template is None:
+                return None
+            self._archetypes.move_to_end(key)
+            steps = template.steps
+        return key, render(steps, quiz_responses)
+
+    def served(self, key: str) -> None:
+        """Count a draft served from an archetype's template"""
+        with self._lock:
+            archetype = self._archetypes.get(key)
+            if archetype is not None:
+                archetype.served += 1
+                self.dirty = True
+
+    def record(self, owner_id: str, quiz_responses: Dict[str, Any], steps: Steps) -> bool:
+        """Add a generated plan to its owner's archetype; returns False if it was not stored"""
+        key = archetype_key(owner_id, quiz_responses)
+        if key is None or not steps or not all(isinstance(step, dict) for step in steps):
+            return False
+        template = parameterize(steps, quiz_responses)
+        question = _question(quiz_responses)
+        with self._lock:
+            archetype = self._archetypes.get(key)
+            if archetype is None:
+                archetype = self._archetypes[key] = _Archetype()
+            self._archetypes.move_to_end(key)
+            # Gemini answers are cached, so the same plan can come back
+            if any(sample.steps == template and sample.question == question for sample in archetype.samples):
+                return False
+            archetype.samples.append(_Sample(template, question))
+            # The oldest plans go first, so templates follow prompt and model changes
+            del archetype.samples[:-self.max_samples]
+            archetype.score_samples()
+            while len(self._archetypes) > self.max_archetypes:
+                self._archetypes.popitem(last=False)
+            self.dirty = True
+            return True
+
+    def record_feedback(self, key: Optional[str], titles: Sequence[str], steps: Steps) -> int:
+        """Score an archetype by how many of the offered step titles are still in steps"""
+        kept = steps_kept(titles, steps)
+        with self._lock:
+            archetype = self._archetypes.get(key) if key else None
+            if archetype is None or not titles:
+                return kept
+            archetype.judged += 1
+            archetype.offered += len(titles)
+            archetype.kept += kept
+            self.dirty = True
+        return kept
+
+    def save(self, path: str) -> None:
+        """Write archetypes to a JSON snapshot (vectors and agreement are rebuilt on load)"""
+        with self._lock:
+            archetypes = [
+                {
+                    "key": key,
+                    "samples": [{"steps": sample.steps, "question": sample.question} for sample in archetype.samples],
+                    "served": archetype.served,
+                    "judged": archetype.judged,
+                    "offered": archetype.offered,
+                    "kept": archetype.kept,
+                }
+                for key, archetype in self._archetypes.items()
+            ]
+            self.dirty = False
+        snapshot = {"version": SNAPSHOT_VERSION, "archetypes": archetypes}
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(snapshot, f)
+        os.replace(temp_path, path)
+
+    def load(self, path: str) -> int:
+        """Add archetypes from a snapshot; returns how many were loaded"""
+        if not os.path.exists(path):
+            return 0
+        with open(path) as f:
+            snapshot = json.load(f)
+        if snapshot.get("version") != SNAPSHOT_VERSION:
+            return 0
+        loaded = 0
+        with self._lock:
+            for item in snapshot.get("archetypes", []):
+                if item["key"] in self._archetypes:
+                    continue
+                archetype = _Archetype()
+                archetype.samples = [
+                    _Sample(sample["steps"], sample.get("question", ""))
+                    for sample in item["samples"][-self.max_samples:]
+                ]
+                for name in ("served", "judged", "offered", "kept"):
+                    setattr(archetype, name, item.get(name, 0))
+                archetype.score_samples()
+                self._archetypes[item["key"]] = archetype
+                loaded += 1
+            while len(self._archetypes) > self.max_archetypes:
+                self._archetypes.popitem(last=False)
+            self.dirty = False
+        return loaded
+
+
+def create_plan_template_library() -> Optional[PlanTemplateLibrary]:
+    """Build the library from PLAN_TEMPLATES_* settings; None when disabled"""
+    if os.getenv("PLAN_TEMPLATES_ENABLED", "true").lower() != "true":
+        return None
+    return PlanTemplateLibrary(
+        min_samples=int(os.getenv("PLAN_TEMPLATES_MIN_SAMPLES", "2")),
+        min_agreement=float(os.getenv("PLAN_TEMPLATES_MIN_AGREEMENT", "0.5")),
+        min_question_similarity=float(os.getenv("PLAN_TEMPLATES_MIN_QUESTION_SIMILARITY", "0.4")),
+        min_keep_rate=float(os.getenv("PLAN_TEMPLATES_MIN_KEEP_RATE", "0.5")),
+        max_archetypes=int(os.getenv("PLAN_TEMPLATES_MAX_ARCHETYPES", "1000")),
+    )
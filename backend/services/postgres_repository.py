@@ -0,0 +1,319 @@
+"""
+Repository backed by a direct asyncpg connection pool
+
+Used with REPOSITORY_BACKEND=postgres in self-hosted deployments where the
+backend can reach Postgres directly. Queries skip the PostgREST HTTP hop and
+asyncpg prepares and caches every statement per connection. The connecting
+role must be allowed to bypass RLS, like the service role key used by the
+Supabase backend.
+"""
+import asyncio
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+from services.admission import within_deadline
+from services.instrumentation import span
+from services.repository import Columns, Repository, Row, check_columns, search_page
+
+
+def _to_row(record) -> Optional[Row]:
+    """Convert an asyncpg Record to the dict shape PostgREST returns"""
+    if record is None:
+        return None
+    row = {}
+    for key, value in record.items():
+        if isinstance(value, UUID):
+            value = str(value)
+        elif isinstance(value, datetime):
+            value = value.isoformat()
+        row[key] = value
+    return row
+
+
+def _uuid(value: Any) -> Optional[UUID]:
+    """Parse an id; None if it is not a UUID, which no row can match"""
+    try:
+        return UUID(str(value))
+    except ValueError:
+        return None
+
+
+def _uuids(values) -> List[UUID]:
+    return [uuid for uuid in map(_uuid, values) if uuid is not None]
+
+
+def _timestamp(value: str) -> datetime:
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+class PostgresRepository(Repository):
+    """Repository using asyncpg with a connection pool"""
+
+    def __init__(self, dsn: str, min_size: int = 2, max_size: int = 10):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.pool = None
+        self._connect_lock = asyncio.Lock()
+
+    async def connect(self) -> None:
+        # Requests can arrive before the startup warm-up has opened the pool
+        async with self._connect_lock:
+            if self.pool is None:
+                self.pool = await self._create_pool()
+
+    async def _create_pool(self):
+        import asyncpg
+
+        async def init_connection(connection):
+            for type_name in ("json", "jsonb"):
+                await connection.set_type_codec(
+                    type_name, encoder=json.dumps, decoder=json.loads, schema="pg_catalog"
+                )
+
+        return await asyncpg.create_pool(
+            self.dsn,
+            min_size=self.min_size,
+            max_size=self.max_size,
+            init=init_connection,
+            # asyncpg prepares each distinct statement once per connection
+            statement_cache_size=256,
+        )
+
+    async def close(self) -> None:
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    async def _pool(self):
+        if self.pool is None:
+            await self.connect()
+        return self.pool
+
+    async def _fetch(self, sql: str, *args) -> List[Row]:
+        pool = await self._pool()
+        with span("db"):
+            records = await within_deadline(pool.fetch(sql, *args))
+        return [_to_row(record) for record in records]
+
+    async def _fetchrow(self, sql: str, *args) -> Optional[Row]:
+        pool = await self._pool()
+        with span("db"):
+            return _to_row(await within_deadline(pool.fetchrow(sql, *args)))
+
+    async def _execute(self, sql: str, *args) -> str:
+        pool = await self._pool()
+        with span("db"):
+            return await within_deadline(pool.execute(sql, *args))
+
+    @staticmethod
+    def _select(table: str, columns: Columns) -> str:
+        return ", ".join(check_columns(table, columns)) if columns else "*"
+
+    @staticmethod
+    def _insert_sql(table: str, data: Row, conflict: Optional[str] = None) -> tuple:
+        columns = check_columns(table, data.keys())
+        placeholders = ", ".join(f"${i}" for i in range(1, len(columns) + 1))
+        sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})"
+        if conflict:
+            updates = ", ".join(f"{column} = EXCLUDED.{column}" for column in columns if column != conflict)
+            sql += f" ON CONFLICT ({conflict}) DO UPDATE SET {updates}"
+        return sql + " RETURNING *", [data[column] for column in columns]
+
+    @staticmethod
+    def _update_sql(table: str, data: Row, where: Dict[str, Any], expected_updated_at: Optional[str]) -> tuple:
+        columns = check_columns(table, data.keys())
+        args: List[Any] = [data[column] for column in columns]
+        assignments = ", ".join(f"{column} = ${i}" for i, column in enumerate(columns, 1))
+        conditions = []
+        for column, value in where.items():
+            args.append(value)
+            conditions.append(f"{column} = ${len(args)}")
+        if expected_updated_at:
+            args.append(_timestamp(expected_updated_at))
+            conditions.append(f"updated_at = ${len(args)}")
+        sql = f"UPDATE {table} SET {assignments} WHERE {' AND '.join(conditions)} RETURNING *"
+        return sql, args
+
+    # Projects. Ids come from request paths; one that is not a UUID matches
+    # nothing, as with the Supabase backend, instead of failing the query
+
+    async def list_projects(self, user_id):
+        user = _uuid(user_id)
+        if user is None:
+            return []
+        return await self._fetch(
+            "SELECT * FROM projects WHERE user_id = $1 ORDER BY created_at DESC", user
+        )
+
+    async def get_project(self, project_id, user_id, columns=None):
+        project, user = _uuid(project_id), _uuid(user_id)
+        if project is None or user is None:
+            return None
+        return await self._fetchrow(
+            f"SELECT {self._select('projects', columns)} FROM projects WHERE id = $1 AND user_id = $2",
+            project, user,
+        )
+
+    async def get_project_by_id(self, project_id):
+        project = _uuid(project_id)
+        if project is None:
+            return None
+        return await self._fetchrow("SELECT * FROM projects WHERE id = $1", project)
+
+    async def get_project_ids(self, project_ids):
+        rows = await self._fetch(
+            "SELECT id FROM projects WHERE id = ANY($1::uuid[])", _uuids(project_ids)
+        )
+        return [row["id"] for row in rows]
+
+    async def create_project(self, data):
+        sql, args = self._insert_sql("projects", {**data, "user_id": UUID(data["user_id"])})
+        return await self._fetchrow(sql, *args)
+
+    async def update_project(self, project_id, user_id, data, expected_updated_at=None):
+        project, user = _uuid(project_id), _uuid(user_id)
+        if project is None or user is None:
+            return None
+        if not data:
+            return await self.get_project(project_id, user_id)
+        sql, args = self._update_sql("projects", data, {"id": project, "user_id": user}, expected_updated_at)
+        return await self._fetchrow(sql, *args)
+
+    async def delete_project(self, project_id, user_id):
+        project, user = _uuid(project_id), _uuid(user_id)
+        if project is None or user is None:
+            return False
+        result = await self._execute("DELETE FROM projects WHERE id = $1 AND user_id = $2", project, user)
+        return result != "DELETE 0"
+
+    # Notebooks
+
+    async def get_notebook(self, project_id, columns=None):
+        project = _uuid(project_id)
+        if project is None:
+            return None
+        return await self._fetchrow(
+            f"SELECT {self._select('notebooks', columns)} FROM notebooks WHERE project_id = $1", project
+        )
+
+    async def create_notebook(self, data):
+        sql, args = self._insert_sql("notebooks", {**data, "project_id": UUID(data["project_id"])})
+        return await self._fetchrow(sql, *args)
+
+    async def update_notebook(self, project_id, data, expected_updated_at=None):
+        project = _uuid(project_id)
+        if project is None:
+            return None
+        if not data:
+            return await self.get_notebook(project_id)
+        sql, args = self._update_sql("notebooks", data, {"project_id": project}, expected_updated_at)
+        return await self._fetchrow(sql, *args)
+
+    async def get_notebook_cells(self, project_id, offset=0, limit=100):
+        project = _uuid(project_id)
+        if project is None:
+            return []
+        rows = await self._fetch("SELECT cell FROM notebook_cells_page($1, $2, $3)", project, offset, limit)
+        return [row["cell"] for row in rows]
+
+    async def iter_notebook_cells(self, project_id, page_size=100):
+        # One cursor over a single read of the cells array, instead of one
+        # read per page; the connection is held until the last cell is sent
+        project = _uuid(project_id)
+        if project is None:
+            return
+        pool = await self._pool()
+        async with pool.acquire() as connection:
+            async with connection.transaction(readonly=True):
+                with span("db"):
+                    cursor = await within_deadline(connection.cursor(
+                        "SELECT t.cell FROM notebooks n, jsonb_array_elements("
+                        "CASE WHEN jsonb_typeof(n.cells) = 'array' THEN n.cells ELSE '[]'::jsonb END"
+                        ") WITH ORDINALITY AS t(cell, idx) WHERE n.project_id = $1 ORDER BY t.idx",
+                        project,
+                    ))
+                while True:
+                    with span("db"):
+                        records = await within_deadline(cursor.fetch(page_size))
+                    for record in records:
+                        yield record["cell"]
+                    if len(records) < page_size:
+                        return
+
+    # Files
+
+    async def list_files(self, project_id, limit=None, offset=0, columns=None):
+        sql = (
+            f"SELECT {self._select('files', columns)} FROM files "
+            "WHERE project_id = $1 ORDER BY created_at DESC"
+        )
+        project = _uuid(project_id)
+        if project is None:
+            return []
+        if limit is None:
+            return await self._fetch(sql, project)
+        return await self._fetch(sql + " LIMIT $2 OFFSET $3", project, limit, offset)
+
+    async def get_file(self, project_id, file_id):
+        file, project = _uuid(file_id), _uuid(project_id)
+        if file is None or project is None:
+            return None
+        return await self._fetchrow("SELECT * FROM files WHERE id = $1 AND project_id = $2", file, project)
+
+    async def create_file(self, data):
+        sql, args = self._insert_sql(
+            "files", {**data, "project_id": UUID(data["project_id"]), "user_id": UUID(data["user_id"])}
+        )
+        return await self._fetchrow(sql, *args)
+
+    async def get_files(self, project_id, file_ids):
+        project = _uuid(project_id)
+        if project is None:
+            return []
+        return await self._fetch(
+            "SELECT * FROM files WHERE project_id = $1 AND id = ANY($2::uuid[])", project, _uuids(file_ids)
+        )
+
+    async def delete_files(self, file_ids):
+        # One statement regardless of how many files are deleted
+        await self._execute("DELETE FROM files WHERE id = ANY($1::uuid[])", _uuids(file_ids))
+
+    # Agent sessions
+
+    async def get_agent_session(self, project_id, columns=None):
+        project = _uuid(project_id)
+        if project is None:
+            return None
+        return await self._fetchrow(
+            f"SELECT {self._select('agent_sessions', columns)} FROM agent_sessions WHERE project_id = $1", project
+        )
+
+    async def upsert_agent_session(self, data):
+        sql, args = self._insert_sql(
+            "agent_sessions", {**data, "project_id": UUID(data["project_id"])}, conflict="project_id"
+        )
+        return await self._fetchrow(sql, *args)
+
+    async def update_agent_session(self, project_id, data, expected_updated_at=None):
+        project = _uuid(project_id)
+        if project is None:
+            return None
+        if not data:
+            return await self.get_agent_session(project_id)
+        sql, args = self._update_sql("agent_sessions", data, {"project_id": project}, expected_updated_at)
+        return await self._fetchrow(sql, *args)
+
+    # Search
+
+    async def search(self, user_id, query, kinds=None, limit=20, offset=0):
+        user = _uuid(user_id)
+        if user is None:
+            return search_page([])
+        rows = await self._fetch(
+            "SELECT * FROM search_workspace($1, $2, $3, $4, $5)",
+            user, query, list(kinds) if kinds else None, limit, offset,
+        )
+        return search_page(rows)
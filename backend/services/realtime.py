@@ -0,0 +1,272 @@
+"""
+Realtime fan-out of project changes (agent sessions, notebooks, files)
+
+Change events arrive from a source -- the backend's own write paths, and
+with several workers either Postgres LISTEN/NOTIFY or the shared cache's
+Redis pub/sub -- and are coalesced per project. Without one of those the hub
+only hears its own worker's writes, so clients connected to other workers
+miss them. Each burst costs one row fetch per changed table no matter how
+many tabs are connected, and every subscriber receives only the fields that
+changed since the last broadcast.
+"""
+import asyncio
+import json
+import os
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Union
+
+from services.cache import CacheBackend, RedisBackend, TwoLevelCache
+
+NOTIFY_CHANNEL = "labmind_changes"
+RELAY_CHANNEL = "labmind:realtime:changes"
+
+REALTIME_TABLES = ("projects", "notebooks", "agent_sessions", "files")
+
+# (project_id, table) -> current row, or None if it no longer exists
+RowLoader = Callable[[str, str], Awaitable[Optional[Dict[str, Any]]]]
+
+_MISSING = object()
+
+
+def diff_rows(previous: Optional[Dict[str, Any]], current: Dict[str, Any]) -> Dict[str, Any]:
+    """Return the top-level fields of current that differ from previous"""
+    if previous is None:
+        return dict(current)
+    return {
+        key: value
+        for key, value in current.items()
+        if previous.get(key, _MISSING) != value
+    }
+
+
+class Subscription:
+    """One connected client; events are read with next_event()"""
+
+    def __init__(self, hub: "ChangeHub", project_id: str, max_queue: int = 100):
+        self.hub = hub
+        self.project_id = project_id
+        self.queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue(maxsize=max_queue)
+
+    def deliver(self, event: Dict[str, Any]) -> None:
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # A client that cannot keep up is told to refetch rather than
+            # holding an unbounded backlog
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({"type": "resync"})
+
+    async def next_event(self, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Wait for the next event; returns None on timeout"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self) -> None:
+        self.hub.unsubscribe(self)
+
+
+class ChangeHub:
+    """Per-project subscriber registry with burst coalescing and diffing"""
+
+    def __init__(self, loader: RowLoader, coalesce_window: float = 0.1):
+        self.loader = loader
+        self.coalesce_window = coalesce_window
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+        self._snapshots: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._flush_tasks: Dict[str, asyncio.Task] = {}
+        # Called with (project_id, table) for every local write, to tell
+        # other workers
+        self.relay: Optional[Callable[[str, str], None]] = None
+
+    def subscribe(self, project_id: str) -> Subscription:
+        subscription = Subscription(self, project_id)
+        self._subscribers.setdefault(project_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        subscribers = self._subscribers.get(subscription.project_id)
+        if not subscribers:
+            return
+        subscribers.discard(subscription)
+        if not subscribers:
+            # Last tab for this project closed: drop its state entirely
+            del self._subscribers[subscription.project_id]
+            self._snapshots.pop(subscription.project_id, None)
+            self._pending.pop(subscription.project_id, None)
+            task = self._flush_tasks.pop(subscription.project_id, None)
+            if task:
+                task.cancel()
+
+    def subscriber_count(self, project_id: Optional[str] = None) -> int:
+        if project_id is not None:
+            return len(self._subscribers.get(project_id, ()))
+        return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def publish(self, project_id: str, table: str, row: Any = _MISSING) -> None:
+        """
+        Record that a table changed for a project.
+
+        Pass the new row when the caller already has it (None for a delete);
+        otherwise it is loaded once when the burst is flushed. Projects with
+        no subscribers are ignored, so this is cheap on every write path.
+        """
+        if self.relay is not None:
+            self.relay(project_id, table)
+        self.receive(project_id, table, row)
+
+    def receive(self, project_id: str, table: str, row: Any = _MISSING) -> None:
+        """Record a change without relaying it, e.g. one another worker made"""
+        if project_id not in self._subscribers:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._pending.setdefault(project_id, {})[table] = row
+        if project_id not in self._flush_tasks:
+            self._flush_tasks[project_id] = loop.create_task(self._flush_later(project_id))
+
+    async def _flush_later(self, project_id: str) -> None:
+        try:
+            await asyncio.sleep(self.coalesce_window)
+        finally:
+            self._flush_tasks.pop(project_id, None)
+        await self.flush(project_id)
+
+    async def flush(self, project_id: str) -> None:
+        """Broadcast every pending change for a project"""
+        pending = self._pending.pop(project_id, None)
+        if not pending:
+            return
+        snapshots = self._snapshots.setdefault(project_id, {})
+        for table, row in pending.items():
+            if row is _MISSING:
+                try:
+                    row = await self.loader(project_id, table)
+                except Exception as e:
+                    print(f"Warning: Could not load {table} change for {project_id}: {e}")
+                    self._broadcast(project_id, {"type": "resync", "table": table})
+                    continue
+
+            if row is None:
+                snapshots.pop(table, None)
+                self._broadcast(project_id, {"type": "deleted", "table": table})
+                continue
+
+            changes = diff_rows(snapshots.get(table), row)
+            snapshots[table] = row
+            if changes:
+                self._broadcast(
+                    project_id, {"type": "changed", "table": table, "changes": changes}
+                )
+
+    def _broadcast(self, project_id: str, event: Dict[str, Any]) -> None:
+        for subscription in list(self._subscribers.get(project_id, ())):
+            subscription.deliver(event)
+
+
+class PostgresChangeListener:
+    """
+    Feed a ChangeHub from Postgres NOTIFY events.
+
+    Requires asyncpg and the triggers from migration 006. One connection
+    listens for the whole worker; payloads only carry the project id and
+    table, the hub loads the row itself.
+    """
+
+    def __init__(self, hub: ChangeHub, dsn: str, channel: str = NOTIFY_CHANNEL):
+        self.hub = hub
+        self.dsn = dsn
+        self.channel = channel
+        self._connection = None
+
+    async def start(self) -> None:
+        import asyncpg
+
+        self._connection = await asyncpg.connect(self.dsn)
+        await self._connection.add_listener(self.channel, self._on_notify)
+
+    async def stop(self) -> None:
+        if self._connection is not None:
+            await self._connection.close()
+            self._connection = None
+
+    def _on_notify(self, connection, pid, channel, payload: str) -> None:
+        try:
+            event = json.loads(payload)
+            if event["table"] in REALTIME_TABLES:
+                self.hub.receive(event["project_id"], event["table"])
+        except (ValueError, KeyError) as e:
+            print(f"Warning: Ignoring malformed change notification: {e}")
+
+
+class CacheChangeRelay:
+    """
+    Share API writes between workers over the cache's pub/sub.
+
+    Each worker publishes the project id and table of its own writes and
+    feeds other workers' into its hub, which loads the row itself. Unlike
+    the Postgres listener, writes made outside the API are not seen.
+    """
+
+    def __init__(self, hub: ChangeHub, backend: CacheBackend, channel: str = RELAY_CHANNEL):
+        self.hub = hub
+        self.backend = backend
+        self.channel = channel
+        self.origin = uuid.uuid4().hex
+        self._sends: Set[asyncio.Task] = set()
+
+    async def start(self) -> None:
+        await self.backend.subscribe(self.channel, self._on_message)
+        self.hub.relay = self._send
+
+    async def stop(self) -> None:
+        # The subscription ends when the cache is closed
+        self.hub.relay = None
+
+    def _send(self, project_id: str, table: str) -> None:
+        message = json.dumps({"project_id": project_id, "table": table, "origin": self.origin})
+        task = asyncio.get_running_loop().create_task(self._publish(message))
+        self._sends.add(task)
+        task.add_done_callback(self._sends.discard)
+
+    async def _publish(self, message: str) -> None:
+        try:
+            await self.backend.publish(self.channel, message)
+        except Exception as e:
+            print(f"Warning: Could not relay change to other workers: {e}")
+
+    def _on_message(self, message: str) -> None:
+        try:
+            event = json.loads(message)
+            if event.get("origin") != self.origin and event["table"] in REALTIME_TABLES:
+                self.hub.receive(event["project_id"], event["table"])
+        except (ValueError, KeyError) as e:
+            print(f"Warning: Ignoring malformed change relay message: {e}")
+
+
+def listener_from_env(
+    hub: ChangeHub, cache: Optional[TwoLevelCache] = None
+) -> Optional[Union[PostgresChangeListener, CacheChangeRelay]]:
+    """
+    Build the cross-worker change source: a Postgres listener when
+    REALTIME_SOURCE=postgres and DATABASE_URL are set, otherwise a relay over
+    the cache when CACHE_BACKEND=redis, otherwise None (single worker only)
+    """
+    if os.getenv("REALTIME_SOURCE", "inprocess") == "postgres":
+        dsn = os.getenv("DATABASE_URL")
+        if dsn:
+            return PostgresChangeListener(hub, dsn)
+        print("Warning: REALTIME_SOURCE=postgres requires DATABASE_URL; using in-process events")
+    if cache is not None and isinstance(cache.backend, RedisBackend):
+        return CacheChangeRelay(hub, cache.backend)
+    return None
+
+
+def encode_sse(event: Dict[str, Any]) -> str:
+    return f"event: {event['type']}\ndata: {json.dumps(event, default=str)}\n\n"
+
@@ -0,0 +1,648 @@
+"""
+Data access for projects, notebooks, files and agent sessions
+
+main.py talks to a Repository instead of building PostgREST queries inline,
+so the storage backend can be swapped:
+
+- SupabaseRepository: the supabase-py client (PostgREST over HTTP); the
+  default. Calls run in worker threads so they do not block the event loop.
+- PostgresRepository: direct asyncpg connection pool, skipping the
+  PostgREST hop (services/postgres_repository.py, needs asyncpg).
+- InMemoryRepository: dictionaries in this process, for tests and benchmarks.
+
+Rows are plain dicts shaped like PostgREST returns them: string ids and ISO
+8601 timestamps. Methods taking expected_updated_at only write when the row
+still has that version and return None otherwise (compare-and-set).
+"""
+import asyncio
+import copy
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from services.admission import within_deadline
+from services.instrumentation import span
+from services.search import (
+    SearchIndex, notebook_documents, project_documents, render_highlight, step_documents,
+)
+
+Row = Dict[str, Any]
+Columns = Optional[Sequence[str]]
+
+PROJECT_COLUMNS = (
+    "id", "user_id", "title", "description", "quiz_responses", "status",
+    "created_at", "updated_at",
+)
+NOTEBOOK_COLUMNS = ("id", "project_id", "cells", "metadata", "created_at", "updated_at")
+FILE_COLUMNS = (
+    "id", "project_id", "user_id", "name", "path", "size", "mime_type", "created_at",
+)
+AGENT_SESSION_COLUMNS = (
+    "id", "project_id", "steps", "current_step", "status", "conversation_history",
+    "metadata", "created_at", "updated_at",
+)
+TABLE_COLUMNS = {
+    "projects": PROJECT_COLUMNS,
+    "notebooks": NOTEBOOK_COLUMNS,
+    "files": FILE_COLUMNS,
+    "agent_sessions": AGENT_SESSION_COLUMNS,
+}
+
+
+def check_columns(table: str, columns: Iterable[str]) -> List[str]:
+    """Reject column names that are not part of the table"""
+    allowed = TABLE_COLUMNS[table]
+    columns = list(columns)
+    unknown = [column for column in columns if column not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown {table} column(s): {', '.join(unknown)}")
+    return columns
+
+
+class Repository:
+    """Interface shared by all storage backends"""
+
+    async def connect(self) -> None:
+        """Open connections; called once on application startup"""
+
+    async def close(self) -> None:
+        """Release connections; called on application shutdown"""
+
+    # Projects
+
+    async def list_projects(self, user_id: str) -> List[Row]:
+        raise NotImplementedError
+
+    async def get_project(self, project_id: str, user_id: str, columns: Columns = None) -> Optional[Row]:
+        raise NotImplementedError
+
+    async def get_project_by_id(self, project_id: str) -> Optional[Row]:
+        """Load a project regardless of owner, for callers that already checked access"""
+        raise NotImplementedError
+
+    async def get_project_ids(self, project_ids: Sequence[str]) -> List[str]:
+        """Return which of the given project ids still exist, for any user"""
+        raise NotImplementedError
+
+    async def create_project(self, data: Row) -> Optional[Row]:
+        raise NotImplementedError
+
+    async def update_project(
+        self, project_id: str, user_id: str, data: Row, expected_updated_at: Optional[str] = None
+    ) -> Optional[Row]:
+        raise NotImplementedError
+
+    async def delete_project(self, project_id: str, user_id: str) -> bool:
+        """Delete an owned project; returns False if nothing was deleted"""
+        raise NotImplementedError
+
+    # Notebooks
+
+    async def get_notebook(self, project_id: str, columns: Columns = None) -> Optional[Row]:
+        raise NotImplementedError
+
+    async def create_notebook(self, data: Row) -> Optional[Row]:
+        raise NotImplementedError
+
+    async def update_notebook(
+        self, project_id: str, data: Row, expected_updated_at: Optional[str] = None
+    ) -> Optional[Row]:
+        raise NotImplementedError
+
+    async def get_notebook_cells(self, project_id: str, offset: int = 0, limit: int = 100) -> List[Row]:
+        """A page of a notebook's cells in order, without reading the whole array"""
+        raise NotImplementedError
+
+    async def iter_notebook_cells(self, project_id: str, page_size: int = 100) -> AsyncIterator[Row]:
+        """
+        A notebook's cells in order, read a page at a time. A save during the
+        read can shift later pages, as with any paginated read.
+        """
+        offset = 0
+        while True:
+            page = await self.get_notebook_cells(project_id, offset, page_size)
+            for cell in page:
+                yield cell
+            if len(page) < page_size:
+                return
+            offset += len(page)
+
+    # Files
+
+    async def list_files(
+        self, project_id: str, limit: Optional[int] = None, offset: int = 0, columns: Columns = None
+    ) -> List[Row]:
+        """Files for a project, newest first"""
+        raise NotImplementedError
+
+    async def get_file(self, project_id: str, file_id: str) -> Optional[Row]:
+        raise NotImplementedError
+
+    async def create_file(self, data: Row) -> Optional[Row]:
+        """Insert a files row for an object the backend uploaded itself"""
+        raise NotImplementedError
+
+    async def get_files(self, project_id: str, file_ids: Sequence[str]) -> List[Row]:
+        raise NotImplementedError
+
+    async def delete_files(self, file_ids: Sequence[str]) -> None:
+        raise NotImplementedError
+
+    # Agent sessions
+
+    async def get_agent_session(self, project_id: str, columns: Columns = None) -> Optional[Row]:
+        raise NotImplementedError
+
+    async def upsert_agent_session(self, data: Row) -> Optional[Row]:
+        """Create or replace the session for data["project_id"]"""
+        raise NotImplementedError
+
+    async def update_agent_session(
+        self, project_id: str, data: Row, expected_updated_at: Optional[str] = None
+    ) -> Optional[Row]:
+        raise NotImplementedError
+
+    # Search
+
+    async def search(
+        self,
+        user_id: str,
+        query: str,
+        kinds: Optional[Sequence[str]] = None,
+        limit: int = 20,
+        offset: int = 0,
+    ) -> Tuple[List[Row], int]:
+        """
+        Ranked page of the user's project, cell and step documents matching
+        query, and the total number of matches. Rows carry project_id,
+        project_title, kind, ref, title, title_highlight, snippet and rank.
+        """
+        raise NotImplementedError
+
+
+def search_page(rows: List[Row]) -> Tuple[List[Row], int]:
+    """Shape search_workspace rows like Repository.search returns them"""
+    total = rows[0]["total_count"] if rows else 0
+    results = []
+    for row in rows:
+        row = {key: value for key, value in row.items() if key != "total_count"}
+        row["title_highlight"] = render_highlight(row.get("title_highlight"))
+        row["snippet"] = render_highlight(row.get("snippet"))
+        results.append(row)
+    return results, total
+
+
+# ids per `in` filter; keeps PostgREST query strings well under URL limits
+SUPABASE_IN_BATCH_SIZE = 200
+
+
+class SupabaseRepository(Repository):
+    """Repository backed by the supabase-py client (PostgREST)"""
+
+    def __init__(self, client, max_workers: int = 32):
+        self.client = client
+        # supabase-py is synchronous, so each query runs in a worker thread.
+        # A dedicated pool keeps queries from queueing behind the default
+        # executor, which is sized for CPU work (cores + 4).
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="supabase")
+
+    async def close(self) -> None:
+        self.executor.shutdown(wait=False)
+
+    async def _run(self, query):
+        with span("db"):
+            return await within_deadline(asyncio.get_running_loop().run_in_executor(self.executor, query))
+
+    @staticmethod
+    def _select(table: str, columns: Columns) -> str:
+        return ", ".join(check_columns(table, columns)) if columns else "*"
+
+    @staticmethod
+    def _data(response) -> Optional[Row]:
+        return response.data if response else None
+
+    @staticmethod
+    def _first(response) -> Optional[Row]:
+        return response.data[0] if response and response.data else None
+
+    # Projects
+
+    async def list_projects(self, user_id):
+        response = await self._run(
+            lambda: self.client.table("projects")
+            .select("*")
+            .eq("user_id", user_id)
+            .order("created_at", desc=True)
+            .execute()
+        )
+        return response.data or []
+
+    async def get_project(self, project_id, user_id, columns=None):
+        response = await self._run(
+            lambda: self.client.table("projects")
+            .select(self._select("projects", columns))
+            .eq("id", project_id)
+            .eq("user_id", user_id)
+            .maybe_single()
+            .execute()
+        )
+        return self._data(response)
+
+    async def get_project_by_id(self, project_id):
+        response = await self._run(
+            lambda: self.client.table("projects")
+            .select("*")
+            .eq("id", project_id)
+            .maybe_single()
+            .execute()
+        )
+        return self._data(response)
+
+    async def get_project_ids(self, project_ids):
+        found: List[str] = []
+        for start in range(0, len(project_ids), SUPABASE_IN_BATCH_SIZE):
+            batch = list(project_ids[start:start + SUPABASE_IN_BATCH_SIZE])
+            response = await self._run(
+                lambda: self.client.table("projects").select("id").in_("id", batch).execute()
+            )
+            found.extend(row["id"] for row in response.data or [])
+        return found
+
+    async def create_project(self, data):
+        response = await self._run(lambda: self.client.table("projects").insert(data).execute())
+        return self._first(response)
+
+    async def update_project(self, project_id, user_id, data, expected_updated_at=None):
+        def query():
+            builder = (
+                self.client.table("projects")
+                .update(data)
+                .eq("id", project_id)
+                .eq("user_id", user_id)
+            )
+            if expected_updated_at:
+                builder = builder.eq("updated_at", expected_updated_at)
+            return builder.execute()
+
+        return self._first(await self._run(query))
+
+    async def delete_project(self, project_id, user_id):
+        response = await self._run(
+            lambda: self.client.table("projects")
+            .delete()
+            .eq("id", project_id)
+            .eq("user_id", user_id)
+            .execute()
+        )
+        # Supabase returns the deleted rows
+        return bool(response.data)
+
+    # Notebooks
+
+    async def get_notebook(self, project_id, columns=None):
+        response = await self._run(
+            lambda: self.client.table("notebooks")
+            .select(self._select("notebooks", columns))
+            .eq("project_id", project_id)
+            .maybe_single()
+            .execute()
+        )
+        return self._data(response)
+
+    async def create_notebook(self, data):
+        response = await self._run(lambda: self.client.table("notebooks").insert(data).execute())
+        return self._first(response)
+
+    async def update_notebook(self, project_id, data, expected_updated_at=None):
+        def query():
+            builder = self.client.table("notebooks").update(data).eq("project_id", project_id)
+            if expected_updated_at:
+                builder = builder.eq("updated_at", expected_updated_at)
+            return builder.execute()
+
+        return self._first(await self._run(query))
+
+    async def get_notebook_cells(self, project_id, offset=0, limit=100):
+        params = {"p_project_id": project_id, "p_offset": offset, "p_limit": limit}
+        response = await self._run(lambda: self.client.rpc("notebook_cells_page", params).execute())
+        return [row["cell"] for row in response.data or []]
+
+    # Files
+
+    async def list_files(self, project_id, limit=None, offset=0, columns=None):
+        def query():
+            builder = (
+                self.client.table("files")
+                .select(self._select("files", columns))
+                .eq("project_id", project_id)
+                .order("created_at", desc=True)
+            )
+            if limit is not None:
+                builder = builder.range(offset, offset + limit - 1)
+            return builder.execute()
+
+        response = await self._run(query)
+        return response.data or []
+
+    async def get_file(self, project_id, file_id):
+        response = await self._run(
+            lambda: self.client.table("files")
+            .select("*")
+            .eq("id", file_id)
+            .eq("project_id", project_id)
+            .maybe_single()
+            .execute()
+        )
+        return self._data(response)
+
+    async def create_file(self, data):
+        response = await self._run(lambda: self.client.table("files").insert(data).execute())
+        return self._first(response)
+
+    async def get_files(self, project_id, file_ids):
+        rows: List[Row] = []
+        for start in range(0, len(file_ids), SUPABASE_IN_BATCH_SIZE):
+            batch = list(file_ids[start:start + SUPABASE_IN_BATCH_SIZE])
+            response = await self._run(
+                lambda: self.client.table("files")
+                .select("*")
+                .eq("project_id", project_id)
+                .in_("id", batch)
+                .execute()
+            )
+            rows.extend(response.data or [])
+        return rows
+
+    async def delete_files(self, file_ids):
+        for start in range(0, len(file_ids), SUPABASE_IN_BATCH_SIZE):
+            batch = list(file_ids[start:start + SUPABASE_IN_BATCH_SIZE])
+            await self._run(lambda: self.client.table("files").delete().in_("id", batch).execute())
+
+    # Agent sessions
+
+    async def get_agent_session(self, project_id, columns=None):
+        response = await self._run(
+            lambda: self.client.table("agent_sessions")
+            .select(self._select("agent_sessions", columns))
+            .eq("project_id", project_id)
+            .maybe_single()
+            .execute()
+        )
+        return self._data(response)
+
+    async def upsert_agent_session(self, data):
+        response = await self._run(
+            lambda: self.client.table("agent_sessions")
+            .upsert(data, on_conflict="project_id")
+            .execute()
+        )
+        return self._first(response)
+
+    async def update_agent_session(self, project_id, data, expected_updated_at=None):
+        def query():
+            builder = self.client.table("agent_sessions").update(data).eq("project_id", project_id)
+            if expected_updated_at:
+                builder = builder.eq("updated_at", expected_updated_at)
+            return builder.execute()
+
+        return self._first(await self._run(query))
+
+    # Search
+
+    async def search(self, user_id, query, kinds=None, limit=20, offset=0):
+        params = {
+            "p_user_id": user_id,
+            "p_query": query,
+            "p_kinds": list(kinds) if kinds else None,
+            "p_limit": limit,
+            "p_offset": offset,
+        }
+        response = await self._run(lambda: self.client.rpc("search_workspace", params).execute())
+        return search_page(response.data or [])
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class InMemoryRepository(Repository):
+    """Repository kept in process memory, mirroring the schema's defaults"""
+
+    DEFAULTS = {
+        "projects": {"description": None, "quiz_responses": None, "status": "draft"},
+        "notebooks": {"cells": [], "metadata": {}},
+        "files": {"mime_type": None},
+        "agent_sessions": {
+            "steps": [],
+            "current_step": 0,
+            "status": "planning",
+            "conversation_history": [],
+            "metadata": {},
+        },
+    }
+
+    def __init__(self):
+        self.tables: Dict[str, Dict[str, Row]] = {table: {} for table in TABLE_COLUMNS}
+        self.search_index = SearchIndex()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _project(row: Optional[Row], table: str, columns: Columns) -> Optional[Row]:
+        if row is None:
+            return None
+        if not columns:
+            return copy.deepcopy(row)
+        return {column: copy.deepcopy(row.get(column)) for column in check_columns(table, columns)}
+
+    def _insert(self, table: str, data: Row) -> Row:
+        now = _now()
+        row = {"id": str(uuid.uuid4()), "created_at": now}
+        if "updated_at" in TABLE_COLUMNS[table]:
+            row["updated_at"] = now
+        row.update(copy.deepcopy(self.DEFAULTS[table]))
+        row.update(copy.deepcopy(data))
+        self.tables[table][row["id"]] = row
+        return copy.deepcopy(row)
+
+    def _update(self, row: Optional[Row], data: Row, expected_updated_at: Optional[str]) -> Optional[Row]:
+        if row is None or (expected_updated_at and row["updated_at"] != expected_updated_at):
+            return None
+        row.update(copy.deepcopy(data))
+        row["updated_at"] = _now()
+        return copy.deepcopy(row)
+
+    def _by_project(self, table: str, project_id: str) -> Optional[Row]:
+        for row in self.tables[table].values():
+            if row["project_id"] == project_id:
+                return row
+        return None
+
+    def _index(self, table: str, row: Optional[Row]) -> Optional[Row]:
+        # What the 007_search.sql triggers do for the database backends
+        if row is None:
+            return None
+        if table == "projects":
+            self.search_index.sync(row["id"], row["user_id"], "project", project_documents(row))
+            return row
+        project = self.tables["projects"].get(row["project_id"])
+        if project is None:
+            return row
+        if table == "notebooks":
+            self.search_index.sync(row["project_id"], project["user_id"], "cell", notebook_documents(row["cells"]))
+        elif table == "agent_sessions":
+            self.search_index.sync(row["project_id"], project["user_id"], "step", step_documents(row["steps"]))
+        return row
+
+    # Projects
+
+    async def list_projects(self, user_id):
+        with self._lock:
+            rows = [copy.deepcopy(row) for row in self.tables["projects"].values() if row["user_id"] == user_id]
+        return sorted(rows, key=lambda row: row["created_at"], reverse=True)
+
+    async def get_project(self, project_id, user_id, columns=None):
+        with self._lock:
+            row = self.tables["projects"].get(project_id)
+            if row is None or row["user_id"] != user_id:
+                return None
+            return self._project(row, "projects", columns)
+
+    async def get_project_by_id(self, project_id):
+        with self._lock:
+            return self._project(self.tables["projects"].get(project_id), "projects", None)
+
+    async def get_project_ids(self, project_ids):
+        with self._lock:
+            return [project_id for project_id in project_ids if project_id in self.tables["projects"]]
+
+    async def create_project(self, data):
+        with self._lock:
+            return self._index("projects", self._insert("projects", data))
+
+    async def update_project(self, project_id, user_id, data, expected_updated_at=None):
+        with self._lock:
+            row = self.tables["projects"].get(project_id)
+            if row is not None and row["user_id"] != user_id:
+                row = None
+            return self._index("projects", self._update(row, data, expected_updated_at))
+
+    async def delete_project(self, project_id, user_id):
+        with self._lock:
+            row = self.tables["projects"].get(project_id)
+            if row is None or row["user_id"] != user_id:
+                return False
+            del self.tables["projects"][project_id]
+            self.search_index.remove_project(project_id)
+            # ON DELETE CASCADE
+            for table in ("notebooks", "files", "agent_sessions"):
+                self.tables[table] = {
+                    key: child for key, child in self.tables[table].items()
+                    if child["project_id"] != project_id
+                }
+            return True
+
+    # Notebooks
+
+    async def get_notebook(self, project_id, columns=None):
+        with self._lock:
+            return self._project(self._by_project("notebooks", project_id), "notebooks", columns)
+
+    async def create_notebook(self, data):
+        with self._lock:
+            if self._by_project("notebooks", data["project_id"]) is not None:
+                raise ValueError("A notebook already exists for this project")
+            return self._index("notebooks", self._insert("notebooks", data))
+
+    async def update_notebook(self, project_id, data, expected_updated_at=None):
+        with self._lock:
+            updated = self._update(self._by_project("notebooks", project_id), data, expected_updated_at)
+            return self._index("notebooks", updated) if "cells" in data else updated
+
+    async def get_notebook_cells(self, project_id, offset=0, limit=100):
+        with self._lock:
+            row = self._by_project("notebooks", project_id)
+            return copy.deepcopy(row["cells"][offset:offset + limit]) if row else []
+
+    # Files
+
+    async def list_files(self, project_id, limit=None, offset=0, columns=None):
+        with self._lock:
+            rows = [row for row in self.tables["files"].values() if row["project_id"] == project_id]
+            rows.sort(key=lambda row: row["created_at"], reverse=True)
+            if limit is not None:
+                rows = rows[offset:offset + limit]
+            return [self._project(row, "files", columns) for row in rows]
+
+    async def get_file(self, project_id, file_id):
+        with self._lock:
+            row = self.tables["files"].get(file_id)
+            if row is None or row["project_id"] != project_id:
+                return None
+            return copy.deepcopy(row)
+
+    async def create_file(self, data):
+        with self._lock:
+            return self._insert("files", data)
+
+    async def get_files(self, project_id, file_ids):
+        with self._lock:
+            rows = (self.tables["files"].get(file_id) for file_id in file_ids)
+            return [copy.deepcopy(row) for row in rows if row and row["project_id"] == project_id]
+
+    async def delete_files(self, file_ids):
+        with self._lock:
+            for file_id in file_ids:
+                self.tables["files"].pop(file_id, None)
+
+    # Agent sessions
+
+    async def get_agent_session(self, project_id, columns=None):
+        with self._lock:
+            return self._project(self._by_project("agent_sessions", project_id), "agent_sessions", columns)
+
+    async def upsert_agent_session(self, data):
+        with self._lock:
+            row = self._by_project("agent_sessions", data["project_id"])
+            if row is None:
+                return self._index("agent_sessions", self._insert("agent_sessions", data))
+            return self._index("agent_sessions", self._update(row, data, None))
+
+    async def update_agent_session(self, project_id, data, expected_updated_at=None):
+        with self._lock:
+            updated = self._update(self._by_project("agent_sessions", project_id), data, expected_updated_at)
+            return self._index("agent_sessions", updated) if "steps" in data else updated
+
+
+    # Search
+
+    async def search(self, user_id, query, kinds=None, limit=20, offset=0):
+        return self.search_index.search(user_id, query, kinds, limit, offset)
+
+
+def create_repository(get_supabase_client: Callable[[], Any]) -> Repository:
+    """
+    Pick the backend from REPOSITORY_BACKEND (supabase, postgres or memory).
+    The Supabase client is only created when the supabase backend is used.
+    """
+    backend = os.getenv("REPOSITORY_BACKEND", "supabase").lower()
+    if backend == "memory":
+        return InMemoryRepository()
+    if backend == "postgres":
+        from services.postgres_repository import PostgresRepository
+
+        dsn = os.getenv("DATABASE_URL")
+        if not dsn:
+            raise ValueError("REPOSITORY_BACKEND=postgres requires DATABASE_URL")
+        return PostgresRepository(
+            dsn,
+            min_size=int(os.getenv("DATABASE_POOL_MIN_SIZE", "2")),
+            max_size=int(os.getenv("DATABASE_POOL_MAX_SIZE", "10")),
+        )
+    if backend != "supabase":
+        raise ValueError(f"Unknown REPOSITORY_BACKEND: {backend}")
+    return SupabaseRepository(
+        get_supabase_client(), max_workers=int(os.getenv("SUPABASE_MAX_WORKERS", "32"))
+    )
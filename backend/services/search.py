@@ -0,0 +1,277 @@
+"""
+Full-text search over projects, notebook cells and agent steps
+
+Every project, notebook cell and agent step becomes a search document with
+a title, prose body and code. In Supabase and Postgres the documents live in
+the search_documents table, kept current by triggers and queried through the
+search_workspace function (007_search.sql). InMemoryRepository keeps the
+same documents in a SearchIndex, an inverted index updated from its write
+paths, so search works in tests and benchmarks too.
+
+Both return highlights as HTML: matched words are wrapped in <mark> and
+everything else is escaped.
+"""
+import html
+import math
+import re
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+Row = Dict[str, Any]
+DocumentKey = Tuple[str, str, str]
+
+SEARCH_KINDS = ("project", "cell", "step")
+# Relative weight of a match in each field, as ts_rank_cd weighs A, B and C
+FIELD_WEIGHTS = (("title", 1.0), ("body", 0.4), ("code", 0.2))
+SNIPPET_WORDS = 30
+
+WORD_PATTERN = re.compile(r"[A-Za-z0-9]+")
+MARK_PATTERN = re.compile(r"(</?mark>)")
+
+
+def project_documents(project: Row) -> List[Row]:
+    return [{"ref": "", "title": project.get("title") or "", "body": project.get("description") or "", "code": ""}]
+
+
+def notebook_documents(cells: Any) -> List[Row]:
+    """One document per non-empty cell; markdown is prose, anything else is code"""
+    documents = []
+    for position, cell in enumerate(cells if isinstance(cells, list) else []):
+        if not isinstance(cell, dict) or not cell.get("content"):
+            continue
+        markdown = cell.get("type") == "markdown"
+        documents.append({
+            "ref": str(cell.get("id", position)),
+            "title": "",
+            "body": cell["content"] if markdown else "",
+            "code": "" if markdown else cell["content"],
+        })
+    return documents
+
+
+def step_documents(steps: Any) -> List[Row]:
+    """One document per plan step, keyed by its index"""
+    return [
+        {
+            "ref": str(position),
+            "title": step.get("title") or "",
+            "body": step.get("description") or "",
+            "code": step.get("code") or "",
+        }
+        for position, step in enumerate(steps if isinstance(steps, list) else [])
+        if isinstance(step, dict)
+    ]
+
+
+def _stem(word: str) -> str:
+    for suffix in ("ing", "ed", "es", "s"):
+        if len(word) > len(suffix) + 2 and word.endswith(suffix):
+            word = word[: -len(suffix)]
+            # "fitting" -> "fit", not "fitt"
+            if suffix in ("ing", "ed") and len(word) > 2 and word[-1] == word[-2] and word[-1] not in "lsz":
+                word = word[:-1]
+            return word
+    return word
+
+
+def terms(text: str) -> List[str]:
+    """Lower-cased, lightly stemmed words; code is split on every non-alphanumeric"""
+    return [_stem(word.lower()) for word in WORD_PATTERN.findall(text)]
+
+
+def parse_query(query: str) -> Tuple[List[str], List[str]]:
+    """Split a web-style query into required and excluded terms ("-word" excludes)"""
+    required: List[str] = []
+    excluded: List[str] = []
+    for word in query.replace('"', " ").split():
+        target = excluded if word.startswith("-") and len(word) > 1 else required
+        for term in terms(word):
+            if term not in target:
+                target.append(term)
+    return required, excluded
+
+
+def highlight(text: str, matched: Set[str], max_words: Optional[int] = None) -> str:
+    """Escape text and mark words whose term is in matched, optionally trimmed around the first match"""
+    words = list(WORD_PATTERN.finditer(text))
+    start, end = 0, len(words)
+    if max_words is not None and len(words) > max_words:
+        first = next((i for i, word in enumerate(words) if _stem(word.group().lower()) in matched), 0)
+        start = max(0, min(first - 5, len(words) - max_words))
+        end = start + max_words
+    if not words:
+        return html.escape(text)
+
+    begin = words[start].start() if start else 0
+    finish = words[end - 1].end() if end < len(words) else len(text)
+    parts = ["… " if start else ""]
+    position = begin
+    for word in words[start:end]:
+        parts.append(html.escape(text[position:word.start()]))
+        if _stem(word.group().lower()) in matched:
+            parts.append(f"<mark>{html.escape(word.group())}</mark>")
+        else:
+            parts.append(html.escape(word.group()))
+        position = word.end()
+    parts.append(html.escape(text[position:finish]))
+    if end < len(words):
+        parts.append(" …")
+    return "".join(parts).strip()
+
+
+def render_highlight(headline: Optional[str]) -> str:
+    """Escape a ts_headline result, keeping only its <mark> tags"""
+    if not headline:
+        return ""
+    return "".join(
+        part if MARK_PATTERN.fullmatch(part) else html.escape(part)
+        for part in MARK_PATTERN.split(headline)
+    )
+
+
+class _Document:
+    __slots__ = ("project_id", "user_id", "kind", "ref", "title", "body", "code", "version", "weights")
+
+    def __init__(self, project_id: str, user_id: str, kind: str, document: Row, version: int):
+        self.project_id = project_id
+        self.user_id = user_id
+        self.kind = kind
+        self.ref = document["ref"]
+        self.title = document.get("title") or ""
+        self.body = document.get("body") or ""
+        self.code = document.get("code") or ""
+        self.version = version
+        self.weights: Dict[str, float] = {}
+        for field, weight in FIELD_WEIGHTS:
+            for term in terms(getattr(self, field)):
+                self.weights[term] = self.weights.get(term, 0.0) + weight
+
+    def same_text(self, document: Row) -> bool:
+        return (self.title, self.body, self.code) == (
+            document.get("title") or "", document.get("body") or "", document.get("code") or ""
+        )
+
+
+class SearchIndex:
+    """
+    Inverted index from (user, term) to documents, updated incrementally.
+
+    sync() replaces one kind of document for a project and only re-tokenizes
+    documents whose text changed, so re-saving a notebook with one edited cell
+    costs one cell.
+    """
+
+    def __init__(self):
+        self._documents: Dict[DocumentKey, _Document] = {}
+        self._postings: Dict[Tuple[str, str], Dict[DocumentKey, float]] = {}
+        self._by_project: Dict[str, Set[DocumentKey]] = {}
+        self._project_titles: Dict[str, str] = {}
+        self._version = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    def _add(self, document: _Document) -> None:
+        key = (document.project_id, document.kind, document.ref)
+        self._documents[key] = document
+        self._by_project.setdefault(document.project_id, set()).add(key)
+        for term, weight in document.weights.items():
+            self._postings.setdefault((document.user_id, term), {})[key] = weight
+
+    def _remove(self, key: DocumentKey) -> None:
+        document = self._documents.pop(key)
+        keys = self._by_project.get(document.project_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_project[document.project_id]
+                self._project_titles.pop(document.project_id, None)
+        for term in document.weights:
+            posting = self._postings.get((document.user_id, term))
+            if posting is not None:
+                posting.pop(key, None)
+                if not posting:
+                    del self._postings[(document.user_id, term)]
+
+    def sync(self, project_id: str, user_id: str, kind: str, documents: Iterable[Row]) -> int:
+        """Make the project's documents of this kind match documents; returns how many changed"""
+        with self._lock:
+            wanted = {document["ref"]: document for document in documents}
+            changed = 0
+            for key in [key for key in self._by_project.get(project_id, ()) if key[1] == kind]:
+                if key[2] not in wanted:
+                    self._remove(key)
+                    changed += 1
+            for ref, document in wanted.items():
+                current = self._documents.get((project_id, kind, ref))
+                if current is not None and current.user_id == user_id and current.same_text(document):
+                    continue
+                if current is not None:
+                    self._remove((project_id, kind, ref))
+                self._version += 1
+                self._add(_Document(project_id, user_id, kind, document, self._version))
+                changed += 1
+            if kind == "project" and wanted:
+                self._project_titles[project_id] = next(iter(wanted.values())).get("title") or ""
+            return changed
+
+    def remove_project(self, project_id: str, kinds: Optional[Sequence[str]] = None) -> None:
+        with self._lock:
+            for key in list(self._by_project.get(project_id, ())):
+                if kinds is None or key[1] in kinds:
+                    self._remove(key)
+
+    def search(
+        self,
+        user_id: str,
+        query: str,
+        kinds: Optional[Sequence[str]] = None,
+        limit: int = 20,
+        offset: int = 0,
+    ) -> Tuple[List[Row], int]:
+        """Ranked page of the user's documents containing every query term, and the total"""
+        required, excluded = parse_query(query)
+        if not required:
+            return [], 0
+        with self._lock:
+            postings = [self._postings.get((user_id, term)) for term in required]
+            if not all(postings):
+                return [], 0
+            total_documents = len(self._documents)
+            # Walk the rarest term's documents and check the others
+            order = sorted(range(len(postings)), key=lambda i: len(postings[i]))
+            idf = [math.log(1 + total_documents / len(posting)) for posting in postings]
+            exclude = [self._postings.get((user_id, term), {}) for term in excluded]
+            scored = []
+            for key, weight in postings[order[0]].items():
+                score = idf[order[0]] * weight / (weight + 1)
+                for i in order[1:]:
+                    other = postings[i].get(key)
+                    if other is None:
+                        break
+                    score += idf[i] * other / (other + 1)
+                else:
+                    if kinds and key[1] not in kinds:
+                        continue
+                    if any(key in posting for posting in exclude):
+                        continue
+                    scored.append((score, self._documents[key].version, key))
+            scored.sort(reverse=True)
+
+            matched = set(required)
+            results = []
+            for score, _, key in scored[offset:offset + limit]:
+                document = self._documents[key]
+                text = "\n".join(part for part in (document.body, document.code) if part)
+                results.append({
+                    "project_id": document.project_id,
+                    "project_title": self._project_titles.get(document.project_id, ""),
+                    "kind": document.kind,
+                    "ref": document.ref,
+                    "title": document.title,
+                    "title_highlight": highlight(document.title, matched),
+                    "snippet": highlight(text, matched, SNIPPET_WORDS),
+                    "rank": round(score, 6),
+                })
+            return results, len(scored)
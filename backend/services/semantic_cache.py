@@ -0,0 +1,303 @@
+"""
+Semantic answer cache for agent chat
+
+Researchers working from the same plan ask the agent near-identical
+questions ("how do I normalize this spectrum?"). Questions are embedded with
+a hashing vectorizer (no model download, pure CPU) and stored in an
+in-process random-hyperplane LSH index. A new question whose cosine
+similarity to a cached one clears the threshold gets the cached answer
+instead of a Gemini call.
+
+Entries are scoped by a hash of the plan and the current step. An answer
+given with conversation history may quote that conversation, so it is also
+scoped by owner and only reused for the same user's same steps. An answer
+to the first question of a conversation depends on nothing but the plan and
+the question, and is shared with every project on an identical plan and
+step, across owners. Follow-ups that refer back to the conversation ("what
+did you say about the previous answer?") are neither cached nor answered
+from the cache. The least recently
+used entries are evicted past max_entries, entries expire after ttl seconds,
+and the index can be saved to and loaded from a JSON file.
+"""
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from services.instrumentation import record_cache
+
+Vector = Dict[int, float]
+
+STOP_WORDS = frozenset(
+    "a an and are as at be by can could do does for from how i if in is it me my of on or "
+    "please should so that the this to we what when which with would you your".split()
+)
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+# Phrases that point back into the conversation, so the answer depends on
+# it. Pronouns such as "it" or "that" are not enough: "what does this cell
+# do with that column" stands on its own
+FOLLOW_UP_PATTERN = re.compile(
+    r"\b(you (just )?(said|mentioned|suggested|wrote|showed|gave|meant)|(did|do) you (say|mean)"
+    r"|your (last |previous |earlier |first )?(answer|reply|response|suggestion|example|code|explanation)"
+    r"|(previous|last|earlier|above|same) (answer|reply|response|message|question|suggestion|example|code|one)"
+    r"|the other one|as (i|you) (said|asked|mentioned)|(say|explain|show|do) (it|that) again)\b"
+)
+# Version 1 snapshots were not scoped by owner and are not loaded
+SNAPSHOT_VERSION = 2
+
+
+def _stem(word: str) -> str:
+    # Crude suffix stripping so "normalizing" and "normalize" share a feature
+    for suffix in ("ing", "ed", "es", "s"):
+        if len(word) > len(suffix) + 3 and word.endswith(suffix):
+            return word[: -len(suffix)]
+    return word
+
+
+def _hash(feature: str) -> int:
+    return int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class HashingVectorizer:
+    """Map text to an L2-normalized sparse vector of hashed word features"""
+
+    def __init__(self, dim: int = 1024):
+        self.dim = dim
+
+    def tokens(self, text: str) -> List[str]:
+        words = [_stem(word) for word in TOKEN_PATTERN.findall(text.lower()) if word not in STOP_WORDS]
+        return words
+
+    def transform(self, text: str) -> Vector:
+        words = self.tokens(text)
+        features = [(word, 1.0) for word in words]
+        features += [(f"{first} {second}", 0.5) for first, second in zip(words, words[1:])]
+        vector: Vector = {}
+        for feature, weight in features:
+            hashed = _hash(feature)
+            # A sign bit keeps hash collisions from only ever adding up
+            sign = 1.0 if hashed >> 63 else -1.0
+            index = hashed % self.dim
+            vector[index] = vector.get(index, 0.0) + sign * weight
+        norm = math.sqrt(sum(value * value for value in vector.values()))
+        if not norm:
+            return {}
+        return {index: value / norm for index, value in vector.items() if value}
+
+
+def cosine(a: Vector, b: Vector) -> float:
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(value * b.get(index, 0.0) for index, value in a.items())
+
+
+def is_follow_up(question: str) -> bool:
+    """Whether a question refers back to the conversation it is asked in"""
+    return FOLLOW_UP_PATTERN.search(question.lower()) is not None
+
+
+def plan_scope(owner_id: Optional[str], steps: List[Dict[str, Any]], current_step: int = 0) -> str:
+    """Hash of the owner, plan and current step that answers are scoped to; owner None is shared"""
+    payload = json.dumps([owner_id, steps, current_step], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+
+class _Entry:
+    __slots__ = ("scope", "question", "answer", "vector", "signatures", "created_at", "hits")
+
+    def __init__(self, scope: str, question: str, answer: str, vector: Vector,
+                 signatures: Tuple[int, ...], created_at: float, hits: int = 0):
+        self.scope = scope
+        self.question = question
+        self.answer = answer
+        self.vector = vector
+        self.signatures = signatures
+        self.created_at = created_at
+        self.hits = hits
+
+
+class SemanticCache:
+    """In-process LSH index from questions to agent answers"""
+
+    def __init__(
+        self,
+        threshold: float = 0.9,
+        max_entries: int = 5000,
+        ttl: float = 7 * 86400,
+        dim: int = 1024,
+        tables: int = 8,
+        bits: int = 8,
+        min_tokens: int = 2,
+        seed: int = 0,
+    ):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # Very short messages ("why?", "what next?") lean on the conversation; skip them
+        self.min_tokens = min_tokens
+        self.vectorizer = HashingVectorizer(dim)
+        self.tables = tables
+        self.bits = bits
+        self.seed = seed
+        self._planes: Optional[List[List[float]]] = None
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._buckets: Dict[Tuple[str, int, int], Set[int]] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.dirty = False
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _hyperplanes(self) -> List[List[float]]:
+        # Gaussian hyperplanes, built on first use to keep imports fast.
+        # Vectors on the same side of all of a table's planes share a
+        # bucket, so similar questions tend to collide in some table.
+        if self._planes is None:
+            rng = random.Random(self.seed)
+            dim = self.vectorizer.dim
+            self._planes = [[rng.gauss(0.0, 1.0) for _ in range(dim)] for _ in range(self.tables * self.bits)]
+        return self._planes
+
+    def _signatures(self, vector: Vector) -> Tuple[int, ...]:
+        planes = self._hyperplanes()
+        signatures = []
+        for table in range(self.tables):
+            signature = 0
+            for bit in range(self.bits):
+                plane = planes[table * self.bits + bit]
+                if sum(value * plane[index] for index, value in vector.items()) > 0:
+                    signature |= 1 << bit
+            signatures.append(signature)
+        return tuple(signatures)
+
+    def _embed(self, question: str) -> Optional[Vector]:
+        if len(self.vectorizer.tokens(question)) < self.min_tokens or is_follow_up(question):
+            return None
+        return self.vectorizer.transform(question) or None
+
+    def _remove(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id)
+        for table, signature in enumerate(entry.signatures):
+            bucket = self._buckets.get((entry.scope, table, signature))
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[(entry.scope, table, signature)]
+        self.dirty = True
+
+    def _nearest(self, scope: str, vector: Vector, signatures: Tuple[int, ...]) -> Tuple[Optional[int], float]:
+        candidates: Set[int] = set()
+        for table, signature in enumerate(signatures):
+            candidates |= self._buckets.get((scope, table, signature), set())
+        best_id, best_score = None, 0.0
+        expired = []
+        now = time.time()
+        for entry_id in candidates:
+            entry = self._entries[entry_id]
+            if now - entry.created_at > self.ttl:
+                expired.append(entry_id)
+                continue
+            score = cosine(vector, entry.vector)
+            if score > best_score:
+                best_id, best_score = entry_id, score
+        for entry_id in expired:
+            self._remove(entry_id)
+        return best_id, best_score
+
+    def lookup(self, scope: str, question: str, shared_scope: Optional[str] = None) -> Optional[str]:
+        """Return a cached answer for a similar enough question in scope, else in shared_scope"""
+        vector = self._embed(question)
+        if vector is None:
+            return None
+        signatures = self._signatures(vector)
+        with self._lock:
+            entry_id, score = self._nearest(scope, vector, signatures)
+            if score < self.threshold and shared_scope is not None:
+                entry_id, score = self._nearest(shared_scope, vector, signatures)
+            hit = entry_id is not None and score >= self.threshold
+            record_cache("semantic_chat", hit)
+            if not hit:
+                return None
+            entry = self._entries[entry_id]
+            entry.hits += 1
+            self._entries.move_to_end(entry_id)
+            return entry.answer
+
+    def add(self, scope: str, question: str, answer: str, created_at: Optional[float] = None) -> bool:
+        """Store an answer; returns False if the question is too short or already covered"""
+        vector = self._embed(question)
+        if vector is None or not answer:
+            return False
+        signatures = self._signatures(vector)
+        with self._lock:
+            _, score = self._nearest(scope, vector, signatures)
+            if score >= self.threshold:
+                return False
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = _Entry(
+                scope, question, answer, vector, signatures, created_at or time.time()
+            )
+            for table, signature in enumerate(signatures):
+                self._buckets.setdefault((scope, table, signature), set()).add(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+            self.dirty = True
+            return True
+
+    def save(self, path: str) -> None:
+        """Write entries to a JSON snapshot (vectors are rebuilt on load)"""
+        with self._lock:
+            entries = [
+                {
+                    "scope": entry.scope,
+                    "question": entry.question,
+                    "answer": entry.answer,
+                    "created_at": entry.created_at,
+                    "hits": entry.hits,
+                }
+                for entry in self._entries.values()
+            ]
+            self.dirty = False
+        snapshot = {"version": SNAPSHOT_VERSION, "entries": entries}
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(snapshot, f)
+        # Atomic, so a crash mid-write never leaves a truncated snapshot
+        os.replace(temp_path, path)
+
+    def load(self, path: str) -> int:
+        """Add entries from a snapshot, oldest first; returns how many were loaded"""
+        if not os.path.exists(path):
+            return 0
+        with open(path) as f:
+            snapshot = json.load(f)
+        if snapshot.get("version") != SNAPSHOT_VERSION:
+            return 0
+        loaded = 0
+        now = time.time()
+        for item in snapshot.get("entries", []):
+            if now - item["created_at"] > self.ttl:
+                continue
+            if self.add(item["scope"], item["question"], item["answer"], created_at=item["created_at"]):
+                loaded += 1
+        self.dirty = False
+        return loaded
+
+
+def create_semantic_cache() -> Optional[SemanticCache]:
+    """Build the chat cache from SEMANTIC_CACHE_* settings; None when disabled"""
+    if os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() != "true":
+        return None
+    return SemanticCache(
+        threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.9")),
+        max_entries=int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "5000")),
+        ttl=float(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", str(7 * 86400))),
+    )
@@ -0,0 +1,124 @@
+"""
+Batched removal of objects from the project-files storage bucket
+
+Objects live under "{project_id}/{timestamp}_{filename}". Storage removes
+and listings are done a page at a time, so cleaning up thousands of files
+costs a handful of requests instead of one per object.
+"""
+import asyncio
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, Iterator, List
+
+PROJECT_FILES_BUCKET = "project-files"
+REMOVE_BATCH_SIZE = 1000
+LIST_PAGE_SIZE = 1000
+
+
+def chunked(items: List[Any], size: int) -> Iterator[List[Any]]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def remove_objects(supabase, paths: Iterable[str]) -> int:
+    """Remove objects from the bucket in batches; returns how many were requested"""
+    paths = list(paths)
+    bucket = supabase.storage.from_(PROJECT_FILES_BUCKET)
+    for batch in chunked(paths, REMOVE_BATCH_SIZE):
+        bucket.remove(batch)
+    return len(paths)
+
+
+def list_folder(supabase, prefix: str) -> List[Dict[str, Any]]:
+    """List every entry directly under a folder, following pagination"""
+    bucket = supabase.storage.from_(PROJECT_FILES_BUCKET)
+    entries: List[Dict[str, Any]] = []
+    offset = 0
+    while True:
+        page = bucket.list(prefix, {"limit": LIST_PAGE_SIZE, "offset": offset})
+        entries.extend(page)
+        if len(page) < LIST_PAGE_SIZE:
+            return entries
+        offset += LIST_PAGE_SIZE
+
+
+def purge_project_objects(supabase, project_id: str) -> int:
+    """Remove every object stored under a project's folder"""
+    bucket = supabase.storage.from_(PROJECT_FILES_BUCKET)
+    removed = 0
+    while True:
+        # Removed objects drop out of the listing, so always read offset 0
+        page = bucket.list(project_id, {"limit": LIST_PAGE_SIZE, "offset": 0})
+        # Sub-folders are listed with a null id
+        paths = [f"{project_id}/{entry['name']}" for entry in page if entry.get("id")]
+        if not paths:
+            return removed
+        result = bucket.remove(paths)
+        removed += len(paths)
+        if not result or len(page) < LIST_PAGE_SIZE:
+            return removed
+
+
+def _is_uuid(value: str) -> bool:
+    try:
+        uuid.UUID(value)
+        return True
+    except ValueError:
+        return False
+
+
+def _older_than(entry: Dict[str, Any], cutoff: datetime) -> bool:
+    created_at = entry.get("created_at")
+    if not created_at:
+        return False
+    created = datetime.fromisoformat(created_at.replace("Z", "+00:00"))
+    return created < cutoff
+
+
+async def sweep_orphaned_objects(
+    supabase, repository, deep: bool = False, grace_seconds: int = 3600
+) -> Dict[str, int]:
+    """
+    Find and remove storage objects that no longer belong to anything.
+
+    Folders whose project row is gone are purged outright. With deep=True,
+    objects in live project folders that have no files row are removed too,
+    as long as they are older than grace_seconds (the browser uploads the
+    object before inserting its files row). Storage calls run in worker
+    threads; rows are read through the repository.
+    """
+    stats = {"orphaned_projects": 0, "orphaned_objects": 0}
+    folders = [
+        entry["name"]
+        for entry in await asyncio.to_thread(list_folder, supabase, "")
+        if not entry.get("id") and _is_uuid(entry["name"])
+    ]
+
+    live_projects = set(await repository.get_project_ids(folders))
+
+    for project_id in folders:
+        if project_id not in live_projects:
+            stats["orphaned_objects"] += await asyncio.to_thread(
+                purge_project_objects, supabase, project_id
+            )
+            stats["orphaned_projects"] += 1
+
+    if not deep:
+        return stats
+
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=grace_seconds)
+    for project_id in live_projects:
+        listing = await asyncio.to_thread(list_folder, supabase, project_id)
+        entries = [entry for entry in listing if entry.get("id")]
+        if not entries:
+            continue
+        known = await repository.list_files(project_id, columns=("path",))
+        known_paths = {row["path"] for row in known}
+        orphans = [
+            f"{project_id}/{entry['name']}"
+            for entry in entries
+            if f"{project_id}/{entry['name']}" not in known_paths and _older_than(entry, cutoff)
+        ]
+        stats["orphaned_objects"] += await asyncio.to_thread(remove_objects, supabase, orphans)
+
+    return stats
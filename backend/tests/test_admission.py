@@ -0,0 +1,99 @@
+import asyncio
+import time
+
+from services import admission
+from services.admission import BATCH_SCOPE_KEY, AdmissionMiddleware, RouteClass
+
+
+def classes(agent_limit=8):
+    return {
+        "crud": RouteClass("crud", limit=64, max_queue=0, max_wait=1.0, timeout=1.0),
+        "agent": RouteClass("agent", limit=agent_limit, max_queue=0, max_wait=1.0, timeout=10.0),
+        "transfer": RouteClass("transfer", limit=4, max_queue=0, max_wait=1.0, timeout=100.0),
+    }
+
+
+def scope(method, path, headers=(), batch=False):
+    value = {"type": "http", "method": method, "path": path, "headers": list(headers)}
+    if batch:
+        value[BATCH_SCOPE_KEY] = True
+    return value
+
+
+async def call(middleware, request_scope):
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    await middleware(request_scope, receive, send)
+    return messages[0]["status"] if messages else None
+
+
+def respond(seen):
+    async def app(request_scope, receive, send):
+        seen.append(admission.time_left())
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    return app
+
+
+def test_batch_gets_the_timeout_of_its_most_expensive_operation():
+    seen = []
+
+    async def batch_app(request_scope, receive, send):
+        seen.append(admission.time_left())
+        admission.extend_deadline_for(request_scope, [
+            ("PUT", "/api/projects/p1/notebook"),
+            ("POST", "/api/projects/p1/agent/analyze?templates=true"),
+        ])
+        await respond(seen)(request_scope, receive, send)
+
+    middleware = AdmissionMiddleware(batch_app, enabled=True, classes=classes())
+    assert asyncio.run(call(middleware, scope("POST", "/api/batch"))) == 200
+    assert seen[0] <= 1.0 and 9.0 < seen[1] <= 10.0
+
+
+def test_batch_deadline_stays_within_the_client_budget():
+    seen = []
+
+    async def batch_app(request_scope, receive, send):
+        admission.extend_deadline_for(request_scope, [("POST", "/api/projects/p1/agent/chat")])
+        await respond(seen)(request_scope, receive, send)
+
+    middleware = AdmissionMiddleware(batch_app, enabled=True, classes=classes())
+    asyncio.run(call(middleware, scope("POST", "/api/batch", [(b"x-request-timeout-ms", b"3000")])))
+    assert 2.0 < seen[0] <= 3.0
+
+
+def test_batched_agent_operations_take_agent_slots():
+    route_classes = classes(agent_limit=1)
+    seen = []
+    middleware = AdmissionMiddleware(respond(seen), enabled=True, classes=route_classes)
+
+    async def run():
+        # Another request holds the only agent slot
+        assert await route_classes["agent"].acquire(deadline=float("inf"))
+        agent = await call(middleware, scope("POST", "/api/projects/p1/agent/chat", batch=True))
+        crud = await call(middleware, scope("PUT", "/api/projects/p1/notebook", batch=True))
+        return agent, crud
+
+    assert asyncio.run(run()) == (503, 200)
+    assert route_classes["crud"].in_flight == 0
+
+
+def test_batched_operations_never_outlive_the_batch():
+    seen = []
+    middleware = AdmissionMiddleware(respond(seen), enabled=True, classes=classes())
+
+    async def run():
+        # The batch's own deadline, as the middleware set it for POST /api/batch
+        admission._deadline.set(time.monotonic() + 2.0)
+        await call(middleware, scope("POST", "/api/projects/p1/agent/chat", batch=True))
+
+    asyncio.run(run())
+    assert seen[0] <= 2.0
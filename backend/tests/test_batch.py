@@ -0,0 +1,176 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+
+from services import batch
+
+
+def op(id, method, path, body=None, depends_on=None, headers=None):
+    return {"id": id, "method": method, "path": path, "body": body, "depends_on": depends_on, "headers": headers}
+
+
+class FakeDispatch:
+    """Records sub-requests and answers them from a handler"""
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.calls = []
+
+    async def __call__(self, method, path, body, headers, restore=False):
+        self.calls.append({"method": method, "path": path, "body": body, "headers": headers, "restore": restore})
+        status, response_body, etag = self.handler(method, path, body, headers)
+        return {"status": status, "headers": {"etag": etag} if etag else {}, "body": response_body}
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_plan_orders_writes_to_the_same_resource():
+    operations = [
+        op("a", "PUT", "/api/projects/p1/notebook"),
+        op("b", "GET", "/api/projects/p1/notebook"),
+        op("c", "PUT", "/api/projects/p1/notebook"),
+        op("d", "PUT", "/api/projects/p1/agent/steps"),
+        op("e", "PUT", "/api/projects/p2/notebook"),
+        op("f", "GET", "/api/projects/p1/notebook"),
+    ]
+    assert batch.plan(operations) == [set(), {0}, {0, 1}, set(), set(), {0, 2}]
+
+
+def test_plan_orders_the_project_row_against_its_whole_project():
+    operations = [
+        op("a", "PUT", "/api/projects/p1/notebook"),
+        op("b", "PUT", "/api/projects/p1/agent/steps"),
+        op("c", "DELETE", "/api/projects/p1"),
+        op("d", "GET", "/api/projects/p2/files"),
+    ]
+    assert batch.plan(operations) == [set(), set(), {0, 1}, set()]
+
+
+def test_plan_adds_explicit_dependencies():
+    operations = [
+        op("a", "POST", "/api/projects"),
+        op("b", "GET", "/api/projects/p2/notebook", depends_on=["a"]),
+    ]
+    assert batch.plan(operations) == [set(), {0}]
+
+
+def test_failed_dependency_skips_with_424():
+    def handler(method, path, body, headers):
+        return (500, {"detail": "boom"}, None) if path == "/api/projects/p1/notebook" else (200, {}, None)
+
+    operations = [
+        op("save", "PUT", "/api/projects/p1/notebook"),
+        op("steps", "PUT", "/api/projects/p1/agent/steps", depends_on=["save"]),
+        op("other", "PUT", "/api/projects/p1/notebook"),
+    ]
+    dispatch = FakeDispatch(handler)
+    results = run(batch.run_concurrent(operations, dispatch))
+
+    assert [result["status"] for result in results] == [500, 424, 500]
+    assert results[1]["body"] == {"detail": "Dependency save failed"}
+    # Ordering alone does not skip: the second notebook write still ran
+    assert [call["path"] for call in dispatch.calls].count("/api/projects/p1/notebook") == 2
+
+
+def test_validate_rejects_an_irreversible_write_before_the_end():
+    app = FastAPI()
+    for path in ("/api/projects/{project_id}", "/api/projects/{project_id}/agent/steps"):
+        app.add_api_route(path, lambda: None, methods=["PUT", "DELETE"])
+    operations = [
+        op("a", "DELETE", "/api/projects/p1"),
+        op("b", "PUT", "/api/projects/p1/agent/steps"),
+    ]
+    with pytest.raises(ValueError, match="cannot be undone"):
+        batch.validate(app, operations, atomic=True, max_operations=50)
+    batch.validate(app, list(reversed(operations)), atomic=True, max_operations=50)
+
+
+class Store:
+    """Rows behind the fake routes of the rollback tests"""
+
+    def __init__(self):
+        self.session = {
+            "steps": [{"title": "Load"}],
+            "current_step": 0,
+            "metadata": {"package_manifest": {"packages": ["pandas"]}, "plan_template": {"key": "k"}},
+        }
+        self.version = 1
+        self.conflict_on_restore = False
+
+    def handler(self, method, path, body, headers):
+        if path == "/api/projects" and method == "POST":
+            return 201, {"id": "new"}, None
+        if path == "/api/projects/new" and method == "DELETE":
+            return 204, None, None
+        if path == "/api/projects/p1/agent" and method == "GET":
+            return 200, dict(self.session), f'"{self.version}"'
+        if path == "/api/projects/p1/agent/steps" and method == "PUT":
+            if headers.get("If-Match") and (self.conflict_on_restore or headers["If-Match"] != f'"{self.version}"'):
+                return 412, {"detail": "Resource has been modified since it was fetched"}, None
+            self.session = {**self.session, **body}
+            if "metadata" not in body:
+                # The route derives the metadata from the steps
+                self.session["metadata"] = {"package_manifest": {"packages": ["numpy"]}}
+            self.version += 1
+            return 200, dict(self.session), f'"{self.version}"'
+        return 400, {"detail": "bad request"}, None
+
+
+def test_atomic_failure_restores_updates_and_derived_metadata():
+    store = Store()
+    before = dict(store.session)
+    operations = [
+        op("create", "POST", "/api/projects", {"title": "x"}),
+        op("steps", "PUT", "/api/projects/p1/agent/steps", {"steps": [{"title": "Fit"}]}),
+        op("bad", "PUT", "/api/projects/p1/notebook", {"cells": []}),
+        op("never", "PUT", "/api/projects/p1/agent/steps", {"steps": []}),
+    ]
+    dispatch = FakeDispatch(store.handler)
+    results, committed, rolled_back = run(batch.run_atomic(operations, dispatch))
+
+    assert (committed, rolled_back) == (False, True)
+    assert [result["status"] for result in results] == [201, 200, 400, 424]
+    assert results[0]["reverted"] is True and results[1]["reverted"] is True
+    assert "reverted" not in results[2]
+    assert store.session == before
+
+    restore = next(call for call in dispatch.calls if call["restore"])
+    assert restore["body"] == {"steps": before["steps"], "metadata": before["metadata"]}
+    assert restore["headers"] == {"If-Match": '"2"'}
+    # Reverted in reverse order: the step update first, then the created project
+    assert [call["method"] for call in dispatch.calls[-2:]] == ["PUT", "DELETE"]
+
+
+def test_atomic_reports_which_revert_failed():
+    store = Store()
+    store_handler = store.handler
+
+    def handler(method, path, body, headers):
+        if path == "/api/projects/p1/notebook":
+            # Someone else edits the steps before the batch fails
+            store.conflict_on_restore = True
+            return 500, {"detail": "boom"}, None
+        return store_handler(method, path, body, headers)
+
+    operations = [
+        op("create", "POST", "/api/projects", {"title": "x"}),
+        op("steps", "PUT", "/api/projects/p1/agent/steps", {"steps": [{"title": "Fit"}]}),
+        op("bad", "PUT", "/api/projects/p1/notebook", {"cells": []}),
+    ]
+    results, committed, rolled_back = run(batch.run_atomic(operations, FakeDispatch(handler)))
+
+    assert (committed, rolled_back) == (False, False)
+    assert results[1]["reverted"] is False and results[1]["revert_status"] == 412
+    assert results[0]["reverted"] is True and "revert_status" not in results[0]
+
+
+def test_atomic_success_leaves_results_untouched():
+    store = Store()
+    operations = [op("steps", "PUT", "/api/projects/p1/agent/steps", {"steps": []})]
+    results, committed, rolled_back = run(batch.run_atomic(operations, FakeDispatch(store.handler)))
+
+    assert (committed, rolled_back) == (True, None)
+    assert "reverted" not in results[0]
@@ -0,0 +1,42 @@
+from fastapi import FastAPI, Header, Response
+from fastapi.testclient import TestClient
+
+from services.compression import CompressionMiddleware
+from services.http_cache import etag_matches
+
+ETAG = '"0123456789abcdef"'
+BODY = b'{"cells": "' + b"x" * 4096 + b'"}'
+
+
+def client():
+    app = FastAPI()
+
+    @app.get("/row")
+    def row(if_none_match: str = Header(None)):
+        if etag_matches(if_none_match, ETAG):
+            return Response(status_code=304, headers={"ETag": ETAG})
+        return Response(content=BODY, media_type="application/json", headers={"ETag": ETAG})
+
+    app.add_middleware(CompressionMiddleware, minimum_size=1024)
+    return TestClient(app)
+
+
+def test_compressed_responses_get_a_per_encoding_etag():
+    http = client()
+    plain = http.get("/row", headers={"Accept-Encoding": "identity"})
+    gzipped = http.get("/row", headers={"Accept-Encoding": "gzip"})
+
+    assert plain.headers["etag"] == ETAG
+    assert gzipped.headers["content-encoding"] == "gzip"
+    assert gzipped.headers["etag"] == '"0123456789abcdef-gz"'
+    assert gzipped.content == BODY
+
+
+def test_suffixed_etags_still_revalidate_and_match():
+    http = client()
+    revalidated = http.get("/row", headers={"Accept-Encoding": "gzip", "If-None-Match": '"0123456789abcdef-gz"'})
+
+    assert revalidated.status_code == 304
+    assert revalidated.headers["etag"] == '"0123456789abcdef-gz"'
+    assert etag_matches('"0123456789abcdef-br"', ETAG, weak=False)
+    assert not etag_matches('"0123456789abcdef-zz"', ETAG, weak=False)
@@ -0,0 +1,54 @@
+import asyncio
+import io
+import json
+import zipfile
+
+from services.export import import_contents, iter_cells, read_upload
+from services.repository import InMemoryRepository
+
+
+def bundle(plan):
+    spool = io.BytesIO()
+    with zipfile.ZipFile(spool, "w") as archive:
+        archive.writestr("agent_plan.json", json.dumps(plan))
+    spool.seek(0)
+    return spool
+
+
+def test_import_keeps_only_plan_settings_and_rebuilds_the_manifest():
+    upload = read_upload(bundle({
+        "steps": [{"title": "Fit", "code": "import sklearn"}],
+        "metadata": {
+            "semantic_cache": False,
+            "plan_templates": "yes",
+            "plan_source": "template",
+            "plan_template": {"key": "someone-else|chemistry|spectroscopy|csv", "titles": ["Fit"]},
+            "package_manifest": {"packages": ["evil"]},
+        },
+    }))
+    repository = InMemoryRepository()
+
+    async def run():
+        await import_contents(repository, None, "p1", "u1", upload)
+        return await repository.get_agent_session("p1")
+
+    try:
+        session = asyncio.run(run())
+    finally:
+        upload.close()
+
+    metadata = session["metadata"]
+    assert set(metadata) == {"semantic_cache", "package_manifest"}
+    assert metadata["semantic_cache"] is False
+    assert metadata["package_manifest"]["packages"] == ["scikit-learn"]
+
+
+def test_iter_cells_pages_through_the_whole_notebook():
+    repository = InMemoryRepository()
+    cells = [{"id": str(i), "type": "code", "content": f"x = {i}"} for i in range(7)]
+
+    async def run():
+        await repository.create_notebook({"project_id": "p1", "cells": cells, "metadata": {}})
+        return [cell async for cell in iter_cells(repository, "p1", page_size=3)]
+
+    assert asyncio.run(run()) == cells
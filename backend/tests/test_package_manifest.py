@@ -0,0 +1,24 @@
+from services.package_manifest import analyze_code, merge_manifests
+
+
+def test_only_pyodide_packages_are_listed():
+    analysis = analyze_code(
+        "import numpy as np\n"
+        "import helpers\n"
+        "from sklearn.linear_model import LinearRegression\n"
+        "import pnadas\n"
+        "%pip install scipy requestz\n"
+    )
+
+    assert analysis["packages"] == ["numpy", "scikit-learn", "scipy"]
+    assert analysis["imports"] == ["numpy", "sklearn"]
+
+
+def test_stored_manifests_are_filtered_on_merge():
+    stored = {"packages": ["numpy", "helpers"], "sources": {"step:0": {"packages": ["numpy", "helpers"], "files": []}}}
+
+    merged = merge_manifests(stored)
+
+    assert merged["packages"] == ["numpy"]
+    assert merged["sources"]["step:0"]["packages"] == ["numpy"]
+    assert stored["sources"]["step:0"]["packages"] == ["numpy", "helpers"]
@@ -0,0 +1,34 @@
+import asyncio
+
+from services.postgres_repository import PostgresRepository
+
+PROJECT_ID = "5003fafc-7ff6-4b77-b8d9-962613230987"
+
+
+def test_malformed_ids_match_nothing_without_a_query():
+    repository = PostgresRepository("postgresql://unused")
+    # Any query would fail on this pool
+    repository.pool = object()
+
+    async def run():
+        return [
+            await repository.list_projects("not-a-uuid"),
+            await repository.get_project("not-a-uuid", PROJECT_ID),
+            await repository.get_project_by_id("1; DROP TABLE projects"),
+            await repository.update_project(PROJECT_ID, "x", {"title": "t"}),
+            await repository.delete_project("not-a-uuid", PROJECT_ID),
+            await repository.get_notebook(""),
+            await repository.update_notebook("not-a-uuid", {"cells": []}),
+            await repository.get_notebook_cells("not-a-uuid"),
+            [cell async for cell in repository.iter_notebook_cells("not-a-uuid")],
+            await repository.list_files("not-a-uuid"),
+            await repository.get_file(PROJECT_ID, "not-a-uuid"),
+            await repository.get_files("not-a-uuid", [PROJECT_ID]),
+            await repository.get_agent_session("not-a-uuid"),
+            await repository.update_agent_session("not-a-uuid", {"status": "idle"}),
+            await repository.search("not-a-uuid", "fft"),
+        ]
+
+    assert asyncio.run(run()) == [
+        [], None, None, None, False, None, None, [], [], [], None, [], None, None, ([], 0),
+    ]
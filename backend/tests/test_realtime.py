@@ -0,0 +1,34 @@
+import asyncio
+
+from services.cache import MemoryBackend
+from services.realtime import CacheChangeRelay, ChangeHub
+
+
+def test_writes_reach_subscribers_on_other_workers():
+    rows = {"notebooks": {"id": "n1", "cells": []}}
+    loads = []
+
+    async def loader(project_id, table):
+        loads.append((project_id, table))
+        return rows[table]
+
+    async def run():
+        # Two workers sharing one cache back end
+        backend = MemoryBackend()
+        writer, reader = ChangeHub(loader, coalesce_window=0.01), ChangeHub(loader, coalesce_window=0.01)
+        for hub in (writer, reader):
+            await CacheChangeRelay(hub, backend).start()
+        subscription = reader.subscribe("p1")
+        mine = writer.subscribe("p1")
+
+        writer.publish("p1", "notebooks", rows["notebooks"])
+        remote = await subscription.next_event(timeout=1)
+        local = await mine.next_event(timeout=1)
+        # The writer does not hear its own write twice
+        echo = await mine.next_event(timeout=0.05)
+        return remote, local, echo
+
+    remote, local, echo = asyncio.run(run())
+    assert remote == {"type": "changed", "table": "notebooks", "changes": {"id": "n1", "cells": []}}
+    assert local == remote and echo is None
+    assert loads == [("p1", "notebooks")]
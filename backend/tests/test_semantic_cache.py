@@ -0,0 +1,41 @@
+import pytest
+
+from services.semantic_cache import SemanticCache, is_follow_up, plan_scope
+
+STEPS = [{"title": "Load spectra", "description": "Read the CSV files", "code": "import pandas as pd"}]
+
+
+@pytest.mark.parametrize("question", [
+    "Why did you say that?",
+    "Can you explain your previous answer in more detail?",
+    "What about the previous one?",
+    "Like you mentioned, should I drop the NaNs first?",
+    "Is the other one faster?",
+    "Please show that again with seaborn",
+    "Apply the same code to the second file",
+])
+def test_back_references_are_follow_ups(question):
+    assert is_follow_up(question)
+
+
+@pytest.mark.parametrize("question", [
+    "What does this cell do with that column?",
+    "How do I normalize it before fitting the peaks?",
+    "Which of these baseline corrections works best for Raman spectra?",
+    "How do I plot the last column against time?",
+    "Should I use the same units for both axes?",
+])
+def test_standalone_questions_are_not_follow_ups(question):
+    assert not is_follow_up(question)
+
+
+def test_first_answers_are_shared_across_owners():
+    cache = SemanticCache()
+    question = "How do I normalize this spectrum before fitting peaks?"
+    shared = plan_scope(None, STEPS)
+    cache.add(shared, question, "Divide by the maximum intensity.")
+
+    assert cache.lookup(plan_scope("owner-b", STEPS), question, shared) == "Divide by the maximum intensity."
+    # An owner's own answers are not seen by anyone else
+    cache.add(plan_scope("owner-a", STEPS, 1), question, "As we discussed, use min-max.")
+    assert cache.lookup(plan_scope("owner-b", STEPS, 1), question, plan_scope(None, STEPS, 1)) is None
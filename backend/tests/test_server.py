@@ -0,0 +1,56 @@
+import asyncio
+import importlib
+import threading
+import types
+from contextlib import asynccontextmanager
+
+import httpx
+from fastapi import FastAPI
+
+from server import LazyApp
+
+
+def test_health_is_served_while_main_imports(monkeypatch):
+    release, events = threading.Event(), []
+
+    @asynccontextmanager
+    async def lifespan(app):
+        events.append("startup")
+        yield
+        events.append("shutdown")
+
+    def import_main(name):
+        # Stands in for the slow import of main
+        release.wait(5)
+        module = types.ModuleType(name)
+        module.app = FastAPI(lifespan=lifespan)
+        module.app.get("/api/ping")(lambda: {"pong": True})
+        module.app.get("/health")(lambda: {"status": "main"})
+        return module
+
+    monkeypatch.setattr(importlib, "import_module", import_main)
+    lazy = LazyApp()
+
+    async def run():
+        messages, sent = asyncio.Queue(), []
+        await messages.put({"type": "lifespan.startup"})
+
+        async def send(message):
+            sent.append(message["type"])
+
+        lifespan_task = asyncio.create_task(lazy({"type": "lifespan"}, messages.get, send))
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=lazy), base_url="http://t") as client:
+            health, ready = await client.get("/health"), await client.get("/ready")
+            assert (health.status_code, ready.status_code) == (200, 503)
+            ping = asyncio.create_task(client.get("/api/ping"))
+            await asyncio.sleep(0.05)
+            assert not ping.done()
+            release.set()
+            assert (await ping).json() == {"pong": True}
+            assert (await client.get("/health")).json() == {"status": "main"}
+        await messages.put({"type": "lifespan.shutdown"})
+        await lifespan_task
+        return sent
+
+    assert asyncio.run(run()) == ["lifespan.startup.complete", "lifespan.shutdown.complete"]
+    assert events == ["startup", "shutdown"]
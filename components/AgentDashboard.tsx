@@ -5,7 +5,7 @@ import { useRouter } from 'next/navigation'
 import AgentStepsView from './AgentStepsView'
 import AgentChat from './AgentChat'
 import { createClient } from '@/lib/supabase/client'
-import { api, API_BASE_URL } from '@/lib/api'
+import { api, API_BASE_URL, subscribeToProject, ApiError, ProjectChangeEvent } from '@/lib/api'
 
 interface AgentDashboardProps {
   projectId: string
@@ -23,16 +23,22 @@ interface Step {
 export default function AgentDashboard({ projectId, initialSession }: AgentDashboardProps) {
   const router = useRouter()
   const [session, setSession] = useState(initialSession)
+  // ETag of the session as shown, sent with edits so they never overwrite a
+  // newer plan (such as one Gemini finished in the background)
+  const [etag, setEtag] = useState<string | null>(null)
   const [loading, setLoading] = useState(false)
   const [error, setError] = useState<string | null>(null)
   const [analyzing, setAnalyzing] = useState(false)
+  const [useTemplates, setUseTemplates] = useState(false)
   const supabase = createClient()
 
-  const fetchSession = async () => {
+  // quiet: refresh in place without the loading spinner
+  const fetchSession = async (quiet = false) => {
     try {
-      setLoading(true)
-      const data = await api.agent.get(projectId)
+      if (!quiet) setLoading(true)
+      const { data, etag } = await api.agent.get(projectId)
       setSession(data)
+      setEtag(etag)
     } catch (err: any) {
       // 404 is expected when no session exists yet - this is fine
       // Network errors are also okay if no session exists yet
@@ -62,20 +68,56 @@ export default function AgentDashboard({ projectId, initialSession }: AgentDashb
   }
 
   useEffect(() => {
-    if (!session) {
-      // Try to fetch session
-      fetchSession()
-    }
+    // Fetch even with an initial session, for its ETag
+    fetchSession(!!session)
     // eslint-disable-next-line react-hooks/exhaustive-deps
   }, [])
 
+  // Status changes, new steps and plans finished in the background are
+  // pushed by the backend instead of polled for
+  useEffect(() => {
+    let closed = false
+    let close: (() => void) | null = null
+
+    const handleEvent = (event: ProjectChangeEvent) => {
+      if (event.type === 'ping') return
+      if (event.type === 'resync') {
+        fetchSession(true)
+        return
+      }
+      if (event.table !== 'agent_sessions') return
+      if (event.type === 'deleted') {
+        setSession(null)
+      } else {
+        fetchSession(true)
+      }
+    }
+
+    subscribeToProject(projectId, handleEvent)
+      .then((unsubscribe) => {
+        if (closed) {
+          unsubscribe()
+        } else {
+          close = unsubscribe
+        }
+      })
+      .catch((err) => console.error('Error subscribing to project changes:', err))
+
+    return () => {
+      closed = true
+      close?.()
+    }
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, [projectId])
+
   const handleAnalyze = async () => {
     setAnalyzing(true)
     setError(null)
 
     try {
-      const data = await api.agent.analyze(projectId)
+      const { data, etag } = await api.agent.analyze(projectId, { templates: useTemplates })
       setSession(data)
+      setEtag(etag)
     } catch (err: any) {
       console.error('Error analyzing research goal:', err)
       const isNetworkError = err.message.includes('fetch') || err.message.includes('Failed to fetch')
@@ -91,8 +133,9 @@ export default function AgentDashboard({ projectId, initialSession }: AgentDashb
 
   const handleStepExecute = async (stepIndex: number) => {
     try {
-      const updatedSession = await api.agent.execute(projectId, stepIndex)
+      const { data: updatedSession, etag } = await api.agent.execute(projectId, stepIndex)
       setSession(updatedSession)
+      setEtag(etag)
 
       // Navigate to notebook to execute the code
       router.push(`/projects/${projectId}/notebook?step=${stepIndex}`)
@@ -111,9 +154,20 @@ export default function AgentDashboard({ projectId, initialSession }: AgentDashb
       const updatedSteps = [...(session.steps || [])]
       updatedSteps[stepIndex] = modifiedStep
 
-      const updatedSession = await api.agent.updateSteps(projectId, { steps: updatedSteps })
+      const { data: updatedSession, etag: updatedEtag } = await api.agent.updateSteps(
+        projectId,
+        { steps: updatedSteps },
+        etag
+      )
       setSession(updatedSession)
+      setEtag(updatedEtag)
     } catch (err: any) {
+      if ((err as ApiError).status === 412) {
+        // The plan changed since it was shown; show the latest and keep it
+        await fetchSession(true)
+        setError('The plan was updated while you were editing it. The latest version is shown; please apply your change again.')
+        return
+      }
       setError(err.message || 'Failed to update step')
     }
   }
@@ -149,6 +203,15 @@ export default function AgentDashboard({ projectId, initialSession }: AgentDashb
             <p className="text-red-400 text-sm">{error}</p>
           </div>
         )}
+        <label className="flex items-center justify-center gap-2 text-sm text-gray-400 mb-6">
+          <input
+            type="checkbox"
+            checked={useTemplates}
+            onChange={(e) => setUseTemplates(e.target.checked)}
+            className="rounded border-white/20 bg-white/5"
+          />
+          Start from my earlier plans for similar projects while the new plan is written
+        </label>
         <button
           onClick={handleAnalyze}
           disabled={analyzing}
@@ -2,6 +2,7 @@
 
 import { useEffect, useState } from 'react'
 import { createClient } from '@/lib/supabase/client'
+import { api } from '@/lib/api'
 
 interface File {
   id: string
@@ -19,6 +20,8 @@ export default function FilesList({ projectId }: FilesListProps) {
   const [files, setFiles] = useState<File[]>([])
   const [loading, setLoading] = useState(true)
   const [error, setError] = useState<string | null>(null)
+  const [selected, setSelected] = useState<Set<string>>(new Set())
+  const [deleting, setDeleting] = useState(false)
   const supabase = createClient()
 
   useEffect(() => {
@@ -40,14 +43,10 @@ export default function FilesList({ projectId }: FilesListProps) {
 
   const fetchFiles = async () => {
     try {
-      const { data, error } = await supabase
-        .from('files')
-        .select('*')
-        .eq('project_id', projectId)
-        .order('created_at', { ascending: false })
-
-      if (error) throw error
+      const data = await api.files.list(projectId)
       setFiles(data || [])
+      // Drop selections of files that are gone
+      setSelected((current) => new Set(Array.from(current).filter((id) => data.some((file) => file.id === id))))
     } catch (err: any) {
       setError(err.message || 'Failed to fetch files')
     } finally {
@@ -76,32 +75,45 @@ export default function FilesList({ projectId }: FilesListProps) {
     }
   }
 
-  const handleDelete = async (fileId: string, filePath: string) => {
+  const handleDelete = async (fileId: string) => {
     if (!confirm('Are you sure you want to delete this file?')) return
 
     try {
-      // Delete from storage first
-      const { error: storageError } = await supabase.storage
-        .from('project-files')
-        .remove([filePath])
+      // The API removes the stored object and the database row
+      await api.files.delete(projectId, fileId)
+      fetchFiles()
+    } catch (err: any) {
+      console.error('Delete error:', err)
+      alert('Failed to delete file: ' + err.message)
+    }
+  }
 
-      // Continue even if storage delete fails (file might not exist)
-      if (storageError && !storageError.message.includes('not found')) {
-        console.warn('Storage delete warning:', storageError)
+  const toggleSelected = (fileId: string) => {
+    setSelected((current) => {
+      const next = new Set(current)
+      if (next.has(fileId)) {
+        next.delete(fileId)
+      } else {
+        next.add(fileId)
       }
+      return next
+    })
+  }
 
-      // Delete from database
-      const { error: dbError } = await supabase
-        .from('files')
-        .delete()
-        .eq('id', fileId)
-
-      if (dbError) throw dbError
+  const handleDeleteSelected = async () => {
+    if (!confirm(`Are you sure you want to delete ${selected.size} files?`)) return
 
+    setDeleting(true)
+    try {
+      // One request for storage and database, however many files
+      await api.files.bulkDelete(projectId, Array.from(selected))
+      setSelected(new Set())
       fetchFiles()
     } catch (err: any) {
       console.error('Delete error:', err)
-      alert('Failed to delete file: ' + err.message)
+      alert('Failed to delete files: ' + err.message)
+    } finally {
+      setDeleting(false)
     }
   }
 
@@ -139,11 +151,27 @@ export default function FilesList({ projectId }: FilesListProps) {
 
   return (
     <div className="space-y-2">
+      {selected.size > 0 && (
+        <button
+          onClick={handleDeleteSelected}
+          disabled={deleting}
+          className="w-full px-3 py-2 text-sm text-red-400 bg-red-500/10 hover:bg-red-500/20 border border-red-500/20 rounded-lg transition-colors disabled:opacity-50"
+        >
+          {deleting ? 'Deleting...' : `Delete selected (${selected.size})`}
+        </button>
+      )}
       {files.map((file) => (
         <div
           key={file.id}
           className="flex items-center justify-between p-3 bg-white/5 rounded-lg border border-white/5 hover:border-white/10 transition-colors"
         >
+          <input
+            type="checkbox"
+            checked={selected.has(file.id)}
+            onChange={() => toggleSelected(file.id)}
+            className="mr-3 accent-white"
+            aria-label={`Select ${file.name}`}
+          />
           <div className="flex-1 min-w-0">
             <div className="font-medium text-white text-sm truncate">{file.name}</div>
             <div className="text-xs text-gray-500">
@@ -161,7 +189,7 @@ export default function FilesList({ projectId }: FilesListProps) {
               </svg>
             </button>
             <button
-              onClick={() => handleDelete(file.id, file.path)}
+              onClick={() => handleDelete(file.id)}
               className="p-1.5 text-gray-400 hover:text-red-400 hover:bg-red-500/10 rounded-lg transition-colors"
               title="Delete"
             >
@@ -3,7 +3,8 @@
 import { useEffect, useRef, useState } from 'react'
 import { createClient } from '@/lib/supabase/client'
 import { NotebookCell } from '@/lib/notebook'
-import { executePythonCode, loadPyodide, isPyodideLoaded } from '@/lib/pyodide-executor'
+import { executePythonCode, loadPyodide, isPyodideLoaded, preloadPackages } from '@/lib/pyodide-executor'
+import { api } from '@/lib/api'
 
 interface NotebookProps {
   projectId: string
@@ -76,6 +77,18 @@ function NotebookEditor({ projectId, initialContent, onSave }: NotebookProps) {
     } else if (isPyodideLoaded()) {
       setPyodideReady(true)
     }
+
+    // Fetch what the plan and notebook import while Pyodide loads, then
+    // install it all in the background so the first run does not stall
+    api.packages
+      .get(projectId)
+      .then((manifest) => preloadPackages(manifest.packages))
+      .then((failed) => {
+        if (failed.length > 0) {
+          console.warn('Could not preload packages:', failed.join(', '))
+        }
+      })
+      .catch((error) => console.warn('Package preload skipped:', error))
     // eslint-disable-next-line react-hooks/exhaustive-deps
   }, [])
 
@@ -10,11 +10,18 @@ async function getAuthToken(): Promise<string | null> {
   return session?.access_token || null
 }
 
-async function apiRequest<T>(
+// Errors carry the HTTP status, e.g. 412 when an If-Match write lost a race
+export interface ApiError extends Error {
+  status?: number
+}
+
+// Server components pass the access token from their own session
+async function sendRequest(
   endpoint: string,
-  options: RequestInit = {}
-): Promise<T> {
-  const token = await getAuthToken()
+  options: RequestInit = {},
+  accessToken?: string | null
+): Promise<Response> {
+  const token = accessToken === undefined ? await getAuthToken() : accessToken
   const headers: Record<string, string> = {
     'Content-Type': 'application/json',
     ...(options.headers as Record<string, string> || {}),
@@ -31,9 +38,21 @@ async function apiRequest<T>(
 
   if (!response.ok) {
     const error = await response.json().catch(() => ({ detail: 'An error occurred' }))
-    throw new Error(error.detail || `HTTP error! status: ${response.status}`)
+    const apiError: ApiError = new Error(error.detail || `HTTP error! status: ${response.status}`)
+    apiError.status = response.status
+    throw apiError
   }
 
+  return response
+}
+
+async function apiRequest<T>(
+  endpoint: string,
+  options: RequestInit = {},
+  accessToken?: string | null
+): Promise<T> {
+  const response = await sendRequest(endpoint, options, accessToken)
+
   if (response.status === 204) {
     return {} as T
   }
@@ -41,10 +60,31 @@ async function apiRequest<T>(
   return response.json()
 }
 
+// A row with the ETag to send back as If-Match when writing it
+export interface Versioned<T> {
+  data: T
+  etag: string | null
+}
+
+async function versionedRequest<T>(
+  endpoint: string,
+  options: RequestInit = {}
+): Promise<Versioned<T>> {
+  const response = await sendRequest(endpoint, options)
+  return { data: await response.json(), etag: response.headers.get('ETag') }
+}
+
 export const api = {
   projects: {
     list: () => apiRequest<any[]>('/api/projects'),
     get: (id: string) => apiRequest<any>(`/api/projects/${id}`),
+    workspace: (id: string, include?: Array<'notebook' | 'files' | 'agent'>, accessToken?: string | null) =>
+      apiRequest<{
+        project: any
+        notebook?: any | null
+        files?: any[]
+        agent_session?: any | null
+      }>(`/api/projects/${id}/workspace${include ? `?include=${include.join(',')}` : ''}`, { cache: 'no-store' }, accessToken),
     create: (data: { title: string; description?: string; status?: string }) =>
       apiRequest<any>('/api/projects', {
         method: 'POST',
@@ -60,20 +100,44 @@ export const api = {
         method: 'DELETE',
       }),
   },
+  packages: {
+    get: (projectId: string) =>
+      apiRequest<{
+        packages: string[]
+        imports: string[]
+        files: string[]
+        sources: Record<string, { packages: string[]; files: string[] }>
+      }>(`/api/projects/${projectId}/packages`),
+  },
+  files: {
+    list: (projectId: string) => apiRequest<any[]>(`/api/projects/${projectId}/files`),
+    delete: (projectId: string, fileId: string) =>
+      apiRequest<void>(`/api/projects/${projectId}/files/${fileId}`, {
+        method: 'DELETE',
+      }),
+    bulkDelete: (projectId: string, fileIds: string[]) =>
+      apiRequest<{ deleted: string[]; not_found: string[] }>(`/api/projects/${projectId}/files/bulk-delete`, {
+        method: 'POST',
+        body: JSON.stringify({ file_ids: fileIds }),
+      }),
+  },
   agent: {
-    analyze: (projectId: string) =>
-      apiRequest<any>(`/api/projects/${projectId}/agent/analyze`, {
+    // templates: start from a draft built from the user's own earlier plans
+    analyze: (projectId: string, options: { templates?: boolean } = {}) =>
+      versionedRequest<any>(`/api/projects/${projectId}/agent/analyze${options.templates ? '?templates=true' : ''}`, {
         method: 'POST',
       }),
     get: (projectId: string) =>
-      apiRequest<any>(`/api/projects/${projectId}/agent`),
-    updateSteps: (projectId: string, data: { steps: any[] }) =>
-      apiRequest<any>(`/api/projects/${projectId}/agent/steps`, {
+      versionedRequest<any>(`/api/projects/${projectId}/agent`),
+    // With etag, the write fails with 412 if the session changed since it was read
+    updateSteps: (projectId: string, data: { steps: any[] }, etag?: string | null) =>
+      versionedRequest<any>(`/api/projects/${projectId}/agent/steps`, {
         method: 'PUT',
         body: JSON.stringify(data),
+        headers: etag ? { 'If-Match': etag } : {},
       }),
     execute: (projectId: string, stepIndex: number) =>
-      apiRequest<any>(`/api/projects/${projectId}/agent/execute/${stepIndex}`, {
+      versionedRequest<any>(`/api/projects/${projectId}/agent/execute/${stepIndex}`, {
         method: 'POST',
       }),
     chat: (projectId: string, message: string) =>
@@ -83,3 +147,31 @@ export const api = {
       }),
   },
 }
+
+export type ProjectChangeEvent =
+  | { type: 'changed'; table: string; changes: Record<string, any> }
+  | { type: 'deleted'; table: string }
+  | { type: 'resync'; table?: string }
+  | { type: 'ping' }
+
+// Subscribe to pushed project changes; returns a function that closes the socket
+export async function subscribeToProject(
+  projectId: string,
+  onEvent: (event: ProjectChangeEvent) => void
+): Promise<() => void> {
+  const token = await getAuthToken()
+  const url = new URL(`${API_BASE_URL}/api/projects/${projectId}/live`)
+  url.protocol = url.protocol === 'https:' ? 'wss:' : 'ws:'
+  if (token) {
+    url.searchParams.set('token', token)
+  }
+
+  const socket = new WebSocket(url.toString())
+  socket.onmessage = (message) => {
+    const event = JSON.parse(message.data) as ProjectChangeEvent
+    if (event.type !== 'ping') {
+      onEvent(event)
+    }
+  }
+  return () => socket.close()
+}
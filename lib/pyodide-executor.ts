@@ -3,6 +3,7 @@
 
 let pyodideInstance: any = null
 let loadingPromise: Promise<any> | null = null
+const installedPackages = new Set<string>()
 
 export async function loadPyodide(): Promise<any> {
   if (pyodideInstance) {
@@ -76,6 +77,34 @@ export async function loadPyodide(): Promise<any> {
   return loadingPromise
 }
 
+// Install packages before the first run instead of on first import.
+// loadPackage only loads packages built into the Pyodide distribution, never
+// from PyPI, so a name that is not one of them is skipped rather than fetched.
+// Returns the packages that could not be installed.
+export async function preloadPackages(packages: string[]): Promise<string[]> {
+  const pending = packages.filter((name) => !installedPackages.has(name))
+  if (pending.length === 0) {
+    return []
+  }
+
+  const pyodide = await loadPyodide()
+  const failed: string[] = []
+  try {
+    // One call resolves everything together and downloads in parallel
+    await pyodide.loadPackage(pending)
+  } catch (error) {
+    console.warn('Package preload failed:', error)
+  }
+  for (const name of pending) {
+    if (pyodide.loadedPackages[name] || pyodide.loadedPackages[name.toLowerCase()]) {
+      installedPackages.add(name)
+    } else {
+      failed.push(name)
+    }
+  }
+  return failed
+}
+
 export interface ExecutionResult {
   output: string
   error: string | null
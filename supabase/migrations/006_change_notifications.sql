@@ -0,0 +1,47 @@
+-- Publish row changes for realtime push to connected clients
+-- The backend LISTENs on the labmind_changes channel (REALTIME_SOURCE=postgres)
+-- Payloads only carry the project id and table; the backend loads the row itself
+-- so notifications stay well under the 8000 byte NOTIFY limit
+
+CREATE OR REPLACE FUNCTION notify_project_change()
+RETURNS TRIGGER AS $$
+DECLARE
+    row_data RECORD;
+    changed_project_id UUID;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        row_data := OLD;
+    ELSE
+        row_data := NEW;
+    END IF;
+
+    IF TG_TABLE_NAME = 'projects' THEN
+        changed_project_id := row_data.id;
+    ELSE
+        changed_project_id := row_data.project_id;
+    END IF;
+
+    PERFORM pg_notify(
+        'labmind_changes',
+        json_build_object(
+            'project_id', changed_project_id,
+            'table', TG_TABLE_NAME,
+            'op', TG_OP
+        )::text
+    );
+    RETURN NULL;
+END;
+$$ language 'plpgsql';
+
+-- Create triggers for realtime tables
+CREATE TRIGGER notify_projects_change AFTER INSERT OR UPDATE OR DELETE ON projects
+    FOR EACH ROW EXECUTE FUNCTION notify_project_change();
+
+CREATE TRIGGER notify_notebooks_change AFTER INSERT OR UPDATE OR DELETE ON notebooks
+    FOR EACH ROW EXECUTE FUNCTION notify_project_change();
+
+CREATE TRIGGER notify_agent_sessions_change AFTER INSERT OR UPDATE OR DELETE ON agent_sessions
+    FOR EACH ROW EXECUTE FUNCTION notify_project_change();
+
+CREATE TRIGGER notify_files_change AFTER INSERT OR UPDATE OR DELETE ON files
+    FOR EACH ROW EXECUTE FUNCTION notify_project_change();
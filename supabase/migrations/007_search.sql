@@ -0,0 +1,228 @@
+-- Full-text search over project titles and descriptions, notebook cells and agent steps
+-- One search_documents row per project, cell and step, kept up to date by triggers.
+-- Only the cells or steps whose text changed are rewritten, so a notebook autosave
+-- does not re-index the whole notebook
+
+CREATE EXTENSION IF NOT EXISTS btree_gin;
+
+-- Split code into identifier parts so "np.fft.fft(x)" and "curve_fit" match "fft" and "fit"
+CREATE OR REPLACE FUNCTION search_code_terms(code TEXT)
+RETURNS TEXT AS $$
+    SELECT regexp_replace(coalesce(code, ''), '[^[:alnum:]]+', ' ', 'g');
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE TABLE IF NOT EXISTS search_documents (
+    project_id UUID NOT NULL REFERENCES projects(id) ON DELETE CASCADE,
+    user_id UUID NOT NULL REFERENCES auth.users(id) ON DELETE CASCADE,
+    kind TEXT NOT NULL CHECK (kind IN ('project', 'cell', 'step')),
+    ref TEXT NOT NULL,
+    title TEXT NOT NULL DEFAULT '',
+    body TEXT NOT NULL DEFAULT '',
+    code TEXT NOT NULL DEFAULT '',
+    search_vector TSVECTOR GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', title), 'A') ||
+        setweight(to_tsvector('english', body), 'B') ||
+        setweight(to_tsvector('simple', search_code_terms(code)), 'C')
+    ) STORED,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (project_id, kind, ref)
+);
+
+-- user_id first so each search only walks the caller's documents
+CREATE INDEX IF NOT EXISTS idx_search_documents_vector ON search_documents USING GIN (user_id, search_vector);
+
+-- Enable Row Level Security
+ALTER TABLE search_documents ENABLE ROW LEVEL SECURITY;
+
+-- Create policy: Users can search their own documents
+CREATE POLICY "Users can view own search documents"
+    ON search_documents FOR SELECT
+    USING (auth.uid() = user_id);
+
+-- Replace the documents of one kind for a project, touching only changed rows
+CREATE OR REPLACE FUNCTION sync_search_documents(
+    p_project_id UUID, p_kind TEXT, p_documents JSONB
+)
+RETURNS VOID AS $$
+DECLARE
+    project_owner UUID;
+BEGIN
+    SELECT user_id INTO project_owner FROM projects WHERE id = p_project_id;
+    IF project_owner IS NULL THEN
+        RETURN;
+    END IF;
+
+    DELETE FROM search_documents d
+    WHERE d.project_id = p_project_id
+      AND d.kind = p_kind
+      AND NOT EXISTS (
+          SELECT 1 FROM jsonb_array_elements(p_documents) doc WHERE doc->>'ref' = d.ref
+      );
+
+    INSERT INTO search_documents (project_id, user_id, kind, ref, title, body, code)
+    SELECT DISTINCT ON (doc->>'ref')
+        p_project_id, project_owner, p_kind, doc->>'ref',
+        coalesce(doc->>'title', ''), coalesce(doc->>'body', ''), coalesce(doc->>'code', '')
+    FROM jsonb_array_elements(p_documents) doc
+    ON CONFLICT (project_id, kind, ref) DO UPDATE
+        SET user_id = EXCLUDED.user_id,
+            title = EXCLUDED.title,
+            body = EXCLUDED.body,
+            code = EXCLUDED.code,
+            updated_at = NOW()
+        WHERE (search_documents.user_id, search_documents.title, search_documents.body, search_documents.code)
+            IS DISTINCT FROM (EXCLUDED.user_id, EXCLUDED.title, EXCLUDED.body, EXCLUDED.code);
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+-- Cells become documents keyed by cell id; markdown is prose, code cells are code
+CREATE OR REPLACE FUNCTION notebook_search_documents(cells JSONB)
+RETURNS JSONB AS $$
+    SELECT coalesce(jsonb_agg(jsonb_build_object(
+        'ref', coalesce(cell->>'id', (idx - 1)::text),
+        'body', CASE WHEN cell->>'type' = 'markdown' THEN cell->>'content' ELSE '' END,
+        'code', CASE WHEN cell->>'type' = 'markdown' THEN '' ELSE cell->>'content' END
+    )), '[]'::jsonb)
+    FROM jsonb_array_elements(CASE WHEN jsonb_typeof(cells) = 'array' THEN cells ELSE '[]'::jsonb END)
+        WITH ORDINALITY AS t(cell, idx)
+    WHERE coalesce(cell->>'content', '') <> '';
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Steps become documents keyed by their index in the plan
+CREATE OR REPLACE FUNCTION agent_step_search_documents(steps JSONB)
+RETURNS JSONB AS $$
+    SELECT coalesce(jsonb_agg(jsonb_build_object(
+        'ref', (idx - 1)::text,
+        'title', step->>'title',
+        'body', step->>'description',
+        'code', step->>'code'
+    )), '[]'::jsonb)
+    FROM jsonb_array_elements(CASE WHEN jsonb_typeof(steps) = 'array' THEN steps ELSE '[]'::jsonb END)
+        WITH ORDINALITY AS t(step, idx);
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION index_project_search()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM sync_search_documents(NEW.id, 'project', jsonb_build_array(jsonb_build_object(
+        'ref', '', 'title', NEW.title, 'body', NEW.description
+    )));
+    -- Child documents carry the owner for filtering
+    IF TG_OP = 'UPDATE' AND NEW.user_id IS DISTINCT FROM OLD.user_id THEN
+        UPDATE search_documents SET user_id = NEW.user_id WHERE project_id = NEW.id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+CREATE OR REPLACE FUNCTION index_notebook_search()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM sync_search_documents(NEW.project_id, 'cell', notebook_search_documents(NEW.cells));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+CREATE OR REPLACE FUNCTION index_agent_session_search()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM sync_search_documents(NEW.project_id, 'step', agent_step_search_documents(NEW.steps));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+-- Project rows cascade; deleted notebooks and sessions take their documents with them
+CREATE OR REPLACE FUNCTION unindex_project_children_search()
+RETURNS TRIGGER AS $$
+BEGIN
+    DELETE FROM search_documents
+    WHERE project_id = OLD.project_id
+      AND kind = CASE WHEN TG_TABLE_NAME = 'notebooks' THEN 'cell' ELSE 'step' END;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+-- The definer functions bypass RLS; only the triggers (which run as the owner)
+-- and the service role may call them
+REVOKE ALL ON FUNCTION sync_search_documents(UUID, TEXT, JSONB) FROM PUBLIC, anon, authenticated;
+REVOKE ALL ON FUNCTION index_project_search() FROM PUBLIC, anon, authenticated;
+REVOKE ALL ON FUNCTION index_notebook_search() FROM PUBLIC, anon, authenticated;
+REVOKE ALL ON FUNCTION index_agent_session_search() FROM PUBLIC, anon, authenticated;
+REVOKE ALL ON FUNCTION unindex_project_children_search() FROM PUBLIC, anon, authenticated;
+
+-- Create triggers
+CREATE TRIGGER index_projects_search AFTER INSERT OR UPDATE OF title, description, user_id ON projects
+    FOR EACH ROW EXECUTE FUNCTION index_project_search();
+
+CREATE TRIGGER index_notebooks_search AFTER INSERT OR UPDATE OF cells ON notebooks
+    FOR EACH ROW EXECUTE FUNCTION index_notebook_search();
+
+CREATE TRIGGER index_agent_sessions_search AFTER INSERT OR UPDATE OF steps ON agent_sessions
+    FOR EACH ROW EXECUTE FUNCTION index_agent_session_search();
+
+CREATE TRIGGER unindex_notebooks_search AFTER DELETE ON notebooks
+    FOR EACH ROW EXECUTE FUNCTION unindex_project_children_search();
+
+CREATE TRIGGER unindex_agent_sessions_search AFTER DELETE ON agent_sessions
+    FOR EACH ROW EXECUTE FUNCTION unindex_project_children_search();
+
+-- Ranked, paginated search with <mark> highlights, newest first among equal ranks.
+-- Headlines are only built for the returned page
+CREATE OR REPLACE FUNCTION search_workspace(
+    p_user_id UUID,
+    p_query TEXT,
+    p_kinds TEXT[] DEFAULT NULL,
+    p_limit INT DEFAULT 20,
+    p_offset INT DEFAULT 0
+)
+RETURNS TABLE (
+    project_id UUID,
+    project_title TEXT,
+    kind TEXT,
+    ref TEXT,
+    title TEXT,
+    title_highlight TEXT,
+    snippet TEXT,
+    rank REAL,
+    total_count BIGINT
+) AS $$
+    WITH query AS (
+        SELECT websearch_to_tsquery('english', p_query) || websearch_to_tsquery('simple', p_query) AS q
+    ),
+    matches AS (
+        SELECT d.project_id, d.kind, d.ref, d.title, d.body, d.code, d.updated_at,
+               ts_rank_cd(d.search_vector, query.q) AS rank,
+               count(*) OVER () AS total_count
+        FROM search_documents d, query
+        WHERE d.user_id = p_user_id
+          AND d.search_vector @@ query.q
+          AND (p_kinds IS NULL OR d.kind = ANY (p_kinds))
+        ORDER BY rank DESC, d.updated_at DESC, d.project_id, d.kind, d.ref
+        LIMIT p_limit OFFSET p_offset
+    )
+    SELECT m.project_id, p.title, m.kind, m.ref, m.title,
+           ts_headline('english', m.title, query.q, 'HighlightAll=true, StartSel=<mark>, StopSel=</mark>'),
+           ts_headline(
+               'english',
+               concat_ws(E'\n', nullif(m.body, ''), nullif(m.code, '')),
+               query.q,
+               'StartSel=<mark>, StopSel=</mark>, MaxWords=30, MinWords=10, MaxFragments=2, FragmentDelimiter=" … "'
+           ),
+           m.rank, m.total_count
+    FROM matches m
+    JOIN projects p ON p.id = m.project_id
+    CROSS JOIN query
+    ORDER BY m.rank DESC, m.updated_at DESC, m.project_id, m.kind, m.ref;
+$$ LANGUAGE sql STABLE;
+
+-- Index existing rows
+SELECT sync_search_documents(id, 'project', jsonb_build_array(jsonb_build_object(
+    'ref', '', 'title', title, 'body', description
+)))
+FROM projects;
+
+SELECT sync_search_documents(project_id, 'cell', notebook_search_documents(cells))
+FROM notebooks;
+
+SELECT sync_search_documents(project_id, 'step', agent_step_search_documents(steps))
+FROM agent_sessions;
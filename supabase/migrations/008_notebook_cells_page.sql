@@ -0,0 +1,27 @@
+-- Read a notebook's cells a page at a time
+-- Exports stream notebooks cell by cell; this keeps the backend from loading the
+-- whole cells array (with every output) into memory at once.
+--
+-- jsonb_array_elements de-TOASTs the cells value once per call; indexing it
+-- with cells -> i would fetch the whole value again for every cell. A page
+-- still reads the whole array, so paging through a notebook costs one full
+-- read per page: PostgREST cannot hold a cursor open between requests. The
+-- direct Postgres repository streams all cells through a single cursor
+-- instead (PostgresRepository.iter_notebook_cells).
+
+CREATE OR REPLACE FUNCTION notebook_cells_page(
+    p_project_id UUID,
+    p_offset INT DEFAULT 0,
+    p_limit INT DEFAULT 100
+)
+RETURNS TABLE (cell JSONB) AS $$
+    SELECT t.cell
+    FROM notebooks n,
+         jsonb_array_elements(
+             CASE WHEN jsonb_typeof(n.cells) = 'array' THEN n.cells ELSE '[]'::jsonb END
+         ) WITH ORDINALITY AS t(cell, idx)
+    WHERE n.project_id = p_project_id
+    ORDER BY t.idx
+    OFFSET greatest(p_offset, 0)
+    LIMIT greatest(p_limit, 0);
+$$ LANGUAGE sql STABLE;